@@ -0,0 +1,108 @@
+"""
+Content-addressed on-disk cache for audio analysis results.
+
+Entries are `.npz` files named after a hash of the audio bytes and the analysis
+parameters, so re-uploading a song or regenerating it at another difficulty reuses
+the beats, onsets and onset envelope without decoding the audio again. Entries are
+evicted least-recently-used first once the cache grows past `MAX_CACHE_BYTES`.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "analysis")
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+_CHUNK_SIZE = 1 << 20
+
+
+def content_hash(path: str) -> str:
+    """sha256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(audio_path: str, audio_hash: Optional[str] = None, **params) -> str:
+    """
+    Key for the analysis of `audio_path` under the given analysis parameters. Pass the
+    file's `content_hash` as `audio_hash` when it is already known, to skip rehashing.
+    """
+    digest = hashlib.sha256((audio_hash or content_hash(audio_path)).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _entry_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{key}.npz")
+
+
+def load(key: str, cache_dir: str = CACHE_DIR) -> Optional[Dict[str, Any]]:
+    """Return the cached fields for `key`, or None on a miss or unreadable entry."""
+    path = _entry_path(key, cache_dir)
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            fields = {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Discarding unreadable analysis cache entry {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # Bump the modification time so eviction treats the entry as recently used.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return {name: value.item() if value.ndim == 0 else value for name, value in fields.items()}
+
+
+def store(key: str, fields: Dict[str, Any], cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+    """Write `fields` (arrays and scalars) under `key`, then evict old entries if over budget."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(key, cache_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **{name: np.asarray(value) for name, value in fields.items()})
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write analysis cache entry {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, suffix: str = ".npz") -> int:
+    """Remove least-recently-used entries until the cache fits in `max_bytes`. Returns entries removed."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
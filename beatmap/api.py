@@ -1,8 +1,10 @@
+import hashlib
 import json
 import time
 import asyncio
 import os
-from game_state import start_new_game, process_hit as process_hit_state
+from dataclasses import replace
+from game_state import GameState, start_new_game, process_hit as process_hit_state, load_new_segments as load_new_segments_state
 from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from midi import (
@@ -15,11 +17,16 @@ from models import (
     FallingDot,
     Song
 )
-import numpy as np
 from score import calculate_score
 from serial_handler import SerialHandler
 from redis_client import add_score, get_leaderboard
+from compiled_beatmap import compile_beatmap, compile_catalog, compiled_path_for
+from catalog import append_entries, remove_entries, update_entry
+from progressive import ProgressiveJob
+from profiling import PROFILE_DIR, PROFILE_LOG
+from warmup import configure_numba_cache, warm_up
 import signal
+from typing import Optional
 
 app = FastAPI()
 
@@ -54,14 +61,28 @@ GAME_STATE = {
     "total_score": 0,
     "current_streak": 0,
     "max_streak": 0,
-    "session": None
+    "session": None,
+    "beatmap_job": None,        # Progressive job still charting the current beatmap
+    "segments_loaded": 0        # Segments of that job already queued in the session
 }
 
 serial_handler = SerialHandler()
+warmup_task = None
+
+
+def background_warmup():
+    """Compile catalog beatmaps and prime the beatmap generation stack off the request path."""
+    compiled = compile_catalog()
+    print(f"Compiled {compiled} catalog beatmaps")
+    warm_up()
+
 
 @app.on_event("startup")
 async def startup_event():
+    global warmup_task
     serial_handler.start()
+    configure_numba_cache()
+    warmup_task = asyncio.create_task(asyncio.to_thread(background_warmup))
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -122,9 +143,25 @@ async def start_game(id: int = 0):
         "midiPath": state.midi_path,
         "songName": state.song_name,
         "bpm": state.bpm,
-        "difficulty": state.difficulty
+        "difficulty": state.difficulty,
+        "charting": state.beatmap_job is not None
     }
 
+async def load_new_segments(websocket: WebSocket):
+    """Helper function to queue beatmap segments charted since the last check and send their falling dots"""
+    state = replace(
+        GameState(),
+        session=GAME_STATE["session"],
+        beatmap_job=GAME_STATE["beatmap_job"],
+        segments_loaded=GAME_STATE["segments_loaded"],
+        game_duration=GAME_STATE["game_duration"]
+    )
+    state, messages = load_new_segments_state(state)
+    for field in ("beatmap_job", "segments_loaded", "game_duration"):
+        GAME_STATE[field] = getattr(state, field)
+    for message in messages:
+        await websocket.send_json(message)
+
 async def process_hit(websocket: WebSocket, move: str, current_time: float):
     """Helper function to process a hit (from keyboard or serial)"""
     if not GAME_STATE["session"]:
@@ -203,6 +240,10 @@ async def game_status_checker(websocket: WebSocket):
             
         current_time = time.perf_counter() - GAME_STATE["start_time"] - GAME_STATE["total_paused_time"]
         
+        # Queue newly charted segments of a beatmap that is still being generated
+        if GAME_STATE["beatmap_job"] is not None:
+            await load_new_segments(websocket)
+        
         # Log remaining notes
         remaining_notes = GAME_STATE["session"].get_remaining_notes()
         
@@ -237,7 +278,7 @@ async def game_status_checker(websocket: WebSocket):
                     })
         
         # Check if all notes are completed
-        if remaining_notes == 0 and GAME_STATE["is_running"]:
+        if remaining_notes == 0 and GAME_STATE["is_running"] and GAME_STATE["beatmap_job"] is None:
             print(f"All notes completed at time {current_time:.2f}")
             await handle_game_over(websocket, current_time)
             break
@@ -347,107 +388,177 @@ async def upload_video_segment(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Beatmap generation jobs currently running; used as the queue depth when picking an analysis tier
+ACTIVE_BEATMAP_JOBS = 0
+
+# Background tasks charting and finishing progressive beatmaps, referenced so they are not garbage collected
+PROGRESSIVE_TASKS = set()
+
+def remove_beatmap_files(mp3_path: str, midi_paths):
+    try:
+        if os.path.exists(mp3_path):
+            os.remove(mp3_path)
+        for midi_path in midi_paths:
+            if os.path.exists(midi_path):
+                os.remove(midi_path)
+            if os.path.exists(compiled_path_for(midi_path)):
+                os.remove(compiled_path_for(midi_path))
+    except:
+        pass
+
+async def finish_progressive_beatmap(job: ProgressiveJob, entry_id: int):
+    """
+    Wait for the rest of a progressive beatmap, then compile it and record the whole song's
+    tempo, or drop its catalog entry if it failed.
+    """
+    try:
+        await asyncio.to_thread(job.done.wait)
+        if job.error is not None:
+            raise job.error
+        compile_beatmap(job.midi_path)
+        update_entry(entry_id, {"bpm": to_int_bpm(job.bpm)})
+    except Exception as e:
+        print(f"Error finishing progressive beatmap: {e}")
+        remove_entries([entry_id])
+        remove_beatmap_files(job.audio_path, [job.midi_path])
+
+async def start_progressive_beatmap(mp3_path: str, song: str, midi_path: str, path: str,
+                                    song_name: str, difficulty: int, tier: Optional[str],
+                                    audio_hash: Optional[str] = None):
+    """Start charting in the background and return the catalog entry once the first segment is playable."""
+    job = ProgressiveJob(mp3_path, midi_path, difficulty, tier=tier, audio_hash=audio_hash)
+    run_task = asyncio.create_task(asyncio.to_thread(job.run))
+    PROGRESSIVE_TASKS.add(run_task)
+    run_task.add_done_callback(PROGRESSIVE_TASKS.discard)
+    if not await asyncio.to_thread(job.wait_for_first_segment):
+        raise job.error or RuntimeError("No beatmap segment was charted")
+    
+    new_entries = append_entries([{
+        "name": song_name,
+        "path": path,
+        "song": song,
+        "bpm": to_int_bpm(job.bpm),
+        "difficulty": difficulty,
+        "tier": job.tier
+    }])
+    task = asyncio.create_task(finish_progressive_beatmap(job, new_entries[0]["id"]))
+    PROGRESSIVE_TASKS.add(task)
+    task.add_done_callback(PROGRESSIVE_TASKS.discard)
+    
+    return {
+        "status": "success",
+        "song": new_entries[0],
+        "songs": new_entries,
+        "progressive": True
+    }
+
+def to_int_bpm(bpm) -> int:
+    """Convert the tempo returned by beatmap generation (int, float or numpy scalar) to an int BPM."""
+    try:
+        return int(float(bpm))
+    except (TypeError, ValueError):
+        return DEFAULT_BPM
+
 @app.post("/beatmap/create")
 async def create_beatmap(
     difficulty: int,
     audio: UploadFile = File(...),
+    all_difficulties: bool = False,
+    tier: Optional[str] = None,
+    time_budget: Optional[float] = None,
+    progressive: bool = False,
+    profile: bool = False,
 ):
     """
     Creates a beatmap from an uploaded MP3 file.
     Difficulty (1-5) is converted to appropriate number of notes based on song duration.
+    With all_difficulties, every difficulty is charted from a single analysis of the song
+    and added to the catalog; "song" is still the entry for the requested difficulty.
+    The analysis tier ("fast", "standard" or "quality") is chosen from the song length,
+    the number of jobs already running and time_budget (seconds) unless given explicitly.
+    With progressive, the song is charted in time windows and the request returns as soon
+    as the first one is done; the game loads the remaining segments as they are charted.
+    Per-stage timings are returned and appended to the profile log; with profile, the
+    peak RSS of each stage (process-wide, so concurrent jobs show up too) and a cProfile
+    dump are recorded as well.
     Returns the generated MIDI file path and other metadata.
     """
+    global ACTIVE_BEATMAP_JOBS
+    from make_beatmap import ANALYSIS_TIERS, TIME_BUDGET_SECONDS
+    if tier is not None and tier not in ANALYSIS_TIERS:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown analysis tier {tier!r}, expected one of {', '.join(ANALYSIS_TIERS)}"
+        )
+    if progressive and all_difficulties:
+        raise HTTPException(status_code=400, detail="Progressive generation charts a single difficulty")
+    
     os.makedirs("../frontend/public/uploads", exist_ok=True)
     
     timestamp = int(time.time())
     mp3_filename = f"upload_{timestamp}.mp3"
-    midi_filename = f"upload_{timestamp}.mid"
-    
     mp3_path = f"../frontend/public/uploads/{mp3_filename}"
-    midi_path = f"../frontend/public/uploads/{midi_filename}"
+
+    from make_beatmap import DIFFICULTIES, difficulty_output_path
+    midi_filenames = (
+        {d: difficulty_output_path(f"upload_{timestamp}.mid", d) for d in DIFFICULTIES}
+        if all_difficulties else {difficulty: f"upload_{timestamp}.mid"}
+    )
+    midi_paths = {d: f"../frontend/public/uploads/{name}" for d, name in midi_filenames.items()}
     
     try:
         content = await audio.read()
         with open(mp3_path, "wb") as f:
             f.write(content)
-            
-        from make_beatmap import process_audio_to_midi
-        bpm = process_audio_to_midi(mp3_path, midi_path, difficulty)
+        # Hashed once here for every cache lookup of the job (analysis_cache.content_hash of the file)
+        audio_hash = hashlib.sha256(content).hexdigest()
         
         song_name = audio.filename.rsplit('.', 1)[0] if audio.filename else f"Custom Song {timestamp}"
         
-        catalog = []
-        try:
-            with open("catalog.json", "r") as f:
-                content = f.read().strip()
-                if content and content[-1] == ']':
-                    try:
-                        catalog = json.loads(content)
-                    except json.JSONDecodeError:
-                        catalog = [
-                            {
-                                "id": 0,
-                                "name": "The Cha Cha Slide (Easy)",
-                                "path": "songmaps/chacha.mid",
-                                "song": "songs/chacha.mp3",
-                                "bpm": 122,
-                                "difficulty": 2
-                            }
-                        ]
-        except FileNotFoundError:
-            catalog = [
-                {
-                    "id": 0,
-                    "name": "The Cha Cha Slide (Easy)",
-                    "path": "songmaps/chacha.mid",
-                    "song": "songs/chacha.mp3",
-                    "bpm": 122,
-                    "difficulty": 2
-                }
-            ]
+        if progressive:
+            return await start_progressive_beatmap(
+                mp3_path, f"/uploads/{mp3_filename}", midi_paths[difficulty],
+                f"/uploads/{midi_filenames[difficulty]}", song_name, difficulty, tier, audio_hash=audio_hash
+            )
             
-        max_id = 0
-        for entry in catalog:
-            if isinstance(entry, dict) and 'id' in entry:
-                max_id = max(max_id, entry['id'])
-        
-        new_entry = {
-            "id": max_id + 1,
-            "name": song_name,
-            "path": f"/uploads/{midi_filename}",
-            "song": f"/uploads/{mp3_filename}",
-            "bpm": int(float(bpm)) if isinstance(bpm, (int, float, np.ndarray)) else DEFAULT_BPM,
-            "difficulty": difficulty
-        }
-        
-        
-        # Remove any incomplete entries
-        catalog = [entry for entry in catalog if isinstance(entry, dict) and all(
-            key in entry for key in ['id', 'name', 'path', 'song', 'bpm', 'difficulty']
-        )]
-        
-        catalog.append(new_entry)
-        
-        # Write the updated catalog with proper formatting
-        # Use a temporary file to ensure atomic write
-        temp_path = "catalog.json.tmp"
-        with open(temp_path, "w") as f:
-            json.dump(catalog, f, indent=4)
+        from make_beatmap import process_audio_to_midis
+        queue_depth = ACTIVE_BEATMAP_JOBS
+        ACTIVE_BEATMAP_JOBS += 1
+        try:
+            report = await asyncio.to_thread(
+                process_audio_to_midis, mp3_path, midi_paths, tier=tier, queue_depth=queue_depth,
+                time_budget=time_budget if time_budget is not None else TIME_BUDGET_SECONDS,
+                profile=profile, log_path=PROFILE_LOG, audio_hash=audio_hash,
+                cprofile_path=os.path.join(PROFILE_DIR, f"upload_{timestamp}.prof") if profile else None
+            )
+        finally:
+            ACTIVE_BEATMAP_JOBS -= 1
+        for midi_path in midi_paths.values():
+            compile_beatmap(midi_path)
         
-        os.replace(temp_path, "catalog.json")
+        new_entries = append_entries([
+            {
+                "name": song_name,
+                "path": f"/uploads/{midi_filename}",
+                "song": f"/uploads/{mp3_filename}",
+                "bpm": to_int_bpm(report.bpm),
+                "difficulty": d,
+                "tier": report.tier,
+                "timings": report.timings
+            }
+            for d, midi_filename in sorted(midi_filenames.items())
+        ])
+        new_entry = next(
+            (entry for entry in new_entries if entry["difficulty"] == difficulty), new_entries[0]
+        )
             
         return {
             "status": "success",
-            "song": new_entry
+            "song": new_entry,
+            "songs": new_entries,
+            "profile": report.model_dump()
         }
         
     except Exception as e:
-        try:
-            if os.path.exists(mp3_path):
-                os.remove(mp3_path)
-            if os.path.exists(midi_path):
-                os.remove(midi_path)
-        except:
-            pass
+        remove_beatmap_files(mp3_path, midi_paths.values())
         print(f"Error creating beatmap: {e}")
         raise HTTPException(status_code=500, detail=str(e))
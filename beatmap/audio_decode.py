@@ -0,0 +1,101 @@
+"""
+Audio decoding with a memory-mapped PCM cache.
+
+Files are decoded with `librosa.load`, which already reads what libsndfile can
+(wav, flac, ogg and, with libsndfile 1.1+, mp3) through soundfile, falls back to
+audioread for the rest (e.g. m4a) and resamples with soxr. What this module adds
+is the cache: decoded PCM is stored as `.npy` files named after the audio's
+content hash and the sample rate and opened memory-mapped, so analysing the same
+song again never decodes it: its pages are read from the page cache as the
+analysis touches them. Every function taking `audio_hash` hashes the file itself
+when it is not given; a job touching the cache more than once hashes it up front
+and passes it along.
+"""
+import os
+from typing import Optional, Tuple
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+import analysis_cache
+
+PCM_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pcm")
+MAX_PCM_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def seekable(path: str) -> bool:
+    """Whether libsndfile can read `path`, so a window of it decodes without decoding what precedes it."""
+    try:
+        sf.info(path)
+        return True
+    except RuntimeError:
+        return False
+
+
+def _pcm_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{key}.npy")
+
+
+def pcm_key(path: str, sr: int, audio_hash: Optional[str] = None) -> str:
+    return analysis_cache.cache_key(path, audio_hash=audio_hash, kind="pcm", sr=sr)
+
+
+def cached_pcm(path: str, sr: int, cache_dir: str = PCM_CACHE_DIR,
+               audio_hash: Optional[str] = None) -> Optional[np.ndarray]:
+    """The cached samples of `path` at `sr`, memory-mapped read-only, or None if not cached."""
+    pcm_path = _pcm_path(pcm_key(path, sr, audio_hash), cache_dir)
+    try:
+        y = np.load(pcm_path, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Discarding unreadable PCM cache entry {pcm_path}: {e}")
+        try:
+            os.remove(pcm_path)
+        except OSError:
+            pass
+        return None
+
+    # Bump the modification time so eviction treats the entry as recently used.
+    try:
+        os.utime(pcm_path)
+    except OSError:
+        pass
+    return y
+
+
+def store_pcm(path: str, sr: int, y: np.ndarray, cache_dir: str = PCM_CACHE_DIR,
+              max_bytes: int = MAX_PCM_CACHE_BYTES, audio_hash: Optional[str] = None):
+    """Write decoded samples of `path` at `sr`, then evict old entries if over budget."""
+    os.makedirs(cache_dir, exist_ok=True)
+    pcm_path = _pcm_path(pcm_key(path, sr, audio_hash), cache_dir)
+    tmp_path = f"{pcm_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(y, dtype=np.float32))
+        os.replace(tmp_path, pcm_path)
+    except OSError as e:
+        print(f"Could not write PCM cache entry {pcm_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    analysis_cache.evict(cache_dir, max_bytes, suffix=".npy")
+
+
+def load_audio(path: str, sr: int, use_cache: bool = True, audio_hash: Optional[str] = None) -> Tuple[np.ndarray, int]:
+    """
+    Mono samples of `path` at `sr`, decoded by `librosa.load(path, sr=sr)` unless
+    cached. Cached samples are returned memory-mapped and read-only.
+    """
+    if use_cache:
+        audio_hash = audio_hash or analysis_cache.content_hash(path)
+        y = cached_pcm(path, sr, audio_hash=audio_hash)
+        if y is not None:
+            return y, sr
+
+    y, sr = librosa.load(path, sr=sr, mono=True)
+
+    if use_cache:
+        store_pcm(path, sr, y, audio_hash=audio_hash)
+    return y, sr
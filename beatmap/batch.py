@@ -0,0 +1,221 @@
+"""
+Batch beatmap generation for a whole music library.
+
+Charts every audio file found in the given directories (searched recursively),
+manifests (text files listing one audio path per line) or plain file arguments
+across a pool of worker processes. Each song is copied into the frontend's
+library folder under a name derived from its content hash, charted at every
+requested difficulty from a single analysis and compiled. Runs are resumable:
+songs whose compiled beatmaps are already up to date are skipped, and analyses
+are reused from the analysis cache. New catalog entries are written in a single
+atomic update at the end. Exits with code 1 if any song failed.
+
+Usage: python batch.py SOURCE [SOURCE ...] [--workers N] [--difficulty all|1-5 ...] [--tier standard]
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from analysis_cache import content_hash
+from catalog import CATALOG_PATH, append_entries, read_catalog
+from compiled_beatmap import compile_beatmap, compiled_path_for, is_stale, open_compiled
+from warmup import configure_numba_cache, warm_up
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+PUBLIC_DIR = "../frontend/public"
+LIBRARY_DIR = "library"
+
+
+@dataclass
+class ChartResult:
+    audio_path: str
+    name: str = ""
+    song: str = ""  # frontend path of the copied audio
+    paths: Dict[int, str] = field(default_factory=dict)  # difficulty -> frontend path of the MIDI file
+    bpm: int = 0
+    tier: Optional[str] = None
+    duration: float = 0.0  # seconds of audio
+    seconds: float = 0.0  # wall time spent on the song
+    skipped: bool = False
+    error: Optional[str] = None
+
+
+def collect_sources(sources: List[str]) -> List[str]:
+    """Audio files named by `sources`, in order and without duplicates."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                paths.extend(
+                    os.path.join(root, name) for name in sorted(files)
+                    if name.lower().endswith(AUDIO_EXTENSIONS)
+                )
+        elif source.lower().endswith(AUDIO_EXTENSIONS):
+            paths.append(source)
+        else:
+            # Manifest: one audio path per line, relative to the manifest, '#' starts a comment
+            base = os.path.dirname(source)
+            with open(source, "r") as f:
+                for line in f:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        paths.append(os.path.join(base, line))
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+
+def library_name(audio_path: str, digest: str) -> str:
+    """File name stem for a song in the library: its name made path-safe plus a content hash prefix."""
+    stem = re.sub(r"[^A-Za-z0-9_-]+", "_", os.path.splitext(os.path.basename(audio_path))[0]).strip("_")
+    return f"{stem or 'song'}_{digest[:8]}"
+
+
+def midi_bpm(midi_path: str) -> int:
+    """The BPM written into a generated MIDI file's tempo message."""
+    from mido import MidiFile, tempo2bpm
+
+    for msg in MidiFile(midi_path).tracks[0]:
+        if msg.type == "set_tempo":
+            return int(round(tempo2bpm(msg.tempo), 6))
+    raise ValueError(f"No tempo in {midi_path}")
+
+
+def is_charted(midi_path: str) -> bool:
+    """Whether `midi_path` was written and compiled completely by an earlier run."""
+    try:
+        return not is_stale(open_compiled(compiled_path_for(midi_path)), midi_path)
+    except Exception:
+        return False
+
+
+def chart_file(audio_path: str, difficulties: List[int], tier: Optional[str], public_dir: str) -> ChartResult:
+    """Worker: copy one song into the library and chart it, unless an earlier run already did."""
+    from make_beatmap import audio_duration, difficulty_output_path, process_audio_to_midis
+
+    start = time.perf_counter()
+    result = ChartResult(audio_path=audio_path)
+    try:
+        audio_hash = content_hash(audio_path)
+        name = library_name(audio_path, audio_hash)
+        library = os.path.join(public_dir, LIBRARY_DIR)
+        os.makedirs(library, exist_ok=True)
+        ext = os.path.splitext(audio_path)[1].lower()
+        song_path = os.path.join(library, f"{name}{ext}")
+        midi_paths = {d: difficulty_output_path(os.path.join(library, f"{name}.mid"), d) for d in difficulties}
+
+        result.name = os.path.splitext(os.path.basename(audio_path))[0]
+        result.song = f"/{LIBRARY_DIR}/{name}{ext}"
+        result.paths = {d: f"/{LIBRARY_DIR}/{os.path.basename(path)}" for d, path in midi_paths.items()}
+        result.duration = audio_duration(audio_path) or 0.0
+
+        if os.path.exists(song_path) and all(is_charted(path) for path in midi_paths.values()):
+            result.skipped = True
+            result.bpm = midi_bpm(next(iter(midi_paths.values())))
+        else:
+            if not os.path.exists(song_path):
+                tmp_path = f"{song_path}.{os.getpid()}.tmp"
+                shutil.copyfile(audio_path, tmp_path)
+                os.replace(tmp_path, song_path)
+            # The library copy has the same content, so its hash carries over
+            report = process_audio_to_midis(song_path, midi_paths, tier=tier, audio_hash=audio_hash)
+            for midi_path in midi_paths.values():
+                compile_beatmap(midi_path)
+            result.bpm = report.bpm
+            result.tier = report.tier
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def catalog_entries(results: List[ChartResult], catalog: List[Dict]) -> List[Dict]:
+    """Catalog entries for charted songs, leaving out beatmaps the catalog already lists."""
+    listed = {entry["path"] for entry in catalog}
+    entries = []
+    for result in results:
+        if result.error is not None:
+            continue
+        for difficulty, path in sorted(result.paths.items()):
+            if path in listed:
+                continue
+            entry = {
+                "name": result.name,
+                "path": path,
+                "song": result.song,
+                "bpm": result.bpm,
+                "difficulty": difficulty,
+            }
+            if result.tier is not None:
+                entry["tier"] = result.tier
+            entries.append(entry)
+    return entries
+
+
+def report_line(result: ChartResult) -> str:
+    if result.error is not None:
+        return f"FAILED   {result.audio_path}: {result.error}"
+    if result.skipped:
+        return f"skipped  {result.audio_path} (already charted)"
+    speed = result.duration / result.seconds if result.seconds > 0 else 0.0
+    return (f"charted  {result.audio_path}  {result.duration:7.1f} s audio in {result.seconds:6.2f} s "
+            f"({speed:5.1f}x realtime, {result.tier})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chart a music library into beatmaps")
+    parser.add_argument("sources", nargs="+", help="audio files, directories or manifests listing audio paths")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--difficulty", nargs="+", default=["all"],
+                        help="difficulties to chart (1-5), or 'all'")
+    parser.add_argument("--tier", default="standard", help="analysis tier, or 'auto' to pick by song length")
+    parser.add_argument("--public-dir", default=PUBLIC_DIR, help="frontend public folder songs are copied into")
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    args = parser.parse_args()
+
+    from make_beatmap import ANALYSIS_TIERS, DIFFICULTIES
+    difficulties = list(DIFFICULTIES) if "all" in args.difficulty else sorted({int(d) for d in args.difficulty})
+    tier = None if args.tier == "auto" else args.tier
+    if tier is not None and tier not in ANALYSIS_TIERS:
+        parser.error(f"unknown tier {tier!r}, expected one of {', '.join(ANALYSIS_TIERS)} or auto")
+
+    audio_paths = collect_sources(args.sources)
+    print(f"Charting {len(audio_paths)} songs at difficulties {difficulties} with {args.workers} workers")
+
+    # Compile numba's functions once here so the workers load them from the cache instead of each compiling them
+    configure_numba_cache()
+    warm_up()
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=configure_numba_cache) as pool:
+        futures = [
+            pool.submit(chart_file, path, difficulties, tier, args.public_dir) for path in audio_paths
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{len(results)}/{len(futures)}] {report_line(result)}")
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda result: audio_paths.index(result.audio_path))
+    added = append_entries(catalog_entries(results, read_catalog(args.catalog)), args.catalog)
+
+    charted = [result for result in results if result.error is None and not result.skipped]
+    skipped = sum(result.skipped for result in results)
+    failed = [result for result in results if result.error is not None]
+    audio_seconds = sum(result.duration for result in charted)
+    print(f"\n{len(charted)} charted, {skipped} skipped, {len(failed)} failed in {elapsed:.1f} s; "
+          f"{len(added)} catalog entries added")
+    if charted and elapsed > 0:
+        print(f"Throughput: {len(charted) * 3600 / elapsed:.0f} songs/hour, "
+              f"{audio_seconds / elapsed:.1f}x realtime across {args.workers} workers")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark for the audio analysis stage of beatmap generation.
+
+Runs `make_beatmap.analyze_signal` (one shared spectrogram) next to the original
+implementation, which called `beat_track`, `onset_detect` and `onset_strength` on the
+raw signal separately, on synthetic click tracks. Prints timings and exits with
+code 1 if the beats, onsets, tempo or onset envelope differ.
+
+With --stream FILE..., compares streaming and in-memory analysis of audio files
+instead: peak traced memory, tempo and the share of beats/onsets that agree within
+one analysis frame. Exits with code 1 if the tempo differs by more than
+STREAM_TEMPO_TOLERANCE or either agreement is below STREAM_MIN_AGREEMENT; the
+envelopes only differ in the dB floor (see stream_analysis.py), so the beats and
+onsets should all but coincide.
+
+Usage: python bench_analysis.py [--seconds 30 120 600] [--stream song.wav ...]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+
+import make_beatmap
+from warmup import click_track, configure_numba_cache
+
+STREAM_TEMPO_TOLERANCE = 0.01  # relative
+STREAM_MIN_AGREEMENT = 0.97
+
+
+def reference_analyze_signal(y, sr):
+    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+    if isinstance(tempo, np.ndarray):
+        tempo = float(tempo[0])
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+
+    onset_frames = librosa.onset.onset_detect(y=y, sr=sr)
+    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
+    onset_strengths = librosa.onset.onset_strength(y=y, sr=sr)
+    return tempo, beat_times, onset_frames, onset_times, onset_strengths
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def traced(fn, *args, **kwargs):
+    """Run `fn`, returning its result, wall time and peak memory traced by tracemalloc."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def agreement(times, reference, tolerance):
+    """Share of `times` that have a `reference` time within `tolerance` seconds."""
+    if len(times) == 0 or len(reference) == 0:
+        return float(len(times) == len(reference))
+    return float(np.mean(make_beatmap.nearest_distance(times, reference) <= tolerance))
+
+
+def compare_streaming(paths):
+    """Whether streaming analysis of every file agrees with the in-memory one."""
+    tolerance = make_beatmap.HOP_LENGTH / make_beatmap.ANALYSIS_SR
+    ok = True
+    for path in paths:
+        memory, memory_time, memory_peak = traced(
+            make_beatmap.load_and_analyze_audio, path, use_cache=False, streaming=False
+        )
+        stream, stream_time, stream_peak = traced(
+            make_beatmap.load_and_analyze_audio, path, use_cache=False, streaming=True
+        )
+        agreements = [
+            agreement(stream.beat_times, memory.beat_times, tolerance),
+            agreement(memory.beat_times, stream.beat_times, tolerance),
+            agreement(stream.onset_times, memory.onset_times, tolerance),
+            agreement(memory.onset_times, stream.onset_times, tolerance),
+        ]
+        same = (abs(stream.tempo - memory.tempo) <= STREAM_TEMPO_TOLERANCE * memory.tempo
+                and min(agreements) >= STREAM_MIN_AGREEMENT)
+        ok &= same
+        print(f"{path}: {memory.duration:.1f} s")
+        print(f"  in-memory {memory_time:6.2f} s  peak {memory_peak / 1e6:7.1f} MB  tempo {memory.tempo:.2f}")
+        print(f"  streaming {stream_time:6.2f} s  peak {stream_peak / 1e6:7.1f} MB  tempo {stream.tempo:.2f}  "
+              f"beats {agreements[0]:.3f}/{agreements[1]:.3f}  onsets {agreements[2]:.3f}/{agreements[3]:.3f}  "
+              f"{'OK' if same else 'MISMATCH'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark audio analysis")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[30, 120, 600])
+    parser.add_argument("--stream", nargs="+", metavar="FILE", help="compare streaming and in-memory analysis")
+    args = parser.parse_args()
+
+    configure_numba_cache()
+    sr = make_beatmap.ANALYSIS_SR
+    # Compile numba kernels before timing anything.
+    make_beatmap.analyze_signal(click_track(sr, 4.0), sr)
+    reference_analyze_signal(click_track(sr, 4.0), sr)
+
+    if args.stream:
+        sys.exit(0 if compare_streaming(args.stream) else 1)
+
+    ok = True
+    for seconds in args.seconds:
+        y = click_track(sr, seconds)
+        analysis, fast = timed(make_beatmap.analyze_signal, y, sr)
+        (tempo, beat_times, onset_frames, onset_times, onset_strengths), slow = timed(reference_analyze_signal, y, sr)
+        same = (
+            np.isclose(analysis.tempo, tempo)
+            and np.array_equal(analysis.beat_times, beat_times)
+            and np.array_equal(analysis.onset_frames, onset_frames)
+            and np.array_equal(analysis.onset_times, onset_times)
+            and np.allclose(analysis.onset_strengths, onset_strengths)
+        )
+        ok &= bool(same)
+        print(f"{seconds:7.1f} s  analyze_signal {fast * 1000:9.1f} ms  reference {slow * 1000:9.1f} ms  "
+              f"x{slow / fast:5.2f}  {'OK' if same else 'MISMATCH'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Equivalence check and timing benchmark for beatmap event generation and downsampling.
+
+Builds synthetic beat/onset tracks of increasing length, runs the vectorized
+`make_beatmap` functions next to the original per-event loops kept below as the
+reference, asserts the outputs are identical and prints the timings.
+Exits with code 1 on any mismatch.
+
+Usage: python bench_events.py [--minutes 1 5 20] [--skip-reference-above 20]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import make_beatmap
+
+
+# -- Reference implementations (the original per-event loops) ----------------
+
+def reference_generate_initial_events(all_times, beat_times, onset_times, onset_velocity_map, tol):
+    events = []
+    for t in all_times:
+        velocity = 64
+        for onset_time, onset_vel in onset_velocity_map.items():
+            if abs(t - onset_time) < tol:
+                velocity = onset_vel
+                break
+
+        is_beat = np.any(np.isclose(t, beat_times, atol=tol))
+        is_onset = np.any(np.isclose(t, onset_times, atol=tol))
+
+        if is_beat and is_onset:
+            events.append((t, [67, 72], velocity))
+        else:
+            if len(events) % 2 == 0:
+                events.append((t, [67], velocity))
+            else:
+                events.append((t, [72], velocity))
+    return events
+
+
+def reference_calculate_note_importance(event, beat_times, tol, tempo):
+    time, pitches, velocity = event
+
+    is_beat = np.any(np.isclose(time, beat_times, atol=tol))
+
+    beat_position = min([abs(time - beat) for beat in beat_times])
+    beat_alignment = 1.0 - (beat_position / (60.0 / tempo))
+
+    importance = (
+        velocity / 127.0 * 0.4 +
+        (1.5 if is_beat else 0.0) * 0.4 +
+        beat_alignment * 0.2
+    )
+
+    return importance
+
+
+def reference_detect_phrases(events, beat_times):
+    if not events:
+        return []
+
+    phrases = []
+    current_phrase = []
+    last_velocity = events[0][2]
+    velocity_threshold = 20
+
+    for event in events:
+        time, pitches, velocity = event
+
+        is_strong_beat = any(np.isclose(time, beat_times[::2], atol=0.05))
+        velocity_change = abs(velocity - last_velocity) > velocity_threshold
+
+        if (velocity_change and len(current_phrase) > 4) or (is_strong_beat and len(current_phrase) > 8):
+            if current_phrase:
+                phrases.append(current_phrase)
+            current_phrase = []
+
+        current_phrase.append(event)
+        last_velocity = velocity
+
+    if current_phrase:
+        phrases.append(current_phrase)
+
+    return phrases
+
+
+def reference_downsample_events(events, max_notes, beat_times, tol, total_duration, tempo):
+    phrases = reference_detect_phrases(events, beat_times)
+
+    total_events = sum(len(phrase) for phrase in phrases)
+    processed_phrases = []
+
+    for phrase in phrases:
+        phrase_ratio = len(phrase) / total_events
+        target_notes = max(1, int(max_notes * phrase_ratio))
+
+        if len(phrase) > target_notes:
+            importance_scores = [
+                (event, reference_calculate_note_importance(event, beat_times, tol, tempo))
+                for event in phrase
+            ]
+
+            importance_scores.sort(key=lambda x: x[1], reverse=True)
+            phrase = [event for event, _ in importance_scores[:target_notes]]
+
+            phrase.sort(key=lambda x: x[0])
+
+        processed_phrases.extend(phrase)
+
+    return processed_phrases
+
+
+# -- Synthetic tracks ----------------------------------------------------------
+
+def synthetic_track(minutes: float, bpm: float = 128.0, onsets_per_second: float = 4.0, seed: int = 0):
+    """Jittered beats plus random onsets, quantized to librosa's default frame grid."""
+    rng = np.random.default_rng(seed)
+    frame = 512 / 22050
+    duration = minutes * 60.0
+    beat_times = np.arange(0.5, duration, 60.0 / bpm) + rng.normal(0, 0.01, int(np.ceil((duration - 0.5) * bpm / 60.0)))
+    beat_times = np.unique(np.round(np.clip(beat_times, 0, duration) / frame) * frame)
+    onset_times = np.unique(np.round(rng.uniform(0, duration, int(duration * onsets_per_second)) / frame) * frame)
+    onset_velocities = rng.integers(40, 128, len(onset_times))
+    onset_velocity_map = dict(zip(onset_times, onset_velocities))
+    all_times = np.union1d(beat_times, onset_times)
+    tol = (60.0 / bpm) * 0.125
+    return all_times, beat_times, onset_times, onset_velocity_map, tol
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark beatmap event generation")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--skip-reference-above", type=float, default=20,
+                        help="only time the vectorized path for tracks longer than this (minutes)")
+    args = parser.parse_args()
+
+    ok = True
+    for minutes in args.minutes:
+        track = synthetic_track(minutes)
+        events, fast = timed(make_beatmap.generate_initial_events, *track)
+        line = f"{minutes:6.1f} min  {len(track[0]):6d} candidates  generate_initial_events {fast * 1000:8.2f} ms"
+        if minutes <= args.skip_reference_above:
+            expected, slow = timed(reference_generate_initial_events, *track)
+            same = events == expected
+            ok &= same
+            line += f"  reference {slow * 1000:9.2f} ms  x{slow / max(fast, 1e-9):7.1f}  {'OK' if same else 'MISMATCH'}"
+        print(line)
+
+        beat_times, tempo = track[1], 128.0
+        for difficulty in (1, 5):
+            max_notes = make_beatmap.calculate_note_parameters(minutes * 60.0, tempo, difficulty).max_notes
+            downsample_args = (events, max_notes, beat_times, track[4], minutes * 60.0 + 2.0, tempo)
+            downsampled, fast = timed(make_beatmap.downsample_events, *downsample_args)
+            line = (f"{'':6s}      difficulty {difficulty}: {len(downsampled):5d} notes  "
+                    f"downsample_events {fast * 1000:8.2f} ms")
+            if minutes <= args.skip_reference_above:
+                expected, slow = timed(reference_downsample_events, *downsample_args)
+                same = downsampled == expected
+                ok &= same
+                line += f"  reference {slow * 1000:9.2f} ms  x{slow / max(fast, 1e-9):7.1f}  {'OK' if same else 'MISMATCH'}"
+            print(line)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
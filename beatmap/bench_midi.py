@@ -0,0 +1,123 @@
+"""
+Equivalence check and timing benchmark for the beatmap MIDI writer.
+
+Writes synthetic beatmaps with `midi_writer.encode_beatmap_midi` next to the
+original mido-based writer kept below as the reference, asserts the files are
+byte-for-byte identical, and parses the written file back with `midi.parse_midi`
+to check every note comes back at its event time. Exits with code 1 on any mismatch.
+
+Usage: python bench_midi.py [--minutes 1 5 20]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+
+from mido import Message, MetaMessage, MidiFile, MidiTrack, bpm2tempo
+
+import make_beatmap
+import midi_writer
+from bench_events import synthetic_track, timed
+from midi import parse_midi, pitch_to_move
+
+
+# -- Reference implementation (the original mido message-by-message writer) ---
+
+def reference_generate_midi_messages(events, ticks_per_second):
+    midi_messages = []
+    min_duration = 60
+
+    for i, (t, pitches, velocity) in enumerate(events):
+        note_on_tick = int(t * ticks_per_second)
+
+        if i < len(events) - 1:
+            next_time = events[i + 1][0]
+            duration = int((next_time - t) * ticks_per_second * 0.8)
+            duration = max(duration, min_duration)
+        else:
+            duration = int(2.0 * ticks_per_second)
+
+        for pitch in pitches:
+            midi_messages.append((note_on_tick, Message('note_on', note=pitch, velocity=velocity, time=0)))
+            midi_messages.append((note_on_tick + duration, Message('note_off', note=pitch, velocity=velocity, time=0)))
+
+    return sorted(midi_messages, key=lambda x: (x[0], 0 if x[1].type == 'note_on' else 1))
+
+
+def reference_encode_midi(events, tempo):
+    mid = MidiFile()
+    track = MidiTrack()
+    mid.tracks.append(track)
+
+    track.append(MetaMessage('set_tempo', tempo=bpm2tempo(float(tempo)), time=0))
+    ticks_per_second = mid.ticks_per_beat * (tempo / 60.0)
+
+    current_tick = 0
+    for abs_tick, msg in reference_generate_midi_messages(events, ticks_per_second):
+        msg.time = max(0, abs_tick - current_tick)
+        current_tick = abs_tick
+        track.append(msg)
+
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+
+# -- Checks ---------------------------------------------------------------------
+
+def synthetic_events(minutes: float, bpm: float, seed: int = 0):
+    all_times, beat_times, onset_times, onset_velocity_map, tol = synthetic_track(minutes, bpm=bpm, seed=seed)
+    return make_beatmap.generate_initial_events(all_times, beat_times, onset_times, onset_velocity_map, tol)
+
+
+def round_trips(events, tempo) -> bool:
+    """Whether parse_midi reads back one note per event pitch, at the event's time to the tick."""
+    fd, path = tempfile.mkstemp(suffix=".mid")
+    os.close(fd)
+    try:
+        make_beatmap.create_midi_file(events, tempo, path)
+        parsed = parse_midi(path)
+    finally:
+        os.remove(path)
+    tick = 60.0 / (tempo * midi_writer.TICKS_PER_BEAT)
+    for pitch, move in pitch_to_move.items():
+        expected = [t for t, pitches, _ in events if pitch in pitches]
+        starts = [note.start for note in parsed.get(move, [])]
+        if len(starts) != len(expected) or any(abs(s - t) > tick * 1.01 for s, t in zip(starts, expected)):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the beatmap MIDI writer")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 5, 20])
+    args = parser.parse_args()
+
+    ok = True
+    for tempo in (90.0, 123.046875, 174.5):
+        # Include gaps whose deltas need two, three and four variable-length bytes
+        long_gaps = [(0.5, [67], 64), (1.0, [67, 72], 127), (40.0, [72], 40), (3000.0, [67, 72], 90)]
+        for events in ([], [(0.0, [67], 64)], long_gaps, synthetic_events(0.5, tempo, seed=1)):
+            same = midi_writer.encode_beatmap_midi(events, tempo) == reference_encode_midi(events, tempo)
+            ok &= same
+            if not same:
+                print(f"MISMATCH for {len(events)} events at {tempo} BPM")
+
+    for minutes in args.minutes:
+        tempo = 128.0
+        events = synthetic_events(minutes, tempo)
+        data, fast = timed(midi_writer.encode_beatmap_midi, events, tempo)
+        expected, slow = timed(reference_encode_midi, events, tempo)
+        same = data == expected
+        parsed_ok = round_trips(events, tempo) if minutes <= 5 else True
+        ok &= same and parsed_ok
+        print(f"{minutes:6.1f} min  {len(events):6d} events  encode_beatmap_midi {fast * 1000:8.2f} ms  "
+              f"mido {slow * 1000:9.2f} ms  x{slow / max(fast, 1e-9):6.1f}  "
+              f"{'OK' if same else 'MISMATCH'}  round trip {'OK' if parsed_ok else 'MISMATCH'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+End-to-end benchmark and accuracy suite for beatmap generation on synthetic audio.
+
+Synthesises click tracks and drum patterns (kick, snare and hi-hat) at known tempos
+and lengths, writes them as wav files and runs the full `process_audio_to_midis`
+pipeline on each with the analysis and PCM caches bypassed. Reports per-stage wall
+time, peak traced memory, tempo error and onset recall/precision against the
+synthesised hit times, plus the share of charted notes that land on a real hit.
+
+With --progressive, every case is also charted by a `progressive.ProgressiveJob`
+and its final tempo and note count are checked against the whole-song run; --songs
+adds real audio files, which have no ground truth and are only checked this way.
+The first window's tempo is reported too: a constant-tempo synthetic track rarely
+fools it, real songs with a slow intro do.
+
+Results are written as JSON. With --compare, cases are matched against an earlier
+results file and the script exits with code 1 when one got slower (beyond
+--time-tolerance) or less accurate. It also exits with code 1 when a progressive
+chart's tempo or note count is further than PROGRESSIVE_TEMPO_TOLERANCE or
+PROGRESSIVE_NOTE_TOLERANCE from the whole-song one.
+
+Usage: python bench_pipeline.py [--seconds 30 120 1200] [--bpm 90 128 174] [--kinds click drums]
+                                [--tier standard] [--output results.json] [--compare baseline.json]
+                                [--progressive] [--songs song.mp3 ...]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pretty_midi
+import soundfile as sf
+
+import make_beatmap
+from bench_analysis import agreement, traced
+from warmup import configure_numba_cache, warm_up
+
+SR = 44100
+ONSET_TOLERANCE = 0.05  # seconds, the usual onset evaluation window
+HIT_MERGE_SECONDS = 0.03  # hits closer than this count as one onset
+PROGRESSIVE_TEMPO_TOLERANCE = 0.01  # relative
+PROGRESSIVE_NOTE_TOLERANCE = 0.05  # relative difference in note count
+
+
+# -- Synthetic audio -----------------------------------------------------------
+
+def _envelope(n: int, decay: float) -> np.ndarray:
+    return np.exp(-np.linspace(0, decay, n)).astype(np.float32)
+
+
+def drum_sounds(sr: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n = int(0.15 * sr)
+    t = np.arange(n) / sr
+    # Kick: sine sweeping down from 150 Hz to 50 Hz
+    kick = np.sin(2 * np.pi * (50 * t + 100 * (1 - np.exp(-t * 30)) / 30)).astype(np.float32) * _envelope(n, 6)
+    # Snare: noise burst over a 200 Hz tone
+    n_snare = int(0.12 * sr)
+    snare = (0.6 * rng.standard_normal(n_snare) + 0.4 * np.sin(2 * np.pi * 200 * np.arange(n_snare) / sr))
+    snare = snare.astype(np.float32) * _envelope(n_snare, 8)
+    # Hi-hat: short high-passed noise
+    n_hat = int(0.03 * sr)
+    hat = np.diff(rng.standard_normal(n_hat + 1)).astype(np.float32) * 0.3 * _envelope(n_hat, 10)
+    return {"kick": kick, "snare": snare, "hat": hat}
+
+
+def place(y: np.ndarray, sound: np.ndarray, times: np.ndarray, sr: int):
+    for start in times:
+        i = int(round(start * sr))
+        if i < len(y):
+            y[i:i + len(sound)] += sound[:len(y) - i]
+
+
+def merge_hits(times: np.ndarray) -> np.ndarray:
+    times = np.unique(np.round(times, 6))
+    if len(times) == 0:
+        return times
+    keep = np.concatenate([[True], np.diff(times) > HIT_MERGE_SECONDS])
+    return times[keep]
+
+
+def synthesize(kind: str, bpm: float, seconds: float, sr: int = SR):
+    """Signal and ground-truth hit times for a `kind` ("click" or "drums") track."""
+    y = np.zeros(int(sr * seconds), dtype=np.float32)
+    beat = 60.0 / bpm
+    beats = np.arange(0.5, seconds - 0.2, beat)
+    if kind == "click":
+        click = np.random.default_rng(0).standard_normal(sr // 50).astype(np.float32) * _envelope(sr // 50, 8)
+        place(y, click, beats, sr)
+        hits = beats
+    elif kind == "drums":
+        sounds = drum_sounds(sr)
+        # Kick on beats 1 and 3 and the "and" of 3, snare on 2 and 4, hi-hat on every eighth
+        position = np.arange(len(beats)) % 4
+        kicks = np.concatenate([beats[position % 2 == 0], beats[position == 2] + beat / 2])
+        snares = beats[position % 2 == 1]
+        hats = np.arange(0.5, seconds - 0.2, beat / 2)
+        place(y, sounds["kick"], kicks, sr)
+        place(y, sounds["snare"], snares, sr)
+        place(y, sounds["hat"], hats, sr)
+        hits = np.concatenate([kicks, snares, hats])
+    else:
+        raise ValueError(f"Unknown track kind {kind!r}")
+    y /= max(1.0, float(np.max(np.abs(y))))
+    return y, merge_hits(hits[hits < seconds])
+
+
+# -- Running and scoring -------------------------------------------------------
+
+def tempo_error(estimated: float, true_bpm: float):
+    """Relative tempo error, and whether the estimate is off by a factor of two instead."""
+    error = abs(estimated - true_bpm) / true_bpm
+    octave = min(abs(estimated - 2 * true_bpm) / (2 * true_bpm), abs(estimated - true_bpm / 2) / (true_bpm / 2))
+    return error, bool(octave < 0.04 <= error)
+
+
+def run_case(kind: str, bpm: float, seconds: float, tier: str, difficulty: int, workdir: str,
+             progressive: bool = False) -> dict:
+    y, hits = synthesize(kind, bpm, seconds)
+    audio_path = os.path.join(workdir, f"{kind}_{bpm:g}_{seconds:g}.wav")
+    midi_path = os.path.join(workdir, f"{kind}_{bpm:g}_{seconds:g}.mid")
+    sf.write(audio_path, y, SR, subtype="PCM_16")
+    del y
+
+    report, elapsed, peak = traced(
+        make_beatmap.process_audio_to_midis, audio_path, {difficulty: midi_path}, tier=tier, use_cache=False
+    )
+    # Scored from a separate, untimed analysis: the pipeline only returns its summary
+    analysis = make_beatmap.load_and_analyze_audio(audio_path, use_cache=False, tier=tier)
+    notes = midi_note_times(midi_path)
+    error, octave = tempo_error(report.tempo, bpm)
+
+    result = {
+        "kind": kind,
+        "bpm": bpm,
+        "seconds": seconds,
+        "tier": report.tier,
+        "difficulty": difficulty,
+        "total_seconds": round(elapsed, 4),
+        "timings": report.timings,
+        "peak_mb": round(peak / 1e6, 1),
+        "tempo": round(report.tempo, 3),
+        "tempo_error": round(error, 4),
+        "octave_error": octave,
+        "onset_recall": round(agreement(hits, analysis.onset_times, ONSET_TOLERANCE), 4),
+        "onset_precision": round(agreement(analysis.onset_times, hits, ONSET_TOLERANCE), 4),
+        "notes": int(len(notes)),
+        "note_precision": round(agreement(notes, hits, ONSET_TOLERANCE), 4),
+    }
+    if progressive:
+        result.update(run_progressive(audio_path, tier, difficulty, workdir, report.tempo, len(notes)))
+    return result
+
+
+def midi_note_times(midi_path: str) -> np.ndarray:
+    return np.unique([note.start for instrument in pretty_midi.PrettyMIDI(midi_path).instruments
+                      for note in instrument.notes])
+
+
+def run_progressive(audio_path: str, tier: str, difficulty: int, workdir: str, tempo: float, notes: int) -> dict:
+    """Chart `audio_path` progressively and compare its tempo and note count with a whole-song run's."""
+    from progressive import ProgressiveJob
+
+    midi_path = os.path.join(workdir, os.path.splitext(os.path.basename(audio_path))[0] + "_progressive.mid")
+    first_window_tempo = None
+
+    class Job(ProgressiveJob):
+        def publish(self, segment):
+            nonlocal first_window_tempo
+            first_window_tempo = first_window_tempo or self.bpm
+            super().publish(segment)
+
+    job = Job(audio_path, midi_path, difficulty, tier=tier)
+    job.run()
+    if job.error is not None:
+        raise job.error
+    return {
+        "progressive_tempo": round(job.bpm, 3),
+        "progressive_first_window_tempo": round(first_window_tempo, 3),
+        "progressive_tempo_error": round(abs(job.bpm - tempo) / tempo, 4),
+        "progressive_notes": int(len(midi_note_times(midi_path))),
+        "progressive_note_difference": round(abs(len(midi_note_times(midi_path)) - notes) / max(notes, 1), 4),
+    }
+
+
+def run_song(audio_path: str, tier: str, difficulty: int, workdir: str) -> dict:
+    """A real song: the whole-song run against the progressive one, without ground truth."""
+    midi_path = os.path.join(workdir, os.path.splitext(os.path.basename(audio_path))[0] + ".mid")
+    report, elapsed, peak = traced(
+        make_beatmap.process_audio_to_midis, audio_path, {difficulty: midi_path}, tier=tier, use_cache=False
+    )
+    notes = int(len(midi_note_times(midi_path)))
+    return {
+        "song": os.path.basename(audio_path),
+        "tier": report.tier,
+        "difficulty": difficulty,
+        "total_seconds": round(elapsed, 4),
+        "peak_mb": round(peak / 1e6, 1),
+        "tempo": round(report.tempo, 3),
+        "notes": notes,
+        **run_progressive(audio_path, tier, difficulty, workdir, report.tempo, notes),
+    }
+
+
+def progressive_mismatches(results):
+    """Descriptions of every case whose progressive chart differs from the whole-song one."""
+    found = []
+    for result in results:
+        if "progressive_tempo" not in result:
+            continue
+        name = result.get("song") or "{} {:g} BPM {:g} s".format(*case_key(result)[:3])
+        if result["progressive_tempo_error"] > PROGRESSIVE_TEMPO_TOLERANCE:
+            found.append(f"{name}: progressive tempo {result['progressive_tempo']:.2f}, "
+                         f"whole song {result['tempo']:.2f}")
+        if result["progressive_note_difference"] > PROGRESSIVE_NOTE_TOLERANCE:
+            found.append(f"{name}: {result['progressive_notes']} progressive notes, "
+                         f"whole song {result['notes']}")
+    return found
+
+
+def case_key(result: dict):
+    return result["kind"], result["bpm"], result["seconds"], result["tier"], result["difficulty"]
+
+
+def regressions(results, baseline, time_tolerance: float):
+    """Descriptions of every case that got slower or less accurate than in `baseline`."""
+    previous = {case_key(result): result for result in baseline["results"] if "song" not in result}
+    found = []
+    for result in results:
+        if "song" in result:
+            continue
+        before = previous.get(case_key(result))
+        if before is None:
+            continue
+        name = "{} {:g} BPM {:g} s".format(*case_key(result)[:3])
+        slower = result["total_seconds"] - before["total_seconds"]
+        if result["total_seconds"] > before["total_seconds"] * (1 + time_tolerance) and slower > 0.05:
+            found.append(f"{name}: {before['total_seconds']:.2f} s -> {result['total_seconds']:.2f} s")
+        for metric in ("onset_recall", "onset_precision", "note_precision"):
+            if result[metric] < before[metric] - 0.02:
+                found.append(f"{name}: {metric} {before[metric]:.3f} -> {result[metric]:.3f}")
+        if result["tempo_error"] > before["tempo_error"] + 0.01:
+            found.append(f"{name}: tempo error {before['tempo_error']:.3f} -> {result['tempo_error']:.3f}")
+    return found
+
+
+def progressive_line(result: dict) -> str:
+    return (f"progressive: tempo {result['progressive_tempo']:.2f} "
+            f"(first window {result['progressive_first_window_tempo']:.2f}, "
+            f"{result['progressive_tempo_error'] * 100:.1f}% off)  notes {result['progressive_notes']} "
+            f"({result['progressive_note_difference'] * 100:.1f}% off)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark beatmap generation on synthetic audio")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[30, 120, 1200])
+    parser.add_argument("--bpm", type=float, nargs="+", default=[90, 128, 174])
+    parser.add_argument("--kinds", nargs="+", default=["click", "drums"], choices=["click", "drums"])
+    parser.add_argument("--tier", default=make_beatmap.DEFAULT_TIER, choices=list(make_beatmap.ANALYSIS_TIERS))
+    parser.add_argument("--difficulty", type=int, default=3)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--time-tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before a case counts as a regression")
+    parser.add_argument("--progressive", action="store_true",
+                        help="also chart every case progressively and check its tempo against the whole-song run")
+    parser.add_argument("--songs", nargs="+", default=[],
+                        help="real audio files to check progressive charting on (implies --progressive)")
+    args = parser.parse_args()
+
+    configure_numba_cache()
+    warm_up()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for seconds in args.seconds:
+            for kind in args.kinds:
+                for bpm in args.bpm:
+                    result = run_case(kind, bpm, seconds, args.tier, args.difficulty, workdir,
+                                      progressive=args.progressive or bool(args.songs))
+                    results.append(result)
+                    stages = "  ".join(f"{stage} {value:.2f}" for stage, value in result["timings"].items())
+                    print(f"{kind:5s} {bpm:5g} BPM {seconds:6g} s  {result['total_seconds']:7.2f} s  "
+                          f"peak {result['peak_mb']:7.1f} MB  tempo {result['tempo']:7.2f} "
+                          f"({result['tempo_error'] * 100:5.1f}%{' octave' if result['octave_error'] else ''})  "
+                          f"onsets R {result['onset_recall']:.3f} P {result['onset_precision']:.3f}  "
+                          f"notes {result['notes']:4d} P {result['note_precision']:.3f}")
+                    print(f"      {stages}")
+                    if "progressive_tempo" in result:
+                        print(f"      {progressive_line(result)}")
+        for song in args.songs:
+            result = run_song(song, args.tier, args.difficulty, workdir)
+            results.append(result)
+            print(f"{result['song']}  {result['total_seconds']:7.2f} s  tempo {result['tempo']:7.2f}  "
+                  f"notes {result['notes']:4d}")
+            print(f"      {progressive_line(result)}")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "tier": args.tier,
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    mismatches = progressive_mismatches(results)
+    for line in mismatches:
+        print(f"MISMATCH {line}")
+    found = []
+    if args.compare:
+        with open(args.compare, "r") as f:
+            found = regressions(results, json.load(f), args.time_tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if not found:
+            print(f"No regressions against {args.compare}")
+    if found or mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Startup benchmark for the API process.
+
+Imports `api` in fresh interpreters and fails (exit code 1) when the best import time
+exceeds the budget, or when a heavy module that should be loaded lazily shows up in
+`sys.modules` right after the import. Most of the import is FastAPI and pydantic
+themselves, which the API cannot avoid and whose cost varies from machine to
+machine, so the budget applies to the time on top of importing just those.
+
+Usage: python bench_startup.py [--budget 0.15] [--runs 5] [--importtime]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Import time of api beyond that of the frameworks in FRAMEWORK_MODULES
+IMPORT_BUDGET_S = 0.15
+FRAMEWORK_MODULES = ["fastapi", "pydantic"]
+LAZY_MODULES = ["numpy", "librosa", "numba", "scipy", "pretty_midi", "mido", "redis", "make_beatmap"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_import(runs: int, modules: str = "api") -> dict:
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        try:
+            out = subprocess.run(
+                [sys.executable, "-c", _PROBE % (modules, LAZY_MODULES)], capture_output=True, text=True, check=True
+            ).stdout
+        except subprocess.CalledProcessError as e:
+            last_line = (e.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"FAIL: importing {modules} exited with code {e.returncode}: {last_line}")
+            sys.exit(1)
+        result = json.loads(out.strip().splitlines()[-1])
+        timings.append(result["elapsed"])
+        loaded.update(result["loaded"])
+    return {"best": min(timings), "timings": timings, "loaded": sorted(loaded)}
+
+
+def print_importtime(top: int = 15):
+    """Show the slowest cumulative imports, as reported by `python -X importtime`."""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"], capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API import time")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_S,
+                        help="budget in seconds for the api import beyond importing the frameworks")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="print the slowest imports")
+    args = parser.parse_args()
+
+    # Throwaway first run so the timed runs read compiled bytecode, like a restarted worker.
+    measure_import(1)
+    # Alternate the two imports so load on the machine affects both alike
+    api_runs, framework_runs = [], []
+    for _ in range(args.runs):
+        api_runs.append(measure_import(1))
+        framework_runs.append(measure_import(1, ", ".join(FRAMEWORK_MODULES)))
+    result = {"best": min(r["best"] for r in api_runs),
+              "loaded": sorted(set().union(*(r["loaded"] for r in api_runs)))}
+    framework = {"best": min(r["best"] for r in framework_runs)}
+    overhead = result["best"] - framework["best"]
+    print(f"api import: best {result['best'] * 1000:.1f} ms over {args.runs} runs, "
+          f"{', '.join(FRAMEWORK_MODULES)} alone {framework['best'] * 1000:.1f} ms, "
+          f"api's own {overhead * 1000:.1f} ms (budget {args.budget * 1000:.0f} ms)")
+    if args.importtime:
+        print_importtime()
+
+    failed = False
+    if overhead > args.budget:
+        print("FAIL: api import time is over budget")
+        failed = True
+    if result["loaded"]:
+        print(f"FAIL: modules that should be lazy were imported: {', '.join(result['loaded'])}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
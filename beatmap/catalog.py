@@ -0,0 +1,115 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List
+
+CATALOG_PATH = "catalog.json"
+REQUIRED_KEYS = ['id', 'name', 'path', 'song', 'bpm', 'difficulty']
+
+DEFAULT_CATALOG = [
+    {
+        "id": 0,
+        "name": "The Cha Cha Slide (Easy)",
+        "path": "songmaps/chacha.mid",
+        "song": "songs/chacha.mp3",
+        "bpm": 122,
+        "difficulty": 2
+    }
+]
+
+
+def read_catalog(catalog_path: str = CATALOG_PATH) -> List[Dict]:
+    """
+    Reads the catalog, falling back to the default catalog when the file is missing
+    or was left truncated, and drops incomplete entries.
+    """
+    catalog = []
+    try:
+        with open(catalog_path, "r") as f:
+            content = f.read().strip()
+            if content and content[-1] == ']':
+                try:
+                    catalog = json.loads(content)
+                except json.JSONDecodeError:
+                    catalog = [dict(entry) for entry in DEFAULT_CATALOG]
+    except FileNotFoundError:
+        catalog = [dict(entry) for entry in DEFAULT_CATALOG]
+
+    # Remove any incomplete entries
+    return [entry for entry in catalog if isinstance(entry, dict) and all(
+        key in entry for key in REQUIRED_KEYS
+    )]
+
+
+@contextmanager
+def catalog_lock(catalog_path: str = CATALOG_PATH):
+    """
+    Hold an exclusive lock on the catalog across a read-modify-write. The API and the
+    batch CLI run as separate processes, so the lock is an flock on a sidecar file.
+    """
+    with open(f"{catalog_path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def append_entries(new_entries: List[Dict], catalog_path: str = CATALOG_PATH) -> List[Dict]:
+    """
+    Assigns ids to `new_entries`, appends them to the catalog in a single atomic write
+    and returns them with their ids.
+    """
+    with catalog_lock(catalog_path):
+        catalog = read_catalog(catalog_path)
+
+        max_id = 0
+        for entry in catalog:
+            max_id = max(max_id, entry['id'])
+
+        added = []
+        for offset, entry in enumerate(new_entries, start=1):
+            added.append({"id": max_id + offset, **entry})
+        catalog.extend(added)
+        write_catalog(catalog, catalog_path)
+    return added
+
+
+def remove_entries(ids: List[int], catalog_path: str = CATALOG_PATH):
+    """Removes the entries with the given ids, e.g. for a beatmap whose generation failed."""
+    with catalog_lock(catalog_path):
+        catalog = read_catalog(catalog_path)
+        write_catalog([entry for entry in catalog if entry['id'] not in ids], catalog_path)
+
+
+def update_entry(entry_id: int, changes: Dict, catalog_path: str = CATALOG_PATH):
+    """Updates fields of the entry with the given id, e.g. the final tempo of a progressive beatmap."""
+    with catalog_lock(catalog_path):
+        catalog = read_catalog(catalog_path)
+        for entry in catalog:
+            if entry['id'] == entry_id:
+                entry.update(changes)
+        write_catalog(catalog, catalog_path)
+
+
+def write_catalog(catalog: List[Dict], catalog_path: str = CATALOG_PATH):
+    """
+    Atomically replace the catalog. Callers that read it first should hold `catalog_lock`,
+    or a concurrent update can be lost.
+    """
+    # A temporary file of its own, so concurrent writers never write into the same one
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(catalog_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(catalog, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file owner-only; give it the permissions of a normal file
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, catalog_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
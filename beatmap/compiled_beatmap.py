@@ -0,0 +1,230 @@
+"""
+Precompiled beatmap format.
+
+A compiled beatmap (`.bmap`, written next to its `.mid` source) stores every lane
+as three flat little-endian arrays (start times, durations, subdivisions) behind a
+small header holding the BPM, the song duration and a checksum of the MIDI file it
+was compiled from. Files are opened with `mmap`, so the arrays are zero-copy views
+and every uvicorn worker shares the same page-cache pages.
+
+Layout:
+    header     MAGIC, version, lane count, bpm (f8), duration (f8), sha256 of the MIDI
+    lane table one (name, offset, count) record per lane
+    lane data  starts (f8[count]), durations (f8[count]), subdivisions (i4[count]),
+               each block padded to 8 bytes
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+from midi import Note, parse_midi_with_tempo
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MAGIC = b"BNGBMAP\x00"
+VERSION = 1
+COMPILED_SUFFIX = ".bmap"
+
+_HEADER = struct.Struct("<8sHHdd32s4x")  # 64 bytes
+_LANE = struct.Struct("<16sQQ")          # 32 bytes
+
+
+class Lane(NamedTuple):
+    starts: "np.ndarray"        # float64, sorted ascending
+    durations: "np.ndarray"     # float64
+    subdivisions: "np.ndarray"  # int32
+
+
+@dataclass
+class CompiledBeatmap:
+    bpm: float
+    duration: float
+    checksum: bytes
+    lanes: Dict[str, Lane]
+
+    def note_count(self) -> int:
+        return sum(len(lane.starts) for lane in self.lanes.values())
+
+    def to_notes(self) -> Dict[str, List[Note]]:
+        """Expand the lane arrays into the `parse_midi` structure used by `BeatmapSession`."""
+        return {
+            move: [
+                Note(move_type=move, start=start, duration=duration, subdivision=subdivision)
+                for start, duration, subdivision in zip(
+                    lane.starts.tolist(), lane.durations.tolist(), lane.subdivisions.tolist()
+                )
+            ]
+            for move, lane in self.lanes.items()
+        }
+
+
+def compiled_path_for(midi_path: str) -> str:
+    return os.path.splitext(midi_path)[0] + COMPILED_SUFFIX
+
+
+def file_checksum(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def build_compiled(midi_path: str) -> CompiledBeatmap:
+    """Build a `CompiledBeatmap` straight from the MIDI source without touching disk."""
+    # Imported here so importing the API does not load numpy
+    import numpy as np
+
+    checksum = file_checksum(midi_path)
+    notes_by_move, bpm = parse_midi_with_tempo(midi_path)
+    lanes = {
+        move: Lane(
+            starts=np.array([n.start for n in notes], dtype="<f8"),
+            durations=np.array([n.duration for n in notes], dtype="<f8"),
+            subdivisions=np.array([n.subdivision for n in notes], dtype="<i4"),
+        )
+        for move, notes in notes_by_move.items()
+    }
+    duration = max(
+        (float(np.max(lane.starts + lane.durations)) for lane in lanes.values() if len(lane.starts)),
+        default=0.0,
+    )
+    return CompiledBeatmap(bpm=float(bpm), duration=duration, checksum=checksum, lanes=lanes)
+
+
+def write_compiled(compiled: CompiledBeatmap, output_path: str):
+    """
+    Write `compiled` to `output_path`. The file is written to a temporary path and renamed,
+    so readers never map a partial file.
+    """
+    offset = _HEADER.size + _LANE.size * len(compiled.lanes)
+    table = []
+    for move, lane in compiled.lanes.items():
+        count = len(lane.starts)
+        table.append(_LANE.pack(move.encode("utf-8"), offset, count))
+        offset += 2 * 8 * count + _pad8(4 * count)
+
+    # A temporary file of its own: workers compiling the same beatmap at once must not
+    # truncate a file another one has just renamed into place
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(
+                MAGIC, VERSION, len(compiled.lanes), compiled.bpm, compiled.duration, compiled.checksum
+            ))
+            f.writelines(table)
+            for lane in compiled.lanes.values():
+                f.write(lane.starts.astype("<f8").tobytes())
+                f.write(lane.durations.astype("<f8").tobytes())
+                subdivisions = lane.subdivisions.astype("<i4").tobytes()
+                f.write(subdivisions + b"\x00" * (_pad8(len(subdivisions)) - len(subdivisions)))
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file owner-only; give it the permissions of a normal file
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def compile_beatmap(midi_path: str, output_path: Optional[str] = None) -> CompiledBeatmap:
+    """Parse `midi_path` once and write its compiled form (by default next to the MIDI file)."""
+    compiled = build_compiled(midi_path)
+    write_compiled(compiled, output_path or compiled_path_for(midi_path))
+    return compiled
+
+
+def open_compiled(path: str) -> CompiledBeatmap:
+    """
+    Memory-map a compiled beatmap. Lane arrays are read-only views into the mapping,
+    which stays open for as long as any of them is referenced.
+    """
+    # Imported here so importing the API does not load numpy
+    import numpy as np
+
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, lane_count, bpm, duration, checksum = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} compiled beatmap")
+
+    lanes: Dict[str, Lane] = {}
+    for i in range(lane_count):
+        name, offset, count = _LANE.unpack_from(buf, _HEADER.size + i * _LANE.size)
+        move = name.rstrip(b"\x00").decode("utf-8")
+        lanes[move] = Lane(
+            starts=np.frombuffer(buf, dtype="<f8", count=count, offset=offset),
+            durations=np.frombuffer(buf, dtype="<f8", count=count, offset=offset + 8 * count),
+            subdivisions=np.frombuffer(buf, dtype="<i4", count=count, offset=offset + 16 * count),
+        )
+
+    return CompiledBeatmap(bpm=bpm, duration=duration, checksum=checksum, lanes=lanes)
+
+
+def is_stale(compiled: CompiledBeatmap, midi_path: str) -> bool:
+    return compiled.checksum != file_checksum(midi_path)
+
+
+def load_beatmap(midi_path: str) -> CompiledBeatmap:
+    """
+    Load the compiled beatmap for `midi_path`, recompiling it when it is missing,
+    unreadable or stale (the MIDI checksum no longer matches). If the compiled file
+    cannot be written, the MIDI source is parsed directly.
+    """
+    path = compiled_path_for(midi_path)
+    if os.path.exists(path):
+        try:
+            compiled = open_compiled(path)
+            if not is_stale(compiled, midi_path):
+                return compiled
+            print(f"Compiled beatmap {path} is stale, recompiling")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error reading compiled beatmap {path}: {e}")
+
+    compiled = build_compiled(midi_path)
+    try:
+        write_compiled(compiled, path)
+    except OSError as e:
+        print(f"Could not write compiled beatmap {path}: {e}")
+    return compiled
+
+
+def compile_catalog(catalog_path: str = "catalog.json", frontend_prefix: str = "../frontend/public/") -> int:
+    """
+    Make sure every MIDI referenced by the catalog has an up-to-date compiled beatmap.
+    Returns the number of beatmaps (re)compiled.
+    """
+    try:
+        with open(catalog_path, "r") as f:
+            catalog = json.load(f)
+    except Exception as e:
+        print(f"Error reading {catalog_path}: {e}")
+        return 0
+
+    compiled = 0
+    for entry in catalog:
+        midi_path = f"{frontend_prefix}{entry.get('path', '').lstrip('/')}"
+        if not entry.get("path") or not os.path.exists(midi_path):
+            continue
+        path = compiled_path_for(midi_path)
+        try:
+            if os.path.exists(path) and not is_stale(open_compiled(path), midi_path):
+                continue
+        except (OSError, ValueError, struct.error):
+            pass
+        try:
+            compile_beatmap(midi_path, path)
+            compiled += 1
+        except Exception as e:
+            print(f"Error compiling beatmap for {midi_path}: {e}")
+    return compiled
@@ -3,10 +3,11 @@ import time
 from dataclasses import dataclass, replace
 from typing import Tuple, List, Dict, Any, Optional
 from midi import (
-    parse_midi,
     Note,
     BeatmapSession
 )
+from compiled_beatmap import load_beatmap
+from progressive import ProgressiveJob, job_for, merge_notes
 from score import calculate_score
 from models import FallingDot
 
@@ -34,6 +35,8 @@ class GameState:
     song_name: str = ""
     difficulty: int = 1
     session: BeatmapSession = None
+    beatmap_job: ProgressiveJob = None  # Set while the beatmap is still being charted
+    segments_loaded: int = 0
 
 
 def get_song_info_from_catalog(id: int) -> tuple:
@@ -70,28 +73,25 @@ def start_new_game(song_id: int = 0) -> Tuple[GameState, List[FallingDot], List[
     frontend_prefix = "../frontend/public/"
     full_midi_path = f"{frontend_prefix}{midi_path.lstrip('/')}"
     print("Full MIDI path:", full_midi_path)
-    truth_moves = parse_midi(full_midi_path)
+    beatmap_job = job_for(full_midi_path)
+    segments_loaded = 0
+    if beatmap_job is not None:
+        # Still being charted: start with the segments published so far, the rest are
+        # queued by load_new_segments as they arrive
+        segments = beatmap_job.segments_since(0)
+        truth_moves = merge_notes(segments)
+        segments_loaded = len(segments)
+    else:
+        truth_moves = load_beatmap(full_midi_path).to_notes()
     
     # Create beatmap session
     session = BeatmapSession(truth_moves, bpm)
     
     # Calculate game duration
-    max_time = 0.0
-    for notes in truth_moves.values():
-        if notes:
-            max_time = max(max_time, notes[-1].start)
-    game_duration = max_time + 10.0
+    game_duration = calculate_game_duration(truth_moves, beatmap_job)
 
     # Create falling dots
-    falling_dots = [
-        FallingDot(
-            move=move,
-            target_time=note.start * 1000,  # Convert to ms
-            track=move
-        )
-        for move, notes in truth_moves.items()
-        for note in notes
-    ]
+    falling_dots = create_falling_dots(truth_moves)
 
     state = GameState(
         is_running=True,
@@ -102,7 +102,9 @@ def start_new_game(song_id: int = 0) -> Tuple[GameState, List[FallingDot], List[
         midi_path=midi_path,
         song_name=song_name,
         difficulty=difficulty,
-        session=session  # Store session in state
+        session=session,  # Store session in state
+        beatmap_job=beatmap_job,
+        segments_loaded=segments_loaded
     )
 
     messages = [{
@@ -117,6 +119,61 @@ def start_new_game(song_id: int = 0) -> Tuple[GameState, List[FallingDot], List[
 
     return state, falling_dots, messages
 
+def calculate_game_duration(truth_moves: Dict[str, List[Note]], beatmap_job: Optional[ProgressiveJob] = None) -> float:
+    """
+    Last note plus 10 seconds. While the beatmap is still being charted the last note is
+    not known yet, so the whole song is allowed for.
+    """
+    max_time = 0.0
+    for notes in truth_moves.values():
+        if notes:
+            max_time = max(max_time, notes[-1].start)
+    if beatmap_job is not None and beatmap_job.duration is not None:
+        max_time = max(max_time, beatmap_job.duration)
+    return max_time + 10.0
+
+def create_falling_dots(truth_moves: Dict[str, List[Note]]) -> List[FallingDot]:
+    return [
+        FallingDot(
+            move=move,
+            target_time=note.start * 1000,  # Convert to ms
+            track=move
+        )
+        for move, notes in truth_moves.items()
+        for note in notes
+    ]
+
+def load_new_segments(state: GameState) -> Tuple[GameState, List[Dict[str, Any]]]:
+    """
+    Queue the segments charted since the game started or since the last call. Once the
+    job is done and everything is queued, the game duration is settled from the last note.
+    """
+    job = state.beatmap_job
+    if job is None:
+        return state, []
+
+    finished = job.finished  # read before the segments so none published in between is missed
+    segments = job.segments_since(state.segments_loaded)
+    new_notes = merge_notes(segments)
+    state.session.extend(new_notes)
+
+    if finished:
+        new_state = replace(
+            state, beatmap_job=None, segments_loaded=0, game_duration=calculate_game_duration(job.notes())
+        )
+    else:
+        new_state = replace(state, segments_loaded=state.segments_loaded + len(segments))
+
+    messages = []
+    if segments or finished:
+        messages.append({
+            "type": "notes_added",
+            "falling_dots": [dot.model_dump() for dot in create_falling_dots(new_notes)],
+            "duration": new_state.game_duration,
+            "charting": new_state.beatmap_job is not None
+        })
+    return new_state, messages
+
 def process_hit(state: GameState, move: str, current_time: float) -> Tuple[GameState, List[Dict[str, Any]]]:
     """Process a hit event and return new state and messages."""
     if not state.is_running or state.is_paused:
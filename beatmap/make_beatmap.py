@@ -1,13 +1,49 @@
+import datetime
+import os
+import time
 from pydantic import BaseModel, Field
 import librosa
 import numpy as np
-from mido import Message, MidiFile, MidiTrack, MetaMessage, bpm2tempo
 from typing import List, Dict, Tuple, Optional
+import analysis_cache
+import audio_decode
+import stream_analysis
+from midi_writer import write_beatmap_midi
+from profiling import PROFILE_LOG, StageTimer, append_profile_log, cprofiled
 
 MAX_NOTES = 500 # Default maximum notes in the final MIDI file
+ANALYSIS_SR = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+STREAMING_MIN_SECONDS = 600 # Longer files are analysed block by block to bound memory
+ANALYSIS_VERSION = 2 # Bump when the analysis pipeline changes so cached results are not reused
+TIME_BUDGET_SECONDS = 30.0 # Analysis time a job may take, including waiting for the jobs ahead of it
+MULTIBAND_BANDS = 4
+
+class AnalysisTier(BaseModel):
+    sr: int
+    n_fft: int
+    hop_length: int
+    n_mels: int = 128
+    percussive: bool = False # Harmonic/percussive separation before the mel spectrogram
+    multiband: bool = False # Pick onsets from normalised per-band envelopes
+    shared_envelope: bool = False # Track beats on the onset envelope instead of a separate median one
+    streamable: bool = False
+    seconds_per_minute: float # Rough analysis cost per minute of audio, used by choose_tier
+
+# Ordered from cheapest to most expensive
+ANALYSIS_TIERS = {
+    "fast": AnalysisTier(sr=11025, n_fft=1024, hop_length=256, n_mels=64, shared_envelope=True,
+                         seconds_per_minute=0.5),
+    "standard": AnalysisTier(sr=ANALYSIS_SR, n_fft=N_FFT, hop_length=HOP_LENGTH, streamable=True,
+                             seconds_per_minute=1.0),
+    "quality": AnalysisTier(sr=ANALYSIS_SR, n_fft=N_FFT, hop_length=HOP_LENGTH, percussive=True, multiband=True,
+                            seconds_per_minute=4.0),
+}
+DEFAULT_TIER = "standard"
 
 class AudioAnalysis(BaseModel):
-    y: np.ndarray
+    tier: str = DEFAULT_TIER
     sr: int
     duration: float
     padded_duration: float
@@ -24,6 +60,13 @@ class NoteParameters(BaseModel):
     max_notes: int
     tolerance: float
 
+class GenerationReport(BaseModel):
+    bpm: int
+    tempo: float
+    tier: str
+    timings: Dict[str, float]
+    peak_rss_mb: Optional[Dict[str, float]] = None # Per stage, only when profiling
+
 class MIDIEvent(BaseModel):
     time: float
     pitches: List[int]
@@ -33,27 +76,13 @@ class BeatmapGenerator(BaseModel):
     input_mp3: str
     output_midi: str
     difficulty: int = Field(default=2, ge=1, le=5)
+    profile: bool = False # Record peak RSS per stage
+    log_path: Optional[str] = None # Rolling log the job report is appended to
+    cprofile_path: Optional[str] = None # Where to dump cProfile stats for the job
     
     def load_and_analyze_audio(self) -> AudioAnalysis:
         """Load audio file and analyze for BPM, beats, and onsets."""
-        y, sr = librosa.load(self.input_mp3, sr=22050)
-        duration = librosa.get_duration(y=y, sr=sr)
-        padded_duration = duration + 2.0
-        
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        if isinstance(tempo, np.ndarray):
-            tempo = float(tempo[0])
-        beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-        
-        onset_frames = librosa.onset.onset_detect(y=y, sr=sr)
-        onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-        onset_strengths = librosa.onset.onset_strength(y=y, sr=sr)
-        
-        return AudioAnalysis(
-            y=y, sr=sr, duration=duration, padded_duration=padded_duration,
-            tempo=tempo, beat_times=beat_times, onset_frames=onset_frames,
-            onset_times=onset_times, onset_strengths=onset_strengths
-        )
+        return load_and_analyze_audio(self.input_mp3)
 
     def calculate_note_parameters(self, duration: float, tempo: float) -> NoteParameters:
         """Calculate note-related parameters based on difficulty and tempo."""
@@ -74,202 +103,181 @@ class BeatmapGenerator(BaseModel):
 
     def generate_initial_events(self, all_times, beat_times, onset_times, onset_velocity_map, tol):
         """Generate initial event list with notes and velocities."""
-        events = []
-        for t in all_times:
-            velocity = 64
-            for onset_time, onset_vel in onset_velocity_map.items():
-                if abs(t - onset_time) < tol:
-                    velocity = onset_vel
-                    break
-                
-            is_beat = np.any(np.isclose(t, beat_times, atol=tol))
-            is_onset = np.any(np.isclose(t, onset_times, atol=tol))
-            
-            if is_beat and is_onset:
-                events.append((t, [67, 72], velocity))
-            else:
-                if len(events) % 2 == 0:
-                    events.append((t, [67], velocity))
-                else:
-                    events.append((t, [72], velocity))
-        return events
+        return generate_initial_events(all_times, beat_times, onset_times, onset_velocity_map, tol)
 
     def calculate_note_importance(self, event, beat_times, tol, tempo):
         """Calculate importance score for a note based on musical features."""
-        time, pitches, velocity = event
-        
-        is_beat = np.any(np.isclose(time, beat_times, atol=tol))
-        
-        beat_position = min([abs(time - beat) for beat in beat_times])
-        beat_alignment = 1.0 - (beat_position / (60.0 / tempo))
-        
-        importance = (
-            velocity / 127.0 * 0.4 +  # Velocity importance (40%)
-            (1.5 if is_beat else 0.0) * 0.4 +  # Beat importance (40%)
-            beat_alignment * 0.2  # Beat alignment importance (20%)
-        )
-        
-        return importance
+        return calculate_note_importance(event, beat_times, tol, tempo)
 
     def detect_phrases(self, events, beat_times):
         """Detect musical phrases based on velocity patterns and beat structure."""
-        if not events:
-            return []
-            
-        phrases = []
-        current_phrase = []
-        last_velocity = events[0][2]
-        velocity_threshold = 20  # Minimum velocity change to mark phrase boundary
-        
-        for event in events:
-            time, pitches, velocity = event
-            
-            # Check for significant velocity change or strong beat
-            is_strong_beat = any(np.isclose(time, beat_times[::2], atol=0.05))
-            velocity_change = abs(velocity - last_velocity) > velocity_threshold
-            
-            if (velocity_change and len(current_phrase) > 4) or (is_strong_beat and len(current_phrase) > 8):
-                if current_phrase:
-                    phrases.append(current_phrase)
-                current_phrase = []
-            
-            current_phrase.append(event)
-            last_velocity = velocity
-        
-        if current_phrase:
-            phrases.append(current_phrase)
-            
-        return phrases
+        return detect_phrases(events, beat_times)
 
     def downsample_events(self, events, max_notes, beat_times, tol, total_duration, tempo):
         """Downsample events using musical phrase detection and note importance."""
-        phrases = self.detect_phrases(events, beat_times)
-        
-        total_events = sum(len(phrase) for phrase in phrases)
-        processed_phrases = []
-        
-        for phrase in phrases:
-            phrase_ratio = len(phrase) / total_events
-            target_notes = max(1, int(max_notes * phrase_ratio))
-            
-            if len(phrase) > target_notes:
-                importance_scores = [
-                    (event, self.calculate_note_importance(event, beat_times, tol, tempo))
-                    for event in phrase
-                ]
-                
-                importance_scores.sort(key=lambda x: x[1], reverse=True)
-                phrase = [event for event, _ in importance_scores[:target_notes]]
-                
-                phrase.sort(key=lambda x: x[0])
-            
-            processed_phrases.extend(phrase)
-        
-        return processed_phrases
+        return downsample_events(events, max_notes, beat_times, tol, total_duration, tempo)
 
     def create_midi_file(self, events, tempo, output_midi):
         """Create and save the MIDI file from the processed events."""
-        mid = MidiFile()
-        track = MidiTrack()
-        mid.tracks.append(track)
-        
-        midi_tempo = bpm2tempo(float(tempo))
-        track.append(MetaMessage('set_tempo', tempo=midi_tempo, time=0))
-        ticks_per_beat = mid.ticks_per_beat
-        ticks_per_second = ticks_per_beat * (tempo / 60.0)
-        
-        midi_messages = self.generate_midi_messages(events, ticks_per_second)
-        self.write_midi_messages(track, midi_messages)
-        
-        mid.save(output_midi)
-        return int(tempo)
-
-    def generate_midi_messages(self, events, ticks_per_second):
-        """Generate MIDI messages from events."""
-        midi_messages = []
-        min_duration = 60
-        
-        for i, (t, pitches, velocity) in enumerate(events):
-            note_on_tick = int(t * ticks_per_second)
-            
-            if i < len(events) - 1:
-                next_time = events[i + 1][0]
-                duration = int((next_time - t) * ticks_per_second * 0.8)
-                duration = max(duration, min_duration)
-            else:
-                duration = int(2.0 * ticks_per_second)
-            
-            for pitch in pitches:
-                midi_messages.append((note_on_tick, Message('note_on', note=pitch, velocity=velocity, time=0)))
-                midi_messages.append((note_on_tick + duration, Message('note_off', note=pitch, velocity=velocity, time=0)))
-        
-        return sorted(midi_messages, key=lambda x: (x[0], 0 if x[1].type == 'note_on' else 1))
-
-    def write_midi_messages(self, track, midi_messages):
-        """Write MIDI messages to the track with proper timing."""
-        current_tick = 0
-        for abs_tick, msg in midi_messages:
-            delta = max(0, abs_tick - current_tick)
-            msg.time = delta
-            current_tick = abs_tick
-            track.append(msg)
+        return create_midi_file(events, tempo, output_midi)
 
     def process_audio_to_midi(self) -> float:
         """
         Creates a MIDI beatmap from an MP3 file based on difficulty level (1-5).
         Returns the detected BPM of the song.
         """
-        # Load and analyze audio
-        analysis = self.load_and_analyze_audio()
-        print(f"Estimated BPM: {analysis.tempo:.2f}")
-        
-        # Calculate parameters
-        params = self.calculate_note_parameters(analysis.duration, analysis.tempo)
-        print(f"Targeting {params.max_notes} notes for difficulty {self.difficulty} "
-              f"({self.difficulty * 30} notes per minute)")
-        print(f"Using tolerance: {params.tolerance:.3f} seconds")
-        
-        # Process onsets and generate events
-        onset_velocity_map = self.process_onset_velocities(
-            analysis.onset_times,
-            analysis.onset_frames,
-            analysis.onset_strengths
+        return self.generate().bpm
+
+    def generate(self) -> GenerationReport:
+        """Creates the MIDI beatmap and returns the full report, with per-stage timings."""
+        return process_audio_to_midis(
+            self.input_mp3, {self.difficulty: self.output_midi}, tier=DEFAULT_TIER,
+            profile=self.profile, log_path=self.log_path, cprofile_path=self.cprofile_path
         )
-        all_times = np.union1d(analysis.beat_times, analysis.onset_times)
-        all_times.sort()
-        
-        events = self.generate_initial_events(
-            all_times, analysis.beat_times, analysis.onset_times, 
-            onset_velocity_map, params.tolerance
+
+def use_streaming(input_mp3: str) -> bool:
+    """Stream files longer than STREAMING_MIN_SECONDS when libsndfile can read them in blocks."""
+    duration = stream_analysis.streamable_duration(input_mp3)
+    return duration is not None and duration > STREAMING_MIN_SECONDS
+
+def audio_duration(input_mp3: str) -> Optional[float]:
+    """Duration of an audio file from its header, without decoding it (None if unknown)."""
+    try:
+        return librosa.get_duration(path=input_mp3)
+    except Exception:
+        return None
+
+def choose_tier(duration: Optional[float], queue_depth: int = 0,
+                time_budget: float = TIME_BUDGET_SECONDS, preferred: str = DEFAULT_TIER) -> str:
+    """
+    Pick the analysis tier for a job: the preferred tier if its estimated analysis time,
+    waiting behind `queue_depth` other jobs, fits in `time_budget` seconds, otherwise the
+    next cheaper tier that does (or the cheapest).
+    """
+    if duration is None:
+        return preferred
+    order = list(ANALYSIS_TIERS)
+    candidates = order[:order.index(preferred) + 1][::-1]
+    for name in candidates:
+        estimate = ANALYSIS_TIERS[name].seconds_per_minute * duration / 60.0 * (queue_depth + 1)
+        if estimate <= time_budget:
+            return name
+    return order[0]
+
+def load_and_analyze_audio(input_mp3: str, use_cache: bool = True, streaming: Optional[bool] = None,
+                           tier: str = DEFAULT_TIER, timer: Optional[StageTimer] = None,
+                           audio_hash: Optional[str] = None) -> AudioAnalysis:
+    """
+    Load audio file and analyze for BPM, beats, and onsets at the given analysis tier.
+    Results are cached by audio content, so analysing the same song again skips decoding.
+    The content is hashed once (or taken from `audio_hash`) for both the analysis and PCM caches.
+    With streaming (chosen automatically for long files when None, standard tier only),
+    the audio is never decoded as a whole: only the onset envelopes are built, block by block.
+    """
+    timer = timer or StageTimer()
+    settings = ANALYSIS_TIERS[tier]
+    if streaming is None:
+        streaming = settings.streamable and use_streaming(input_mp3)
+    elif streaming and not settings.streamable:
+        raise ValueError(f"The {tier} analysis tier does not support streaming")
+    
+    with timer.stage("cache"):
+        if use_cache and audio_hash is None:
+            audio_hash = analysis_cache.content_hash(input_mp3)
+        key = analysis_cache.cache_key(
+            input_mp3, audio_hash=audio_hash, version=ANALYSIS_VERSION, mode="stream" if streaming else "memory",
+            **settings.model_dump(exclude={"seconds_per_minute", "streamable"})
         )
-        events = self.downsample_events(
-            events, params.max_notes, analysis.beat_times, 
-            params.tolerance, analysis.padded_duration, analysis.tempo
+        cached = analysis_cache.load(key) if use_cache else None
+    if cached is not None:
+        print(f"Using cached analysis for {input_mp3}")
+        return AudioAnalysis(**cached)
+    
+    if streaming:
+        with timer.stage("features"):
+            streamed = stream_analysis.stream_onset_envelopes(input_mp3, settings.sr, settings.n_fft, settings.hop_length)
+        with timer.stage("tempo"):
+            tempo = stream_analysis.estimate_tempo(streamed.beat_envelope, streamed.sr, streamed.hop_length)
+        analysis = analyze_envelopes(
+            streamed.beat_envelope, streamed.onset_envelope, streamed.sr, streamed.hop_length,
+            streamed.duration, bpm=tempo, tier=tier, timer=timer
         )
-        print(f"Final total notes: {len(events)}")
-        
-        # Create and save MIDI file
-        return self.create_midi_file(events, analysis.tempo, self.output_midi)
+    else:
+        with timer.stage("decode"):
+            y, sr = audio_decode.load_audio(input_mp3, settings.sr, use_cache=use_cache, audio_hash=audio_hash)
+        analysis = analyze_signal(y, sr, tier=tier, timer=timer)
+    
+    with timer.stage("cache"):
+        analysis_cache.store(key, analysis.model_dump())
+    return analysis
+
+def spectral_features(y: np.ndarray, sr: int, tier: str = DEFAULT_TIER):
+    """
+    Compute the STFT and log-mel spectrogram once and derive both onset envelopes from it:
+    the median-aggregated one librosa uses for beat tracking and the mean-aggregated one
+    used for onset picking and velocities. The quality tier separates out the percussive
+    part of the spectrum first and picks onsets from per-band envelopes; the fast tier
+    uses the onset envelope for beat tracking too.
+    """
+    settings = ANALYSIS_TIERS[tier]
+    magnitude = np.abs(librosa.stft(y, n_fft=settings.n_fft, hop_length=settings.hop_length))
+    if settings.percussive:
+        _, magnitude = librosa.decompose.hpss(magnitude)
+    mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=magnitude ** 2, sr=sr, n_mels=settings.n_mels))
+    del magnitude
+    
+    envelope_args = dict(sr=sr, hop_length=settings.hop_length, n_fft=settings.n_fft)
+    if settings.multiband:
+        channels = np.linspace(0, settings.n_mels, MULTIBAND_BANDS + 1).astype(int)
+        bands = librosa.onset.onset_strength_multi(S=mel_db, channels=channels, **envelope_args)
+        # Normalise each band so quiet high-frequency hits count as much as loud bass ones
+        onset_envelope = np.mean(bands / np.maximum(bands.max(axis=1, keepdims=True), 1e-10), axis=0)
+    else:
+        onset_envelope = librosa.onset.onset_strength(S=mel_db, **envelope_args)
+    if settings.shared_envelope:
+        beat_envelope = onset_envelope
+    else:
+        beat_envelope = librosa.onset.onset_strength(S=mel_db, aggregate=np.median, **envelope_args)
+    return beat_envelope, onset_envelope
 
-def load_and_analyze_audio(input_mp3: str) -> AudioAnalysis:
-    """Load audio file and analyze for BPM, beats, and onsets."""
-    y, sr = librosa.load(input_mp3, sr=22050)
+def analyze_signal(y: np.ndarray, sr: int, tier: str = DEFAULT_TIER, timer: Optional[StageTimer] = None) -> AudioAnalysis:
+    """
+    Analyze an already decoded mono signal for BPM, beats, and onsets.
+    Beat tracking, peak picking and the strength lookup all share one spectrogram;
+    the waveform itself is not kept in the result.
+    """
+    timer = timer or StageTimer()
     duration = librosa.get_duration(y=y, sr=sr)
+    with timer.stage("features"):
+        beat_envelope, onset_strengths = spectral_features(y, sr, tier=tier)
+    return analyze_envelopes(
+        beat_envelope, onset_strengths, sr, ANALYSIS_TIERS[tier].hop_length, duration, tier=tier, timer=timer
+    )
+
+def analyze_envelopes(beat_envelope: np.ndarray, onset_strengths: np.ndarray, sr: int,
+                      hop_length: int, duration: float, bpm: Optional[float] = None,
+                      tier: str = DEFAULT_TIER, timer: Optional[StageTimer] = None) -> AudioAnalysis:
+    """
+    Track beats and pick onsets from precomputed onset envelopes (frames `hop_length` samples apart).
+    The tempo is estimated from the beat envelope unless `bpm` is given.
+    """
+    timer = timer or StageTimer()
     padded_duration = duration + 2.0
     
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+    with timer.stage("beats"):
+        tempo, beat_frames = librosa.beat.beat_track(onset_envelope=beat_envelope, sr=sr, hop_length=hop_length, bpm=bpm)
     if isinstance(tempo, np.ndarray):
         tempo = float(tempo[0])
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
     
-    onset_frames = librosa.onset.onset_detect(y=y, sr=sr)
-    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-    onset_strengths = librosa.onset.onset_strength(y=y, sr=sr)
+    with timer.stage("onsets"):
+        onset_frames = librosa.onset.onset_detect(onset_envelope=onset_strengths, sr=sr, hop_length=hop_length)
+    onset_times = librosa.frames_to_time(onset_frames, sr=sr, hop_length=hop_length)
     
     return AudioAnalysis(
-        y=y, sr=sr, duration=duration, padded_duration=padded_duration,
+        sr=sr, duration=duration, padded_duration=padded_duration,
         tempo=tempo, beat_times=beat_times, onset_frames=onset_frames,
-        onset_times=onset_times, onset_strengths=onset_strengths
+        onset_times=onset_times, onset_strengths=onset_strengths, tier=tier
     )
 
 def calculate_note_parameters(duration: float, tempo: float, difficulty: int) -> NoteParameters:
@@ -283,209 +291,336 @@ def calculate_note_parameters(duration: float, tempo: float, difficulty: int) ->
     
     return NoteParameters(max_notes=max_notes, tolerance=tol)
 
-def process_onset_velocities(onset_times, onset_frames, onset_strengths):
-    """Process onset strengths into MIDI velocities."""
+def process_onset_velocities(onset_times, onset_frames, onset_strengths, strength_scale: Optional[float] = None):
+    """
+    Process onset strengths into MIDI velocities, relative to the strongest onset, or to
+    `strength_scale` when the strengths are only part of the song.
+    """
+    if len(onset_frames) == 0:
+        return {}
     onset_strengths = onset_strengths[onset_frames]
-    onset_velocities = np.clip(onset_strengths * 127 / onset_strengths.max(), 40, 127).astype(int)
+    scale = strength_scale if strength_scale is not None else onset_strengths.max()
+    onset_velocities = np.clip(onset_strengths * 127 / max(scale, 1e-10), 40, 127).astype(int)
     return dict(zip(onset_times, onset_velocities))
 
+def any_close(times, sorted_ref, atol):
+    """
+    For every entry of `times`, whether `np.any(np.isclose(t, sorted_ref, atol=atol))` holds.
+    Only the nearest reference on each side of `t` can satisfy isclose, so a
+    `searchsorted` lookup replaces the scan over the whole reference array.
+    """
+    times = np.asarray(times, dtype=float)
+    sorted_ref = np.asarray(sorted_ref, dtype=float)
+    if len(sorted_ref) == 0:
+        return np.zeros(len(times), dtype=bool)
+    idx = np.searchsorted(sorted_ref, times)
+    left = sorted_ref[np.maximum(idx - 1, 0)]
+    right = sorted_ref[np.minimum(idx, len(sorted_ref) - 1)]
+    return np.isclose(times, left, atol=atol) | np.isclose(times, right, atol=atol)
+
+def first_within(times, sorted_ref, tol):
+    """
+    For every entry of `times`, the index of the first `sorted_ref` entry with
+    `abs(t - ref) < tol`, or -1 when there is none.
+    """
+    times = np.asarray(times, dtype=float)
+    sorted_ref = np.asarray(sorted_ref, dtype=float)
+    result = np.full(len(times), -1, dtype=np.intp)
+    if len(sorted_ref) == 0:
+        return result
+    # The first match is the entry right after `t - tol`; one extra candidate on each
+    # side covers rounding in `t - tol`. Assign in reverse so the lowest index wins.
+    start = np.searchsorted(sorted_ref, times - tol) - 1
+    for k in (2, 1, 0):
+        idx = start + k
+        valid = (idx >= 0) & (idx < len(sorted_ref))
+        idx = np.clip(idx, 0, len(sorted_ref) - 1)
+        hit = valid & (np.abs(times - sorted_ref[idx]) < tol)
+        result[hit] = idx[hit]
+    return result
+
 def generate_initial_events(all_times, beat_times, onset_times, onset_velocity_map, tol):
-    """Generate initial event list with notes and velocities."""
+    """
+    Generate initial event list with notes and velocities.
+    Each time takes the velocity of the first onset within `tol` (64 if none); times that are
+    both a beat and an onset get both pitches, the rest alternate between left and right.
+    Beat times, onset times and the velocity map keys must be in ascending order, as
+    produced by librosa and `process_onset_velocities`.
+    """
+    all_times = np.asarray(all_times, dtype=float)
+    map_times = np.fromiter(onset_velocity_map.keys(), dtype=float, count=len(onset_velocity_map))
+    map_velocities = np.fromiter(onset_velocity_map.values(), dtype=int, count=len(onset_velocity_map))
+
+    onset_idx = first_within(all_times, map_times, tol)
+    velocities = np.full(len(all_times), 64, dtype=int)
+    matched = onset_idx >= 0
+    velocities[matched] = map_velocities[onset_idx[matched]]
+    is_both = any_close(all_times, beat_times, tol) & any_close(all_times, onset_times, tol)
+
     events = []
-    for t in all_times:
-        velocity = 64
-        for onset_time, onset_vel in onset_velocity_map.items():
-            if abs(t - onset_time) < tol:
-                velocity = onset_vel
-                break
-            
-        is_beat = np.any(np.isclose(t, beat_times, atol=tol))
-        is_onset = np.any(np.isclose(t, onset_times, atol=tol))
-        
-        if is_beat and is_onset:
+    for i, (t, velocity, both) in enumerate(zip(all_times.tolist(), velocities.tolist(), is_both.tolist())):
+        if both:
             events.append((t, [67, 72], velocity))
+        elif i % 2 == 0:
+            events.append((t, [67], velocity))
         else:
-            if len(events) % 2 == 0:
-                events.append((t, [67], velocity))
-            else:
-                events.append((t, [72], velocity))
+            events.append((t, [72], velocity))
     return events
 
-def calculate_note_importance(event, beat_times, tol, tempo):
-    """Calculate importance score for a note based on musical features."""
-    time, pitches, velocity = event
-    
-    # Check if note falls on a beat
-    is_beat = np.any(np.isclose(time, beat_times, atol=tol))
+def nearest_distance(times, sorted_ref):
+    """For every entry of `times`, the distance to the closest `sorted_ref` entry (inf if there is none)."""
+    times = np.asarray(times, dtype=float)
+    sorted_ref = np.asarray(sorted_ref, dtype=float)
+    if len(sorted_ref) == 0:
+        return np.full(len(times), np.inf)
+    idx = np.searchsorted(sorted_ref, times)
+    left = sorted_ref[np.maximum(idx - 1, 0)]
+    right = sorted_ref[np.minimum(idx, len(sorted_ref) - 1)]
+    return np.minimum(np.abs(times - left), np.abs(times - right))
+
+def note_importance(times, velocities, beat_times, tol, tempo):
+    """Calculate importance scores for many notes at once based on musical features."""
+    velocities = np.asarray(velocities)
+    # Check if notes fall on a beat
+    is_beat = any_close(times, beat_times, tol)
     
     # Calculate position within the beat (0.0 to 1.0)
-    beat_position = min([abs(time - beat) for beat in beat_times])
+    beat_position = nearest_distance(times, beat_times)
     beat_alignment = 1.0 - (beat_position / (60.0 / tempo))
     
-    # Combine factors into importance score
-    importance = (
-        velocity / 127.0 * 0.4 +  # Velocity importance (40%)
-        (1.5 if is_beat else 0.0) * 0.4 +  # Beat importance (40%)
+    # Combine factors into importance scores
+    return (
+        velocities / 127.0 * 0.4 +  # Velocity importance (40%)
+        np.where(is_beat, 1.5, 0.0) * 0.4 +  # Beat importance (40%)
         beat_alignment * 0.2  # Beat alignment importance (20%)
     )
+
+def calculate_note_importance(event, beat_times, tol, tempo):
+    """Calculate importance score for a note based on musical features."""
+    time, pitches, velocity = event
+    return float(note_importance([time], [velocity], beat_times, tol, tempo)[0])
+
+def phrase_starts(times, velocities, beat_times):
+    """
+    Indices where musical phrases start, based on velocity patterns and beat structure.
+    A new phrase starts on a significant velocity change once the current phrase has more
+    than 4 notes, or on a strong beat once it has more than 8.
+    """
+    velocities = np.asarray(velocities)
+    if len(velocities) == 0:
+        return np.zeros(0, dtype=np.intp)
+    velocity_threshold = 20  # Minimum velocity change to mark phrase boundary
+    
+    # Check for significant velocity change or strong beat
+    is_strong_beat = any_close(times, np.asarray(beat_times)[::2], 0.05)
+    velocity_change = np.abs(np.diff(velocities, prepend=velocities[0])) > velocity_threshold
     
-    return importance
+    # Only the phrase length carries state from one note to the next, so walk the
+    # candidate positions rather than every note.
+    candidates = np.flatnonzero(is_strong_beat | velocity_change)
+    starts = [0]
+    for i, change, strong in zip(
+        candidates.tolist(), velocity_change[candidates].tolist(), is_strong_beat[candidates].tolist()
+    ):
+        phrase_length = i - starts[-1]
+        if (change and phrase_length > 4) or (strong and phrase_length > 8):
+            starts.append(i)
+    return np.array(starts, dtype=np.intp)
 
 def detect_phrases(events, beat_times):
     """Detect musical phrases based on velocity patterns and beat structure."""
     if not events:
         return []
-        
-    phrases = []
-    current_phrase = []
-    last_velocity = events[0][2]
-    velocity_threshold = 20  # Minimum velocity change to mark phrase boundary
-    
-    for event in events:
-        time, pitches, velocity = event
-        
-        # Check for significant velocity change or strong beat
-        is_strong_beat = any(np.isclose(time, beat_times[::2], atol=0.05))
-        velocity_change = abs(velocity - last_velocity) > velocity_threshold
-        
-        if (velocity_change and len(current_phrase) > 4) or (is_strong_beat and len(current_phrase) > 8):
-            if current_phrase:
-                phrases.append(current_phrase)
-            current_phrase = []
-        
-        current_phrase.append(event)
-        last_velocity = velocity
-    
-    if current_phrase:
-        phrases.append(current_phrase)
-        
-    return phrases
+    times = np.array([event[0] for event in events], dtype=float)
+    velocities = np.array([event[2] for event in events])
+    bounds = phrase_starts(times, velocities, beat_times).tolist() + [len(events)]
+    return [events[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def top_k_indices(scores, k):
+    """
+    Indices of the `k` highest scores in ascending index order. Ties at the cut-off go
+    to the earlier index, matching a stable descending sort.
+    """
+    n = len(scores)
+    if k >= n:
+        return np.arange(n)
+    kth = scores[np.argpartition(scores, n - k)[n - k]]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    return np.sort(np.concatenate([above, ties]))
 
 def downsample_events(events, max_notes, beat_times, tol, total_duration, tempo):
-    """Downsample events using musical phrase detection and note importance."""
-    # Detect musical phrases
-    phrases = detect_phrases(events, beat_times)
+    """
+    Downsample events using musical phrase detection and note importance.
+    Events must be in time order, as produced by `generate_initial_events`.
+    """
+    if not events:
+        return []
+    times = np.array([event[0] for event in events], dtype=float)
+    velocities = np.array([event[2] for event in events])
     
-    # Calculate target notes per phrase proportionally
-    total_events = sum(len(phrase) for phrase in phrases)
-    processed_phrases = []
+    # Detect musical phrases and score every note once
+    bounds = phrase_starts(times, velocities, beat_times).tolist() + [len(events)]
+    importance = note_importance(times, velocities, beat_times, tol, tempo)
     
-    for phrase in phrases:
-        # Calculate target notes for this phrase
-        phrase_ratio = len(phrase) / total_events
+    total_events = len(events)
+    keep = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # Calculate target notes for this phrase proportionally
+        phrase_ratio = (end - start) / total_events
         target_notes = max(1, int(max_notes * phrase_ratio))
         
-        if len(phrase) > target_notes:
-            # Calculate importance scores for all notes in the phrase
-            importance_scores = [
-                (event, calculate_note_importance(event, beat_times, tol, tempo))
-                for event in phrase
-            ]
-            
-            # Sort by importance and keep top notes
-            importance_scores.sort(key=lambda x: x[1], reverse=True)
-            phrase = [event for event, _ in importance_scores[:target_notes]]
-            
-            # Resort by time
-            phrase.sort(key=lambda x: x[0])
-        
-        processed_phrases.extend(phrase)
+        if end - start > target_notes:
+            # Keep the most important notes, in time order
+            keep.append(start + top_k_indices(importance[start:end], target_notes))
+        else:
+            keep.append(np.arange(start, end))
     
-    return processed_phrases
+    return [events[i] for i in np.concatenate(keep).tolist()]
 
 def create_midi_file(events, tempo, output_midi):
     """Create and save the MIDI file from the processed events."""
-    mid = MidiFile()
-    track = MidiTrack()
-    mid.tracks.append(track)
-    
-    midi_tempo = bpm2tempo(float(tempo))
-    track.append(MetaMessage('set_tempo', tempo=midi_tempo, time=0))
-    ticks_per_beat = mid.ticks_per_beat
-    ticks_per_second = ticks_per_beat * (tempo / 60.0)
-    
-    midi_messages = generate_midi_messages(events, ticks_per_second)
-    write_midi_messages(track, midi_messages)
-    
-    mid.save(output_midi)
+    write_beatmap_midi(events, tempo, output_midi)
     return int(tempo)
 
-def generate_midi_messages(events, ticks_per_second):
-    """Generate MIDI messages from events."""
-    midi_messages = []
-    min_duration = 60
-    
-    for i, (t, pitches, velocity) in enumerate(events):
-        note_on_tick = int(t * ticks_per_second)
-        
-        if i < len(events) - 1:
-            next_time = events[i + 1][0]
-            duration = int((next_time - t) * ticks_per_second * 0.8)
-            duration = max(duration, min_duration)
-        else:
-            duration = int(2.0 * ticks_per_second)
-        
-        for pitch in pitches:
-            midi_messages.append((note_on_tick, Message('note_on', note=pitch, velocity=velocity, time=0)))
-            midi_messages.append((note_on_tick + duration, Message('note_off', note=pitch, velocity=velocity, time=0)))
-    
-    return sorted(midi_messages, key=lambda x: (x[0], 0 if x[1].type == 'note_on' else 1))
-
-def write_midi_messages(track, midi_messages):
-    """Write MIDI messages to the track with proper timing."""
-    current_tick = 0
-    for abs_tick, msg in midi_messages:
-        delta = max(0, abs_tick - current_tick)
-        msg.time = delta
-        current_tick = abs_tick
-        track.append(msg)
-
-def process_audio_to_midi(input_mp3: str, output_midi: str, difficulty: int = 2) -> float:
+DIFFICULTIES = (1, 2, 3, 4, 5)
+
+def generate_candidate_events(analysis: AudioAnalysis, tolerance: float, strength_scale: Optional[float] = None):
     """
-    Creates a MIDI beatmap from an MP3 file based on difficulty level (1-5).
-    Returns the detected BPM of the song.
+    Build the full candidate event list that every difficulty is downsampled from.
+    See `process_onset_velocities` for `strength_scale`.
     """
-    # Load and analyze audio
-    analysis = load_and_analyze_audio(input_mp3)
-    print(f"Estimated BPM: {analysis.tempo:.2f}")
-    
-    # Calculate parameters
-    params = calculate_note_parameters(analysis.duration, analysis.tempo, difficulty)
-    print(f"Targeting {params.max_notes} notes for difficulty {difficulty} "
-          f"({difficulty * 30} notes per minute)")
-    print(f"Using tolerance: {params.tolerance:.3f} seconds")
-    
-    # Process onsets and generate events
     onset_velocity_map = process_onset_velocities(
         analysis.onset_times,
         analysis.onset_frames,
-        analysis.onset_strengths
+        analysis.onset_strengths,
+        strength_scale
     )
     all_times = np.union1d(analysis.beat_times, analysis.onset_times)
     all_times.sort()
     
-    events = generate_initial_events(
+    return generate_initial_events(
         all_times, analysis.beat_times, analysis.onset_times, 
-        onset_velocity_map, params.tolerance
+        onset_velocity_map, tolerance
     )
-    events = downsample_events(
-        events, params.max_notes, analysis.beat_times, 
-        params.tolerance, analysis.padded_duration, analysis.tempo
-    )
-    print(f"Final total notes: {len(events)}")
+
+def difficulty_output_path(output_midi: str, difficulty: int) -> str:
+    """`song.mid` -> `song_d3.mid`, used when writing every difficulty at once."""
+    root, ext = os.path.splitext(output_midi)
+    return f"{root}_d{difficulty}{ext or '.mid'}"
+
+def process_audio_to_midis(input_mp3: str, output_midis: Dict[int, str], tier: Optional[str] = None,
+                           queue_depth: int = 0, time_budget: float = TIME_BUDGET_SECONDS,
+                           use_cache: bool = True, profile: bool = False, log_path: Optional[str] = None,
+                           cprofile_path: Optional[str] = None, audio_hash: Optional[str] = None) -> GenerationReport:
+    """
+    Creates one MIDI beatmap per difficulty level in `output_midis` (difficulty -> path)
+    from a single audio analysis. The tolerance only depends on the tempo, so the
+    candidate events are shared and only downsampling runs per difficulty.
+    Without an explicit tier, one is chosen from the song length, `queue_depth` and `time_budget`.
+    With `profile`, the peak RSS of each stage is recorded as well; with `log_path` the
+    job's report is appended to that rolling log, and with `cprofile_path` the job runs
+    under cProfile and its stats are dumped there. `audio_hash` is the file's
+    `analysis_cache.content_hash`, if the caller already has it.
+    Returns the detected BPM and tempo, the analysis tier used and per-stage timings.
+    """
+    timer = StageTimer(track_memory=profile)
+    start = time.perf_counter()
+    try:
+        with cprofiled(cprofile_path) as profiled:
+            report = generate_beatmaps(input_mp3, output_midis, tier, queue_depth, time_budget, use_cache, timer,
+                                       audio_hash=audio_hash)
+    finally:
+        timer.stop()
+    if profile:
+        report.peak_rss_mb = timer.peak_rss_mb()
+    if log_path is not None:
+        append_profile_log({
+            "finished": datetime.datetime.now().isoformat(timespec="seconds"),
+            "audio": os.path.basename(input_mp3),
+            "difficulties": sorted(output_midis),
+            "total_seconds": round(time.perf_counter() - start, 4),
+            "cprofile": cprofile_path if profiled else None,
+            **report.model_dump(),
+        }, log_path)
+    return report
+
+def generate_beatmaps(input_mp3: str, output_midis: Dict[int, str], tier: Optional[str], queue_depth: int,
+                      time_budget: float, use_cache: bool, timer: StageTimer,
+                      audio_hash: Optional[str] = None) -> GenerationReport:
+    if tier is None:
+        tier = choose_tier(audio_duration(input_mp3), queue_depth, time_budget)
+    print(f"Using {tier} analysis tier")
+    
+    # Load and analyze audio
+    analysis = load_and_analyze_audio(input_mp3, use_cache=use_cache, tier=tier, timer=timer, audio_hash=audio_hash)
+    print(f"Estimated BPM: {analysis.tempo:.2f}")
     
-    # Create and save MIDI file
-    return create_midi_file(events, analysis.tempo, output_midi)
+    tolerance = calculate_note_parameters(analysis.duration, analysis.tempo, DIFFICULTIES[0]).tolerance
+    print(f"Using tolerance: {tolerance:.3f} seconds")
+    
+    # Process onsets and generate events
+    with timer.stage("events"):
+        candidates = generate_candidate_events(analysis, tolerance)
+    
+    bpm = int(analysis.tempo)
+    for difficulty, output_midi in sorted(output_midis.items()):
+        params = calculate_note_parameters(analysis.duration, analysis.tempo, difficulty)
+        print(f"Targeting {params.max_notes} notes for difficulty {difficulty} "
+              f"({difficulty * 30} notes per minute)")
+        
+        with timer.stage("downsample"):
+            events = downsample_events(
+                candidates, params.max_notes, analysis.beat_times, 
+                params.tolerance, analysis.padded_duration, analysis.tempo
+            )
+        print(f"Final total notes: {len(events)}")
+        
+        # Create and save MIDI file
+        with timer.stage("midi"):
+            bpm = create_midi_file(events, analysis.tempo, output_midi)
+    return GenerationReport(bpm=bpm, tempo=analysis.tempo, tier=analysis.tier, timings=timer.rounded())
+
+def process_audio_to_midi(input_mp3: str, output_midi: str, difficulty: int = 2, tier: Optional[str] = DEFAULT_TIER,
+                          profile: bool = False, log_path: Optional[str] = None,
+                          cprofile_path: Optional[str] = None) -> float:
+    """
+    Creates a MIDI beatmap from an MP3 file based on difficulty level (1-5).
+    Returns the detected BPM of the song. See `process_audio_to_midis` for the profiling options.
+    """
+    return process_audio_to_midis(
+        input_mp3, {difficulty: output_midi}, tier=tier,
+        profile=profile, log_path=log_path, cprofile_path=cprofile_path
+    ).bpm
 
 def main():
     import sys
+    profile = "--profile" in sys.argv
+    if profile:
+        sys.argv.remove("--profile")
     if len(sys.argv) < 3:
-        print("Usage: python make_beatmap.py input.mp3 output.mid [difficulty]")
+        print(f"Usage: python make_beatmap.py input.mp3 output.mid [difficulty|all] [{'|'.join(ANALYSIS_TIERS)}|auto] [--profile]")
     else:
         i_mp3 = sys.argv[1]
         o_midi = sys.argv[2]
-        diff = int(sys.argv[3]) if len(sys.argv) > 3 else 2
-        process_audio_to_midi(i_mp3, o_midi, diff)
+        tier = sys.argv[4] if len(sys.argv) > 4 else DEFAULT_TIER
+        if tier == "auto":
+            tier = None
+        if len(sys.argv) > 3 and sys.argv[3] == "all":
+            outputs = {d: difficulty_output_path(o_midi, d) for d in DIFFICULTIES}
+        else:
+            outputs = {int(sys.argv[3]) if len(sys.argv) > 3 else 2: o_midi}
+        cprofile_path = f"{os.path.splitext(o_midi)[0]}.prof" if profile else None
+        report = process_audio_to_midis(
+            i_mp3, outputs, tier=tier, profile=profile,
+            log_path=PROFILE_LOG if profile else None, cprofile_path=cprofile_path
+        )
+        print(f"Analysis tier: {report.tier}")
+        for stage, seconds in report.timings.items():
+            peak = f"  peak RSS {report.peak_rss_mb[stage]:8.1f} MB" if report.peak_rss_mb else ""
+            print(f"  {stage:10s} {seconds:8.3f} s{peak}")
+        if cprofile_path:
+            print(f"cProfile stats written to {cprofile_path}")
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,3 @@
-import pretty_midi
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple, Deque
 from score import Judgement
@@ -73,6 +72,18 @@ def parse_midi(midi_path: str) -> Dict[str, List[Note]]:
     and the value is a list of Note objects (sorted by start time) associated with that move.
     Only pitches that exist in `pitch_to_move` are included.
     """
+    notes_by_move, _ = parse_midi_with_tempo(midi_path)
+    return notes_by_move
+
+
+def parse_midi_with_tempo(midi_path: str) -> Tuple[Dict[str, List[Note]], float]:
+    """
+    Same as `parse_midi`, but also returns the tempo estimated from the MIDI file,
+    which is the BPM the note subdivisions were computed against.
+    """
+    # Imported lazily: only needed when a beatmap has to be (re)compiled, not at API startup.
+    import pretty_midi
+
     midi_data = pretty_midi.PrettyMIDI(midi_path)
     bpm = midi_data.estimate_tempo()
     print(f"Estimated BPM from MIDI: {bpm:.2f}")
@@ -99,7 +110,7 @@ def parse_midi(midi_path: str) -> Dict[str, List[Note]]:
     for move, note_list in notes_by_move.items():
         note_list.sort(key=lambda n: n.start)
     
-    return notes_by_move
+    return notes_by_move, bpm
 
 # Editable ranking thresholds for early and late hits.
 # Each value is the fraction of the threshold that determines the ranking.
@@ -235,6 +246,11 @@ class BeatmapSession:
             sorted_notes = sorted(notes, key=lambda n: n.start)
             self.move_queues[move] = deque(sorted_notes)
             
+    def extend(self, notes_by_move: Dict[str, List[Note]]):
+        """Queue notes that start after every note already queued, e.g. a newly charted segment."""
+        for move, notes in notes_by_move.items():
+            self.move_queues.setdefault(move, deque()).extend(sorted(notes, key=lambda n: n.start))
+
     def get_remaining_notes(self) -> int:
         """Return total number of remaining notes across all moves."""
         return sum(len(q) for q in self.move_queues.values())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 
 
 class Song(BaseModel):
@@ -9,6 +9,8 @@ class Song(BaseModel):
     song: str
     bpm: int
     difficulty: int
+    tier: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 class GetSongsResponse(BaseModel):
     songs: List[Song]
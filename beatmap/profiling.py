@@ -0,0 +1,157 @@
+"""
+Per-stage profiling for beatmap generation jobs.
+
+`StageTimer` accumulates wall time per named stage and, when memory tracking is
+on, the peak resident set size seen during each stage, sampled by a background
+thread. Job summaries can be appended to a size-rotated JSON-lines log, and a
+job can be run under cProfile with its stats dumped for a deeper look.
+"""
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+PROFILE_LOG = os.path.join(PROFILE_DIR, "generation_profile.jsonl")
+PROFILE_LOG_MAX_BYTES = 1024 * 1024
+PROFILE_LOG_BACKUPS = 3
+RSS_SAMPLE_SECONDS = 0.005
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# From Python 3.12 cProfile holds the process-wide sys.monitoring profiler slot, so only
+# one job can be profiled at a time
+_CPROFILE_LOCK = threading.Lock()
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None where it cannot be read."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def max_rss() -> int:
+    """Highest resident set size this process has reached, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """Accumulates wall time (and optionally peak RSS) per named stage of a beatmap generation job."""
+
+    def __init__(self, track_memory: bool = False):
+        self.timings: Dict[str, float] = {}
+        self.peak_rss: Dict[str, int] = {}
+        self.track_memory = track_memory
+        self._stage_peak = 0
+        self._sampling = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while self._sampling.is_set():
+            rss = current_rss()
+            if rss is not None:
+                self._stage_peak = max(self._stage_peak, rss)
+            time.sleep(RSS_SAMPLE_SECONDS)
+
+    def _rss(self) -> int:
+        rss = current_rss()
+        # Without a current RSS reading, fall back to the process high-water mark
+        return max_rss() if rss is None else rss
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.track_memory:
+            self._stage_peak = self._rss()
+            if self._sampler is None:
+                self._sampling.set()
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+            if self.track_memory:
+                peak = max(self._stage_peak, self._rss())
+                self.peak_rss[name] = max(self.peak_rss.get(name, 0), peak)
+
+    def stop(self):
+        """Stop the memory sampler, if it was started."""
+        if self._sampler is not None:
+            self._sampling.clear()
+            self._sampler.join()
+            self._sampler = None
+
+    def rounded(self, digits: int = 4) -> Dict[str, float]:
+        return {name: round(seconds, digits) for name, seconds in self.timings.items()}
+
+    def peak_rss_mb(self) -> Dict[str, float]:
+        return {name: round(peak / 1e6, 1) for name, peak in self.peak_rss.items()}
+
+
+@contextmanager
+def cprofiled(stats_path: Optional[str]):
+    """
+    Run the block under cProfile and dump its stats to `stats_path` (no-op when None).
+    Yields whether the block is profiled: while another job holds the profiler the block
+    runs unprofiled with a warning, as profiling must never fail or hold up the job.
+    """
+    if stats_path is None:
+        yield False
+        return
+    if not _CPROFILE_LOCK.acquire(blocking=False):
+        print(f"Warning: another job is being profiled, not writing {stats_path}")
+        yield False
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # A profiler outside this module is already active
+            print(f"Warning: could not start cProfile ({e}), not writing {stats_path}")
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            profiler.disable()
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(stats_path)), exist_ok=True)
+                profiler.dump_stats(stats_path)
+            except OSError as e:
+                print(f"Could not write cProfile stats {stats_path}: {e}")
+    finally:
+        _CPROFILE_LOCK.release()
+
+
+def rotate(log_path: str, backups: int = PROFILE_LOG_BACKUPS):
+    """Shift `log_path` to `.1`, `.1` to `.2` and so on, dropping the oldest."""
+    for i in range(backups - 1, 0, -1):
+        if os.path.exists(f"{log_path}.{i}"):
+            os.replace(f"{log_path}.{i}", f"{log_path}.{i + 1}")
+    os.replace(log_path, f"{log_path}.1")
+
+
+def append_profile_log(record: Dict, log_path: str = PROFILE_LOG, max_bytes: int = PROFILE_LOG_MAX_BYTES):
+    """Append `record` as one JSON line, rotating the log once it grows past `max_bytes`."""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        if os.path.exists(log_path) and os.path.getsize(log_path) >= max_bytes:
+            rotate(log_path)
+        with open(log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Could not write profile log {log_path}: {e}")
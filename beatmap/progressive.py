@@ -0,0 +1,261 @@
+"""
+Progressive beatmap generation: the song is charted window by window and each
+finished window is published as a segment of notes, so a freshly uploaded song
+can be played while its later sections are still being analysed.
+
+The first window is short so the first segment is ready within a couple of
+seconds; the tempo estimated from it is kept while charting, so every published
+segment shares one beat grid. Each window is analysed with CONTEXT_SECONDS of
+audio on both sides so beats and onsets near its edges are found, and only events
+inside the window are kept. Notes are budgeted cumulatively, so the published
+segments have as many notes as a whole-song run at the same difficulty.
+Velocities are scaled by the strongest onset found so far rather than each
+window's own, so loudness carries across segment boundaries.
+
+A few seconds of audio are not enough to estimate the tempo of a whole song (on
+payphone.mp3 the first window gives 73.8 BPM, the whole file 112.3). Windows
+start on the song's own frame grid, so the onset envelopes of their inner parts
+are stitched into the envelopes of the whole song; once every window is done,
+the tempo, beats and onsets are found on those like a whole-song run would, and
+the MIDI file is charted from them. `bpm` then holds the final tempo.
+
+Formats libsndfile reads are decoded window by window, which seeks; others (m4a
+through audioread) can only be decoded from the start, so they are decoded once
+into the PCM cache and every window is sliced from it.
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from midi import Note, get_note_subdivision, pitch_to_move
+
+FIRST_SEGMENT_SECONDS = 10.0
+SEGMENT_SECONDS = 30.0
+CONTEXT_SECONDS = 2.0
+MIN_NOTE_SECONDS = 0.05
+
+# Jobs that are still charting, keyed by output MIDI path
+JOBS: Dict[str, "ProgressiveJob"] = {}
+_JOBS_LOCK = threading.Lock()
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    notes: Dict[str, List[Note]]
+
+
+def window_bounds(duration: float) -> List[tuple]:
+    """(start, end) of every analysis window: a short first window, then SEGMENT_SECONDS each."""
+    bounds = []
+    start, end = 0.0, min(duration, FIRST_SEGMENT_SECONDS)
+    while start < duration:
+        bounds.append((start, end))
+        start, end = end, min(duration, end + SEGMENT_SECONDS)
+    return bounds
+
+
+def events_to_notes(events, bpm: float) -> Dict[str, List[Note]]:
+    """
+    Notes per move for time-ordered (time, pitches, velocity) events. Durations follow
+    `midi_writer.note_messages`: 80% of the gap to the next event, 2 s for the last.
+    """
+    notes_by_move: Dict[str, List[Note]] = {}
+    for i, (t, pitches, _) in enumerate(events):
+        if i < len(events) - 1:
+            duration = max((events[i + 1][0] - t) * 0.8, MIN_NOTE_SECONDS)
+        else:
+            duration = 2.0
+        subdivision = get_note_subdivision(duration, bpm)
+        for pitch in pitches:
+            move = pitch_to_move.get(pitch)
+            if move is None:
+                continue
+            notes_by_move.setdefault(move, []).append(
+                Note(move_type=move, start=t, duration=duration, subdivision=subdivision)
+            )
+    return notes_by_move
+
+
+def merge_notes(segments: List[Segment]) -> Dict[str, List[Note]]:
+    """Notes of consecutive segments, per move."""
+    notes_by_move: Dict[str, List[Note]] = {}
+    for segment in segments:
+        for move, notes in segment.notes.items():
+            notes_by_move.setdefault(move, []).extend(notes)
+    return notes_by_move
+
+
+class ProgressiveJob:
+    """A beatmap being charted window by window; published segments can be read while it runs."""
+
+    def __init__(self, audio_path: str, midi_path: str, difficulty: int, tier: Optional[str] = None,
+                 audio_hash: Optional[str] = None):
+        self.audio_path = audio_path
+        self.audio_hash = audio_hash # content hash for the PCM cache, computed when charting if not given
+        self.midi_path = midi_path
+        self.difficulty = difficulty
+        self.tier = tier
+        self.bpm: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.ready = threading.Event() # set by the first segment, or when the job ends without one
+        self.done = threading.Event()
+        self._segments: List[Segment] = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.done.is_set()
+
+    def publish(self, segment: Segment):
+        with self._lock:
+            self._segments.append(segment)
+        self.ready.set()
+
+    def segments_since(self, index: int) -> List[Segment]:
+        """Segments published after the first `index` ones."""
+        with self._lock:
+            return self._segments[index:]
+
+    def notes(self) -> Dict[str, List[Note]]:
+        """All notes published so far, per move."""
+        return merge_notes(self.segments_since(0))
+
+    def wait_for_first_segment(self, timeout: Optional[float] = None) -> bool:
+        """Block until the first segment is published or the job ends. Returns whether a segment exists."""
+        self.ready.wait(timeout)
+        with self._lock:
+            return bool(self._segments)
+
+    def run(self):
+        """
+        Chart the song window by window, publishing segments, then write the MIDI file.
+        Errors are kept in `error` rather than raised, as the job runs in the background.
+        """
+        register(self)
+        try:
+            self._chart()
+        except Exception as e:
+            print(f"Progressive beatmap generation failed for {self.audio_path}: {e}")
+            self.error = e
+        finally:
+            self.done.set()
+            self.ready.set()
+            unregister(self)
+
+    def _chart(self):
+        # Imported here so the API can look up running jobs without loading librosa
+        import librosa
+        import numpy as np
+        import analysis_cache
+        import audio_decode
+        import make_beatmap
+
+        tier = self.tier = self.tier or make_beatmap.DEFAULT_TIER
+        settings = make_beatmap.ANALYSIS_TIERS[tier]
+        self.duration = make_beatmap.audio_duration(self.audio_path)
+        if self.duration is None:
+            raise ValueError(f"Could not read the duration of {self.audio_path}")
+
+        # A song decoded before is sliced from the PCM cache. Otherwise seekable formats decode each
+        # window on its own, so the first segment does not wait for the whole song; decoding a window
+        # of any other format means decoding everything before it, so the song is decoded once
+        audio_hash = self.audio_hash = self.audio_hash or analysis_cache.content_hash(self.audio_path)
+        pcm = audio_decode.cached_pcm(self.audio_path, settings.sr, audio_hash=audio_hash)
+        if pcm is None and not audio_decode.seekable(self.audio_path):
+            pcm, _ = audio_decode.load_audio(self.audio_path, settings.sr, audio_hash=audio_hash)
+
+        sr, hop_length = settings.sr, settings.hop_length
+        all_events = []
+        max_notes = None
+        tolerance = None
+        strength_scale = 0.0
+        beat_parts, onset_parts = [], []
+        for start, end in window_bounds(self.duration):
+            # Start on a frame of the whole song, so the window's envelope frames are the song's
+            first_frame = int(max(0.0, start - CONTEXT_SECONDS) * sr) // hop_length
+            offset = first_frame * hop_length / sr
+            stop = min(self.duration, end + CONTEXT_SECONDS)
+            if pcm is not None:
+                y = np.asarray(pcm[first_frame * hop_length:int(round(stop * sr))])
+            else:
+                y, _ = librosa.load(self.audio_path, sr=sr, offset=offset, duration=stop - offset)
+            beat_envelope, onset_envelope = make_beatmap.spectral_features(y, sr, tier=tier)
+            analysis = make_beatmap.analyze_envelopes(
+                beat_envelope, onset_envelope, sr, settings.hop_length, len(y) / sr, bpm=self.bpm, tier=tier
+            )
+            if self.bpm is None:
+                self.bpm = analysis.tempo
+                params = make_beatmap.calculate_note_parameters(self.duration, self.bpm, self.difficulty)
+                max_notes, tolerance = params.max_notes, params.tolerance
+                print(f"Estimated BPM: {self.bpm:.2f}, targeting {max_notes} notes")
+
+            # Keep the window's own envelope frames and events, in song time; the last window keeps
+            # everything up to the end
+            last = end >= self.duration
+            inner = slice(int(round(start * sr / hop_length)) - first_frame,
+                          None if last else int(round(end * sr / hop_length)) - first_frame)
+            beat_parts.append(beat_envelope[inner])
+            onset_parts.append(onset_envelope[inner])
+            beat_times = analysis.beat_times + offset
+            onset_times = analysis.onset_times + offset
+            in_beats = (beat_times >= start) & ((beat_times < end) | last)
+            in_onsets = (onset_times >= start) & ((onset_times < end) | last)
+            window = analysis.model_copy(update=dict(
+                beat_times=beat_times[in_beats],
+                onset_times=onset_times[in_onsets],
+                onset_frames=analysis.onset_frames[in_onsets],
+            ))
+            if len(window.onset_frames):
+                strength_scale = max(strength_scale, float(np.max(window.onset_strengths[window.onset_frames])))
+            candidates = make_beatmap.generate_candidate_events(window, tolerance, strength_scale=strength_scale)
+
+            quota = int(round(max_notes * end / self.duration)) - len(all_events)
+            events = []
+            if quota > 0:
+                events = make_beatmap.downsample_events(
+                    candidates, quota, window.beat_times, tolerance, self.duration + 2.0, self.bpm
+                )
+            all_events.extend(events)
+            self.publish(Segment(start=start, end=end, notes=events_to_notes(events, self.bpm)))
+            print(f"Published segment {start:.1f}-{end:.1f} s with {len(events)} notes")
+
+        self._write_midi(np.concatenate(beat_parts), np.concatenate(onset_parts), tier)
+
+    def _write_midi(self, beat_envelope, onset_envelope, tier: str):
+        """Chart the MIDI file from the whole song's stitched envelopes, like `make_beatmap.generate_beatmaps`."""
+        import make_beatmap
+
+        settings = make_beatmap.ANALYSIS_TIERS[tier]
+        analysis = make_beatmap.analyze_envelopes(
+            beat_envelope, onset_envelope, settings.sr, settings.hop_length, self.duration, tier=tier
+        )
+        print(f"Estimated BPM of the whole song: {analysis.tempo:.2f} (first window: {self.bpm:.2f})")
+        params = make_beatmap.calculate_note_parameters(analysis.duration, analysis.tempo, self.difficulty)
+        candidates = make_beatmap.generate_candidate_events(analysis, params.tolerance)
+        events = make_beatmap.downsample_events(
+            candidates, params.max_notes, analysis.beat_times, params.tolerance,
+            analysis.padded_duration, analysis.tempo
+        )
+        self.bpm = analysis.tempo
+        make_beatmap.create_midi_file(events, self.bpm, self.midi_path)
+
+
+def register(job: ProgressiveJob):
+    with _JOBS_LOCK:
+        JOBS[os.path.normpath(job.midi_path)] = job
+
+
+def unregister(job: ProgressiveJob):
+    with _JOBS_LOCK:
+        if JOBS.get(os.path.normpath(job.midi_path)) is job:
+            del JOBS[os.path.normpath(job.midi_path)]
+
+
+def job_for(midi_path: str) -> Optional[ProgressiveJob]:
+    """The job still charting `midi_path`, if any."""
+    with _JOBS_LOCK:
+        return JOBS.get(os.path.normpath(midi_path))
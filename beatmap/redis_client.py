@@ -1,8 +1,16 @@
-import redis
 import json
 from typing import List, Dict
 
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+_redis_client = None
+
+
+def get_redis_client():
+    """Create the Redis client on first use so importing the API does not pay for the redis package."""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    return _redis_client
 
 
 def add_score(name: str, score: int, max_streak: int) -> None:
@@ -12,6 +20,7 @@ def add_score(name: str, score: int, max_streak: int) -> None:
         'score': score,
         'max_streak': max_streak
     })
+    redis_client = get_redis_client()
     redis_client.zadd('leaderboard', {entry: score})
     # Keep only top 100 scores
     redis_client.zremrangebyrank('leaderboard', 0, -101)
@@ -19,5 +28,5 @@ def add_score(name: str, score: int, max_streak: int) -> None:
 
 def get_leaderboard() -> List[Dict]:
     """Get the top 100 scores"""
-    entries = redis_client.zrevrange('leaderboard', 0, 99, withscores=True)
+    entries = get_redis_client().zrevrange('leaderboard', 0, 99, withscores=True)
     return [json.loads(entry[0]) for entry in entries] 
\ No newline at end of file
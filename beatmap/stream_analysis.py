@@ -0,0 +1,142 @@
+"""
+Bounded-memory onset envelope extraction for long audio files.
+
+The file is read with libsndfile block by block and resampled to the analysis rate
+with soxr's streaming resampler, which gives the samples `librosa.load` would, so
+only one block of samples is alive at a time. The blocks are framed like the
+centred STFT of the whole signal, each block of frames is turned into a log-mel
+spectrogram with the same window, hop and mel bands as in memory and reduced to
+onset envelope values on the spot, carrying the last mel frame over to the next
+block for the frame difference.
+
+The one difference from `librosa.onset.onset_strength` on the decoded signal is
+the dB floor. `power_to_db` clips at TOP_DB below the loudest bin of the whole
+spectrogram, which is not known until the end, and a floor relative to each block
+moved from block to block. Here the floor is TOP_DB below the loudest bin seen so
+far, so it only differs from the in-memory one while the song is quieter than it
+gets later, and only for bins that quiet. Tempo estimation, whose tempogram
+otherwise grows with song length, is accumulated chunk by chunk as well.
+"""
+from typing import NamedTuple, Optional
+
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+
+BLOCK_FRAMES = 512 # ~12 s of audio per block at the default hop
+TEMPO_CHUNK_FRAMES = 4096
+TOP_DB = 80.0 # power_to_db's default
+RESAMPLE_QUALITY = "HQ" # what librosa.load's default soxr_hq uses
+
+
+class StreamedEnvelopes(NamedTuple):
+    beat_envelope: np.ndarray   # median over mel bands, what beat_track computes internally
+    onset_envelope: np.ndarray  # mean over mel bands, what onset_strength computes by default
+    sr: int
+    hop_length: int
+    duration: float
+
+
+def streamable_duration(path: str) -> Optional[float]:
+    """Duration of `path` if libsndfile can read it block by block (it cannot decode e.g. m4a), else None."""
+    try:
+        return sf.info(path).duration
+    except Exception:
+        return None
+
+
+def resampled_blocks(path: str, sr: int, block_samples: int):
+    """Mono blocks of `path` at `sr`, as `librosa.load(path, sr=sr)` would decode it."""
+    with sf.SoundFile(path) as f:
+        resampler = None
+        if f.samplerate != sr:
+            resampler = soxr.ResampleStream(f.samplerate, sr, 1, dtype="float32", quality=RESAMPLE_QUALITY)
+        native_block = max(1, int(block_samples * f.samplerate / sr))
+        for block in f.blocks(blocksize=native_block, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            yield mono if resampler is None else resampler.resample_chunk(mono)
+        if resampler is not None:
+            yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def stream_onset_envelopes(
+    path: str, analysis_sr: int, n_fft: int, hop_length: int, block_frames: int = BLOCK_FRAMES
+) -> StreamedEnvelopes:
+    mel_basis = librosa.filters.mel(sr=analysis_sr, n_fft=n_fft)
+    beat_blocks, onset_blocks = [], []
+    previous = None # last raw dB frame of the previous block
+    loudest = -np.inf
+    num_samples = 0
+
+    def envelopes(frames):
+        nonlocal previous, loudest
+        power = np.abs(librosa.stft(frames, n_fft=n_fft, hop_length=hop_length, center=False)) ** 2
+        mel_db = librosa.power_to_db(mel_basis @ power, top_db=None)
+        loudest = max(loudest, float(mel_db.max()))
+        if previous is not None:
+            mel_db = np.concatenate([previous, mel_db], axis=1)
+        previous = mel_db[:, -1:]
+        rise = np.maximum(0.0, np.diff(np.maximum(mel_db, loudest - TOP_DB), axis=1))
+        beat_blocks.append(np.median(rise, axis=0))
+        onset_blocks.append(np.mean(rise, axis=0))
+
+    # Centred framing: the signal is padded with n_fft // 2 zeros on both sides, and
+    # each block of frames keeps the n_fft - hop_length samples the next frame shares
+    pending = np.zeros(n_fft // 2, dtype=np.float32)
+    for samples in resampled_blocks(path, analysis_sr, block_frames * hop_length):
+        num_samples += len(samples)
+        pending = np.concatenate([pending, samples])
+        usable = (len(pending) - n_fft) // hop_length + 1
+        if usable >= block_frames:
+            envelopes(pending[:(usable - 1) * hop_length + n_fft])
+            pending = pending[usable * hop_length:]
+    pending = np.concatenate([pending, np.zeros(n_fft // 2, dtype=np.float32)])
+    if len(pending) >= n_fft:
+        envelopes(pending)
+
+    # onset_strength puts the difference of frames k and k + 1 at k + 1 + n_fft // (2 * hop)
+    n_frames = 1 + num_samples // hop_length
+    start = 1 + n_fft // (2 * hop_length)
+
+    def assemble(blocks):
+        envelope = np.zeros(n_frames, dtype=np.float32)
+        values = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+        values = values[:max(0, n_frames - start)]
+        envelope[start:start + len(values)] = values
+        return envelope
+
+    return StreamedEnvelopes(
+        beat_envelope=assemble(beat_blocks),
+        onset_envelope=assemble(onset_blocks),
+        sr=analysis_sr,
+        hop_length=hop_length,
+        duration=num_samples / analysis_sr,
+    )
+
+
+def estimate_tempo(
+    onset_envelope: np.ndarray, sr: int, hop_length: int, ac_size: float = 8.0,
+    chunk_frames: int = TEMPO_CHUNK_FRAMES
+) -> float:
+    """
+    The tempo `librosa.beat.beat_track` would estimate from `onset_envelope`, without
+    materialising the whole tempogram: its columns are computed `chunk_frames` at a time
+    from the same padded envelope and summed into the mean that `librosa.feature.tempo`
+    aggregates anyway.
+    """
+    win_length = librosa.time_to_frames(ac_size, sr=sr, hop_length=hop_length).item()
+    n = len(onset_envelope)
+    padded = np.pad(onset_envelope, win_length // 2, mode="linear_ramp", end_values=[0, 0])
+
+    total = np.zeros(win_length)
+    for start in range(0, n, chunk_frames):
+        stop = min(n, start + chunk_frames)
+        tempogram = librosa.feature.tempogram(
+            onset_envelope=padded[start:stop + win_length - 1], sr=sr, hop_length=hop_length,
+            win_length=win_length, center=False
+        )
+        total += tempogram.sum(axis=-1)
+
+    tempo = librosa.feature.tempo(tg=(total / max(n, 1))[:, None], sr=sr, hop_length=hop_length, aggregate=None)
+    return float(np.ravel(tempo)[0])
@@ -0,0 +1,52 @@
+"""
+Background warm-up for the API process.
+
+The API imports only what it needs to serve requests; librosa, numba and pretty_midi
+are loaded lazily. Right after startup this module imports them on a worker thread and
+runs the analysis pipeline once on a short synthetic click track, so the first
+`/beatmap/create` does not pay for the imports and numba JIT compilation mid-request.
+"""
+import os
+import time
+
+NUMBA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "numba")
+WARMUP_SR = 22050
+WARMUP_SECONDS = 4.0
+WARMUP_BPM = 120.0
+
+
+def configure_numba_cache():
+    """Persist numba's compiled functions so later processes load them instead of recompiling."""
+    os.environ.setdefault("NUMBA_CACHE_DIR", NUMBA_CACHE_DIR)
+    os.makedirs(os.environ["NUMBA_CACHE_DIR"], exist_ok=True)
+
+
+def click_track(sr: int = WARMUP_SR, seconds: float = WARMUP_SECONDS, bpm: float = WARMUP_BPM):
+    """A decaying noise burst on every beat, enough to exercise beat and onset detection."""
+    import numpy as np
+
+    y = np.zeros(int(sr * seconds), dtype=np.float32)
+    click = np.random.default_rng(0).standard_normal(sr // 50).astype(np.float32)
+    click *= np.exp(-np.linspace(0, 8, len(click))).astype(np.float32)
+    for start in np.arange(0, seconds, 60.0 / bpm):
+        i = int(start * sr)
+        y[i:i + len(click)] += click[:len(y) - i]
+    return y
+
+
+def warm_up() -> float:
+    """
+    Import the beatmap generation stack and prime librosa/numba caches.
+    Returns the time spent, in seconds.
+    """
+    start = time.perf_counter()
+    configure_numba_cache()
+
+    import pretty_midi  # noqa: F401
+    from make_beatmap import analyze_signal
+
+    analyze_signal(click_track(), WARMUP_SR)
+
+    elapsed = time.perf_counter() - start
+    print(f"Warm-up finished in {elapsed:.2f}s")
+    return elapsed
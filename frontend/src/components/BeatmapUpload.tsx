@@ -8,6 +8,8 @@ export default function BeatmapUpload({onSubmit}: {onSubmit: () => void}) {
   const [file, setFile] = useState<File | null>(null);
   const [loading, setLoading] = useState(false);
   const [difficulty, setDifficulty] = useState<number>(2);
+  // Opt-in: lets the song be played while later sections are still being charted
+  const [progressive, setProgressive] = useState(false);
   const { startGame, setShowSongSelect } = useContext(GameContext);
 
   const handleSubmit = async () => {
@@ -18,7 +20,7 @@ export default function BeatmapUpload({onSubmit}: {onSubmit: () => void}) {
     formData.append('audio', file);
 
     try {
-      const response = await fetch(`http://127.0.0.1:8000/beatmap/create?difficulty=${difficulty}`, {
+      const response = await fetch(`http://127.0.0.1:8000/beatmap/create?difficulty=${difficulty}${progressive ? '&progressive=true' : ''}`, {
         method: 'POST',
         body: formData,
       });
@@ -103,6 +105,21 @@ export default function BeatmapUpload({onSubmit}: {onSubmit: () => void}) {
               Higher difficulty = more notes and complexity
             </div>
           </div>
+
+          <div className="flex flex-col gap-2">
+            <label className="flex items-center gap-3 text-xl font-display cursor-pointer">
+              <input
+                type="checkbox"
+                checked={progressive}
+                onChange={(e) => setProgressive(e.target.checked)}
+                className="checkbox"
+              />
+              Play while charting
+            </label>
+            <div className="text-sm text-gray-600 mt-1">
+              Start playing after the first few seconds are charted; notes charted before the whole song is analysed may sit on a rougher beat grid
+            </div>
+          </div>
           
           <div className="flex flex-row gap-4">
             <PushButton
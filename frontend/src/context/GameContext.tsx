@@ -249,6 +249,12 @@ export const GameProvider = ({ children }: { children: ReactNode }) => {
             totalScore: data.totalScore,    // updated score if any penalty is applied
             currentStreak: 0,               // reset streak on miss
           }));
+        } else if (data.type === "notes_added") {
+          // Segments of a beatmap that was still being charted when the game started
+          setGameState(prev => ({
+            ...prev,
+            fallingDots: [...prev.fallingDots, ...data.falling_dots],
+          }));
         } else if (data.type === "game_over") {
           // First update game state
           setGameState(prev => ({
@@ -0,0 +1,111 @@
+"""
+Speed and drift benchmark for adaptive-resolution, ROI-tracked landmark extraction.
+
+Runs the frames of a video through the current full-resolution path
+(`extract_landmarks`) and through `HandTracker` at several working widths, with
+and without ROI tracking, each with a fresh Hands graph. Reports the cost per
+frame, how often the number of hands found differs from the full-resolution
+path, the mean landmark drift (normalised distance between matching landmarks of
+hands found by both) and how often the classifier's prediction differs. Exits
+with code 1 when a configuration drifts further than --max-drift or changes the
+prediction for more than --max-prediction-diff of the frames: a configuration
+only pays off if it is faster and classifies like the full-resolution path.
+
+Usage: python bench_roi.py [--video test_double.bin] [--widths 640 480 320] [--max-drift 0.05] [--max-prediction-diff 0.02]
+"""
+import argparse
+import sys
+import time
+
+import mediapipe as mp
+import numpy as np
+
+from detect_hand_position import classify, extract_landmarks, model_inputs, model_path, predicted_gestures, setup_model
+from roi_tracking import NUM_LANDMARKS, HandTracker
+from video_decode import read_frames
+
+
+def new_hands():
+    return mp.solutions.hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5)
+
+
+def run(frames, extract):
+    landmarks, start = [], time.perf_counter()
+    for frame in frames:
+        landmarks.append(extract(frame))
+    return landmarks, (time.perf_counter() - start) / len(frames)
+
+
+def drift(reference, hands):
+    """Mean distance between matching landmarks, pairing each hand with the nearest reference hand by wrist."""
+    distances = []
+    for expected, found in zip(reference, hands):
+        for hand in found:
+            if not expected:
+                continue
+            wrist = np.array([hand[0], hand[NUM_LANDMARKS]])
+            nearest = min(expected, key=lambda e: np.hypot(*(np.array([e[0], e[NUM_LANDMARKS]]) - wrist)))
+            xy = np.stack([hand[:NUM_LANDMARKS], hand[NUM_LANDMARKS:2 * NUM_LANDMARKS]])
+            xy_expected = np.stack([nearest[:NUM_LANDMARKS], nearest[NUM_LANDMARKS:2 * NUM_LANDMARKS]])
+            distances.append(np.mean(np.hypot(*(xy - xy_expected))))
+    return float(np.mean(distances)) if distances else 0.0
+
+
+def predictions(landmarks, model, use_double):
+    predicted = []
+    for frame_landmarks in landmarks:
+        rows, slots = model_inputs(frame_landmarks, use_double)
+        gestures = [None, None]
+        if rows:
+            for slot, gesture in zip(slots, predicted_gestures(classify(model, None, None, np.array(rows, dtype=np.float32)))):
+                gestures[slot] = gesture
+        predicted.append(gestures)
+    return predicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark adaptive-resolution ROI hand tracking")
+    parser.add_argument("--video", default="test_double.bin")
+    parser.add_argument("--widths", type=int, nargs="+", default=[640, 480, 320])
+    parser.add_argument("--max-drift", type=float, default=0.05)
+    parser.add_argument("--max-prediction-diff", type=float, default=0.02,
+                        help="largest share of frames whose prediction may differ from the full-resolution path")
+    parser.add_argument('--use_double', action='store_true', help="classify with the two-hand model")
+    args = parser.parse_args()
+
+    with open(args.video, "rb") as f:
+        frames = list(read_frames(f.read()))
+    path = model_path(args.use_double)
+    if not path.endswith(".npz"):
+        print(f"{path} is not a NumPy model, export one with numpy_model.py first")
+        sys.exit(1)
+    model, _, _ = setup_model(path)
+
+    hands = new_hands()
+    reference, baseline = run(frames, lambda frame: extract_landmarks(frame, hands))
+    expected = predictions(reference, model, args.use_double)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"full frame          {baseline * 1000:7.2f} ms/frame  {1 / baseline:6.1f} fps")
+
+    ok = True
+    for width in args.widths:
+        for track_roi in (False, True):
+            tracker = HandTracker(new_hands(), working_width=width, track_roi=track_roi)
+            found, cost = run(frames, tracker)
+            count_mismatch = np.mean([len(a) != len(b) for a, b in zip(reference, found)])
+            prediction_mismatch = np.mean([a != b for a, b in zip(expected, predictions(found, model, args.use_double))])
+            mean_drift = drift(reference, found)
+            failures = [name for name, failed in (("DRIFT", mean_drift > args.max_drift),
+                                                  ("PREDICTIONS", prediction_mismatch > args.max_prediction_diff)) if failed]
+            ok &= not failures
+            print(f"{width:4d} px {'roi ' if track_roi else 'full'}       {cost * 1000:7.2f} ms/frame  {1 / cost:6.1f} fps  "
+                  f"x{baseline / cost:4.2f}  hand count differs {count_mismatch:6.1%}  "
+                  f"prediction differs {prediction_mismatch:6.1%}  drift {mean_drift:.4f}  "
+                  f"full-frame searches {tracker.full_frame_searches}"
+                  f"{''.join('  ' + name for name in failures)}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,29 @@
 import cv2
 import mediapipe as mp
-import tensorflow as tf
 import numpy as np
+import os
+import hashlib
+import itertools
+import threading
 import time
+from collections import OrderedDict
 from config import *
+from numpy_model import NumpyGestureModel, NumpyMultiHeadModel, load_numpy_model
+from video_decode import frame_count, open_video, sampled_frames
+from voting import DEFAULT_STOPPING_RULE, GestureDecision, GestureVote, report_z
 
 # Define screen regions
 TOP_THRESHOLD = 0.33
 BOTTOM_THRESHOLD = 0.66
 
+# Frames decoded and classified together between checks of the stopping rule
+VOTE_BATCH_FRAMES = 8
+
+# Gesture results of recently classified segments, keyed by content hash
+RESULT_CACHE_SIZE = 256
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
 def detect_hand_position_draw(frame, hands, mp_hands, mp_drawing):
     #Unmirror the frame
     frame = cv2.flip(frame, 1)
@@ -46,7 +61,25 @@ def detect_hand_position_draw(frame, hands, mp_hands, mp_drawing):
 
     return frame, positions
 
+def model_path(use_double):
+    """The exported NumPy model if there is one, else the TFLite model."""
+    npz_path = f"./model/model_double{use_double}.npz"
+    return npz_path if os.path.exists(npz_path) else f"./model/model_double{use_double}.tflite"
+
+def combined_model_path():
+    """The exported multi-head model (see train.build_multihead_model), NumPy if there is one."""
+    npz_path = "./model/model_multihead.npz"
+    return npz_path if os.path.exists(npz_path) else "./model/model_multihead.tflite"
+
 def setup_model(tflite_save_path):
+    """
+    Load the gesture classifier. A NumPy model (.npz, see numpy_model.py) stands in
+    for the interpreter without loading TensorFlow, and has no tensor details.
+    """
+    if tflite_save_path.endswith(".npz"):
+        return load_numpy_model(tflite_save_path), None, None
+
+    import tensorflow as tf
     interpreter = tf.lite.Interpreter(model_path=tflite_save_path)
     interpreter.allocate_tensors()
 
@@ -55,59 +88,107 @@ def setup_model(tflite_save_path):
 
     return interpreter, input_details, output_details
 
-def detect_hand_position(frame, interpreter, hands, mp_hands, input_details, output_details, use_double=False):
-    """
-    Detect hand positions in a frame. For each hand, determine if it is in the top, middle, or bottom region of the screen.
-    Call this function for base bongo hits. 
-    """
+def preprocess(frame):
+    """Unmirrored RGB copy of a BGR frame, as MediaPipe expects it."""
     #Unmirror the frame
     frame = cv2.flip(frame, 1)
     # Convert BGR to RGB (MediaPipe requirement)
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = hands.process(frame_rgb)
-    positions = [None, None]
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-    # if results.multi_hand_landmarks and results.multi_handedness:
-    temp = []
-    if results.multi_hand_landmarks:
-        for idx, (hand_landmarks, handedness) in enumerate(zip(results.multi_hand_landmarks, results.multi_handedness)):
+def extract_landmarks(frame, hands):
+    """Landmark vectors, shape (63,), of every hand MediaPipe finds in a BGR frame."""
+    return rgb_landmarks(preprocess(frame), hands)
 
+def rgb_landmarks(frame_rgb, hands):
+    """Landmark vectors, shape (63,), of every hand MediaPipe finds in a preprocessed RGB frame."""
+    results = hands.process(frame_rgb)
+    landmarks = []
+    if results.multi_hand_landmarks:
+        for hand_landmarks in results.multi_hand_landmarks:
             # Extract x and y coords of all 21 hand landmarks
             x = [lm.x for lm in hand_landmarks.landmark]
             y = [lm.y for lm in hand_landmarks.landmark]
             z = [lm.z for lm in hand_landmarks.landmark]
-        
-            landmark_info = np.hstack((x, y, z)) # Shape: (63,)
-            input_data = np.array([landmark_info], dtype=np.float32)
-
-            # Get the output
-            if not use_double:
-                # Run classifier
-                interpreter.set_tensor(input_details[0]['index'], input_data)
-                interpreter.invoke()
-                output_data = interpreter.get_tensor(output_details[0]['index'])
-                probabilities = np.squeeze(output_data)
-                max_prob = np.max(probabilities)
-                if max_prob < CONFIDENCE_THRESHOLD: output = None
-                else: output = np.argmax(probabilities)
-                positions[idx] = output
-            else:
-                temp.append(landmark_info)
-    
-    if use_double and len(temp) == 2:
-        input_data = np.hstack(temp).astype(np.float32)
-        input_data = np.expand_dims(input_data, axis=0)
-        interpreter.set_tensor(input_details[0]['index'], input_data)
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]['index'])
-        probabilities = np.squeeze(output_data)
-        max_prob = np.max(probabilities)
-        if max_prob < CONFIDENCE_THRESHOLD:
-            output = None
-        else:
-            output = np.argmax(probabilities)
-        positions[0] = output
+            landmarks.append(np.hstack((x, y, z))) # Shape: (63,)
+    return landmarks
+
+def model_inputs(landmarks, use_double):
+    """
+    Classifier input rows for one frame's hands, and the position slot each row's
+    prediction belongs in. The double model takes both hands as one row.
+    """
+    # In tracking mode MediaPipe can report more than max_num_hands hands after a jump
+    # between frames, such as frames dropped by the live pipeline; only two have a slot
+    landmarks = landmarks[:2]
+    if use_double:
+        return ([np.hstack(landmarks)], [0]) if len(landmarks) == 2 else ([], [])
+    return landmarks, list(range(len(landmarks)))
 
+def multihead_inputs(landmarks):
+    """
+    Multi-head model input row for one frame's hands, both hands side by side with
+    zeros for a missing one, and the number of hands found.
+    """
+    landmarks = landmarks[:2]
+    row = np.zeros(2 * 63, dtype=np.float32)
+    for slot, hand in enumerate(landmarks):
+        row[slot * 63:(slot + 1) * 63] = hand
+    return row, len(landmarks)
+
+def classify(interpreter, input_details, output_details, input_data):
+    """Class probabilities for a [batch, features] input, resizing the interpreter input to the batch size."""
+    if isinstance(interpreter, NumpyGestureModel):
+        return interpreter.predict(input_data)
+    index = input_details[0]['index']
+    if list(interpreter.get_input_details()[0]['shape']) != list(input_data.shape):
+        interpreter.resize_tensor_input(index, input_data.shape)
+        interpreter.allocate_tensors()
+    interpreter.set_tensor(index, input_data)
+    interpreter.invoke()
+    return interpreter.get_tensor(output_details[0]['index'])
+
+def classify_multihead(interpreter, input_details, output_details, input_data):
+    """Single-hand probabilities, [batch, 2, classes], and two-hand probabilities, [batch, classes], of the multi-head model."""
+    if isinstance(interpreter, NumpyMultiHeadModel):
+        return interpreter.predict(input_data)
+    classify(interpreter, input_details, output_details, input_data)
+    # TFLite does not keep the output names; the single-hand head is the one with a hand axis
+    outputs = [interpreter.get_tensor(detail['index']) for detail in output_details]
+    single = next(output for output in outputs if output.ndim == 3)
+    double = next(output for output in outputs if output.ndim == 2)
+    return single, double
+
+def predicted_gestures(probabilities):
+    """Class index of each row, or None where the top probability is below CONFIDENCE_THRESHOLD."""
+    return [None if np.max(row) < CONFIDENCE_THRESHOLD else int(np.argmax(row)) for row in probabilities]
+
+def multihead_gestures(single, double, hand_counts):
+    """
+    (left, right, double) class indices per frame from the multi-head model's outputs,
+    gated by the number of hands found: a single-hand answer only for a hand that is
+    there, a two-hand answer only when both are.
+    """
+    gestures = []
+    for hands_found, hand_probabilities, pair_probabilities in zip(hand_counts, single, double):
+        left, right = predicted_gestures(hand_probabilities)
+        gestures.append((
+            left if hands_found >= 1 else None,
+            right if hands_found >= 2 else None,
+            predicted_gestures([pair_probabilities])[0] if hands_found == 2 else None,
+        ))
+    return gestures
+
+def detect_hand_position(frame, interpreter, hands, mp_hands, input_details, output_details, use_double=False):
+    """
+    Detect hand positions in a frame. For each hand, determine if it is in the top, middle, or bottom region of the screen.
+    Call this function for base bongo hits. 
+    """
+    rows, slots = model_inputs(extract_landmarks(frame, hands), use_double)
+    positions = [None, None]
+    if rows:
+        probabilities = classify(interpreter, input_details, output_details, np.array(rows, dtype=np.float32))
+        for slot, gesture in zip(slots, predicted_gestures(probabilities)):
+            positions[slot] = gesture
     return positions
 
 def test_hand_position_live(cap, hands, mp_hands, mp_drawing):
@@ -125,50 +206,152 @@ def test_hand_position_live(cap, hands, mp_hands, mp_drawing):
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
-def check_hand_position(octet_stream, hands, mp_hands, interpreter, input_details, output_details, use_double = False):
+def segment_key(octet_stream, *settings):
+    return (hashlib.sha1(octet_stream).hexdigest(), *settings)
+
+def cached_result(key):
+    with _result_cache_lock:
+        result = _result_cache.get(key)
+        if result is not None:
+            _result_cache.move_to_end(key)
+        return result
+
+def store_result(key, result):
+    with _result_cache_lock:
+        _result_cache[key] = result
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+def vote_batch(frames, votes, extract, interpreter, input_details, output_details, use_double):
+    """Classify a batch of frames in one invoke and add each frame's prediction per hand to `votes`."""
+    positions = [[None, None] for _ in frames]
+    rows, targets = [], []
+    for frame_index, frame in enumerate(frames):
+        frame_rows, slots = model_inputs(extract(frame), use_double)
+        rows.extend(frame_rows)
+        targets.extend((frame_index, slot) for slot in slots)
+
+    if rows:
+        probabilities = classify(interpreter, input_details, output_details, np.array(rows, dtype=np.float32))
+        for (frame_index, slot), gesture in zip(targets, predicted_gestures(probabilities)):
+            positions[frame_index][slot] = gesture
+
+    # If we're dealing with a two-handed pose, everything we need is in the left slot
+    for frame_positions in positions:
+        for slot, vote in enumerate(votes):
+            vote.add(frame_positions[slot])
+
+def vote_batch_combined(frames, votes, extract, interpreter, input_details, output_details):
+    """Classify a batch of frames with the multi-head model and add each frame's left, right and two-hand prediction to `votes`."""
+    positions = [(None, None, None) for _ in frames]
+    rows, counts, targets = [], [], []
+    for frame_index, frame in enumerate(frames):
+        row, hands_found = multihead_inputs(extract(frame))
+        if hands_found:
+            rows.append(row)
+            counts.append(hands_found)
+            targets.append(frame_index)
+
+    if rows:
+        single, double = classify_multihead(interpreter, input_details, output_details, np.array(rows))
+        for frame_index, gestures in zip(targets, multihead_gestures(single, double, counts)):
+            positions[frame_index] = gestures
+
+    for frame_positions in positions:
+        for vote, gesture in zip(votes, frame_positions):
+            vote.add(gesture)
+
+def decide_hand_position(octet_stream, hands, interpreter, input_details, output_details, use_double = False,
+                         use_cache = True, stopping_rule = DEFAULT_STOPPING_RULE, frame_stride = 1,
+                         combined = False):
+    """
+    Vote for the most common gesture of each hand over every `frame_stride`-th frame of
+    the video, classifying VOTE_BATCH_FRAMES frames per invoke and stopping as soon as
+    `stopping_rule` settles the vote. Returns the gestures with the number of frames
+    used, the number that could have been (when known) and the decision confidence.
+    With `combined`, the interpreter is the multi-head model (see combined_model_path),
+    one pass answers both the single- and two-hand question and the decision also
+    carries the two-hand gesture; `use_double` is ignored. The two-hand head has no
+    'none' class, so `double` names the closest two-hand gesture even when each hand
+    makes its own single-hand one: it is only meaningful when the caller expects a
+    two-hand gesture.
+    The video is decoded from memory, so concurrent calls share no files, and the
+    result for the same segment content and settings is served from a cache.
+    """
+    if combined:
+        use_double = False
+    key = segment_key(octet_stream, use_double, stopping_rule, frame_stride, combined)
+    if use_cache:
+        result = cached_result(key)
+        if result is not None:
+            return result
+
+    num_classes = len(DOUBLE_LABEL_MAP) if use_double else len(SINGLE_LABEL_MAP)
+    votes = [GestureVote(num_classes) for _ in range(1 if use_double else 2)]
+    if combined:
+        votes.append(GestureVote(len(DOUBLE_LABEL_MAP)))
+    extract = lambda frame: extract_landmarks(frame, hands)
+    frames_used = 0
+    with open_video(octet_stream) as cap:
+        total = frame_count(cap)
+        frames_total = None if total is None else -(-total // frame_stride)
+        frames = sampled_frames(cap, frame_stride)
+        while True:
+            batch = list(itertools.islice(frames, VOTE_BATCH_FRAMES))
+            if not batch:
+                break
+            if combined:
+                vote_batch_combined(batch, votes, extract, interpreter, input_details, output_details)
+            else:
+                vote_batch(batch, votes, extract, interpreter, input_details, output_details, use_double)
+            frames_used += len(batch)
+            frames_left = None if frames_total is None else max(frames_total - frames_used, 0)
+            if all(vote.settled(stopping_rule, frames_used, frames_left) for vote in votes):
+                break
+
+    id_to_gesture = DOUBLE_ID_TO_GESTURE if use_double else SINGLE_ID_TO_GESTURE
+    hand_votes = votes[:2] if combined else votes
+    gestures = [id_to_gesture.get(vote.leader(), 'none') for vote in hand_votes]
+    z = report_z(stopping_rule)
+    result = GestureDecision(
+        left=gestures[0],
+        right=gestures[1] if not use_double else 'none',
+        frames_used=frames_used,
+        frames_total=frames_total,
+        confidence=round(min(vote.confidence(z) for vote in votes), 4),
+        double=DOUBLE_ID_TO_GESTURE.get(votes[-1].leader(), 'none') if combined else None,
+    )
+
+    if use_cache:
+        store_result(key, result)
+    return result
+
+def check_hand_position(octet_stream, hands, mp_hands, interpreter, input_details, output_details, use_double = False,
+                        use_cache = True, stopping_rule = DEFAULT_STOPPING_RULE, frame_stride = 1, combined = False):
     """
     Given a .bin octet stream file, determine the most common hand position
-    for left and right hands in the video.
+    for left and right hands in the video, and with `combined` the two-hand gesture too.
+    See decide_hand_position for the stopping rule and frame sampling.
     """
-    with open("temp.mp4", "wb") as f:
-        f.write(octet_stream)
-    
-    cap = cv2.VideoCapture("temp.mp4")
-    all_positions = []
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break 
-            
-        all_positions.append(detect_hand_position(frame, interpreter, hands, mp_hands, input_details, output_details, use_double = use_double))
-    
-    gesture_counts_left = [0] * (len(SINGLE_LABEL_MAP)) if not use_double else [0] * (len(DOUBLE_LABEL_MAP))
-    gesture_counts_right = [0] * (len(SINGLE_LABEL_MAP)) if not use_double else [0] * (len(DOUBLE_LABEL_MAP))
-
-    for positions in all_positions:
-        left_gesture = positions[0]
-        if left_gesture is None: gesture_counts_left[-1] += 1
-        else: gesture_counts_left[left_gesture] += 1
-        # If we're dealing with a two-handed pose, everything we need is already in the left_gesture index
-        if not use_double:
-            right_gesture = positions[1]
-            if right_gesture is None: gesture_counts_right[-1] += 1
-            else: gesture_counts_right[right_gesture] += 1
-    most_common_left = gesture_counts_left.index(max(gesture_counts_left))
-
-    if not use_double:
-        most_common_right = gesture_counts_right.index(max(gesture_counts_right))
-        return SINGLE_ID_TO_GESTURE[most_common_left], SINGLE_ID_TO_GESTURE[most_common_right]
-
-    return DOUBLE_ID_TO_GESTURE[most_common_left], 'none'
-
-def test_check_hand_position(bin_file, mp_hands, hands, interpreter, input_details, output_details, use_double):
+    decision = decide_hand_position(octet_stream, hands, interpreter, input_details, output_details, use_double = use_double,
+                                    use_cache = use_cache, stopping_rule = stopping_rule, frame_stride = frame_stride,
+                                    combined = combined)
+    if combined:
+        return decision.left, decision.right, decision.double
+    return decision.left, decision.right
+
+def test_check_hand_position(bin_file, mp_hands, hands, interpreter, input_details, output_details, use_double, combined = False):
     with open(bin_file, "rb") as f:
         octet_stream = f.read()
-    left, right = check_hand_position(octet_stream, hands, mp_hands, interpreter, input_details, output_details, use_double = use_double)
-    return left, right
+    decision = decide_hand_position(octet_stream, hands, interpreter, input_details, output_details, use_double = use_double,
+                                    combined = combined)
+    print(f"Decided after {decision.frames_used} of {decision.frames_total or '?'} frames, confidence {decision.confidence:.3f}")
+    if combined:
+        return decision.left, decision.right, decision.double
+    return decision.left, decision.right
     
-def main(use_double = False):
+def main(use_double = False, combined = False):
     # Initialize MediaPipe Hands
     print(SINGLE_LABEL_MAP, DOUBLE_LABEL_MAP)
     mp_hands = mp.solutions.hands
@@ -178,12 +361,12 @@ def main(use_double = False):
     # Open Webcam
     cap = cv2.VideoCapture(0)
     
-    tflite_save_path = "./model/model_doubleTrue.tflite" if use_double else "./model/model_doubleFalse.tflite"
-    interpreter, input_details, output_details = setup_model(tflite_save_path)
+    interpreter, input_details, output_details = setup_model(combined_model_path() if combined else model_path(use_double))
     # Test hand position
     # test_hand_position_live(cap, hands, mp_hands, mp_drawing)
-    left, right = test_check_hand_position("test_double.bin", mp_hands, hands, interpreter, input_details, output_details, use_double = use_double)
-    print(left, right)
+    gestures = test_check_hand_position("test_double.bin", mp_hands, hands, interpreter, input_details, output_details,
+                                        use_double = use_double, combined = combined)
+    print(*gestures)
     cap.release()
     cv2.destroyAllWindows()
 
@@ -191,5 +374,6 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="run gesture recognizer")
     parser.add_argument('--use_double', action='store_true', help="detect hand gestures that involve both hands")
+    parser.add_argument('--combined', action='store_true', help="detect one- and two-hand gestures with the multi-head model")
     args = parser.parse_args()
-    main(use_double=args.use_double)
\ No newline at end of file
+    main(use_double=args.use_double, combined=args.combined)
\ No newline at end of file
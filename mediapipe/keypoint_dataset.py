@@ -0,0 +1,122 @@
+"""
+Memory-mapped training data for the gesture classifiers.
+
+`KeypointDataset` opens a keypoint store written by process_data.py (see
+keypoint_store.py) without reading it: the label and landmark columns are
+memory maps, so opening takes no time whatever the dataset size and only the
+rows of the batch being trained on are paged in. Train/test splits are arrays of
+row indices, and `batches` streams (inputs, labels) batches over such a split,
+reshuffled on every pass.
+
+Keypoint CSVs from older runs (label, then landmarks, per line) are converted to
+a store once with `convert_csv`, reading a block of lines at a time.
+
+Usage: python keypoint_dataset.py ../data/hand_keypoints_doubleFalse.csv [store_dir]
+"""
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from keypoint_store import ColumnWriter, load_columns, new_manifest, read_manifest
+
+TRAIN_SIZE = 0.75
+CSV_BLOCK_ROWS = 65536
+
+
+class KeypointDataset:
+    """Landmark rows and their labels, memory-mapped from a keypoint store."""
+
+    def __init__(self, store_dir, allow_incomplete=False):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No keypoint store at {store_dir}")
+        if not manifest["complete"]:
+            if not allow_incomplete:
+                raise ValueError(f"{store_dir} is incomplete ({manifest['rows']} rows extracted so far); "
+                                 f"rerun process_data.py to finish it")
+            print(f"Warning: {store_dir} is incomplete, using the {manifest['rows']} rows extracted so far")
+        columns = load_columns(store_dir, manifest)
+        self.store_dir = store_dir
+        self.inputs = columns["landmarks"]
+        self.labels = columns["label"]
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def width(self):
+        return self.inputs.shape[1]
+
+    def rows(self, indices):
+        """Inputs and labels of the given rows, read in file order."""
+        indices = np.sort(indices)
+        return np.asarray(self.inputs[indices], dtype=np.float32), np.asarray(self.labels[indices], dtype=np.int16)
+
+
+def split_indices(num_rows, train_size=TRAIN_SIZE, seed=None):
+    """Shuffled row indices of a train and a test split."""
+    indices = np.random.default_rng(seed).permutation(num_rows)
+    cut = int(round(train_size * num_rows))
+    return indices[:cut], indices[cut:]
+
+
+def batches(read_rows, indices, batch_size, rng=None):
+    """
+    Batches of `read_rows(batch_indices)` over `indices`, in a new random order on
+    every call when an `np.random.Generator` is given, else in the order given.
+    """
+    if rng is not None:
+        indices = rng.permutation(indices)
+    for start in range(0, len(indices), batch_size):
+        yield read_rows(indices[start:start + batch_size])
+
+
+def convert_csv(csv_path, store_dir, block_rows=CSV_BLOCK_ROWS):
+    """Convert a keypoint CSV to a store at `store_dir`, a block of lines at a time."""
+    with open(csv_path) as f:
+        width = len(f.readline().split(",")) - 1
+    writer = ColumnWriter(store_dir, new_manifest(width, {"source": os.path.abspath(csv_path)}))
+    try:
+        with open(csv_path) as f:
+            for block_index in itertools.count():
+                lines = list(itertools.islice(f, block_rows))
+                if not lines:
+                    break
+                rows = np.loadtxt(lines, delimiter=",", dtype=np.float32, ndmin=2)
+                writer.append(block_index, {"label": rows[:, 0].astype(np.int16), "landmarks": rows[:, 1:]})
+        writer.finish()
+    finally:
+        writer.close()
+    print(f"Converted {writer.manifest['rows']} rows of {csv_path} to {store_dir}")
+    return writer.manifest
+
+
+def open_dataset(store_dir, csv_path=None):
+    """
+    The dataset at `store_dir`, converted from `csv_path` first if only the CSV exists
+    or an earlier conversion of that CSV was interrupted. Any other incomplete store
+    is refused rather than trained on.
+    """
+    if csv_path is not None and os.path.exists(csv_path):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            convert_csv(csv_path, store_dir)
+        elif not manifest["complete"] and manifest["settings"].get("source") == os.path.abspath(csv_path):
+            print(f"Conversion of {csv_path} to {store_dir} was interrupted, converting it again")
+            convert_csv(csv_path, store_dir)
+    return KeypointDataset(store_dir)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python keypoint_dataset.py keypoints.csv [store_dir]")
+        sys.exit(1)
+    csv_path = sys.argv[1]
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(csv_path)[0]
+    convert_csv(csv_path, store_dir)
+
+
+if __name__ == "__main__":
+    main()
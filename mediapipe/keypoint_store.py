@@ -0,0 +1,125 @@
+"""
+Binary columnar store for extracted hand keypoints.
+
+A store is a directory holding one raw little-endian file per column (the class
+label of each row and its landmark vector) and `manifest.json`, which records
+each column's dtype and row width, how many rows are committed and which chunks
+of the image list they came from. Rows are appended chunk by chunk: the column
+files are flushed to disk before the manifest is atomically replaced, so after an
+interruption the manifest still describes a consistent prefix and anything past
+it is truncated away when the store is reopened.
+
+Columns are read back with `np.memmap`, without parsing or copying the file.
+"""
+import json
+import os
+
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+LABEL_DTYPE = np.dtype("<i2")
+LANDMARK_DTYPE = np.dtype("<f4")
+
+
+def manifest_path(store_dir):
+    return os.path.join(store_dir, MANIFEST_NAME)
+
+
+def read_manifest(store_dir):
+    """The store's manifest, or None if there is no store at `store_dir` yet."""
+    try:
+        with open(manifest_path(store_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(store_dir, manifest):
+    path = manifest_path(store_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def new_manifest(width, settings):
+    """Manifest of an empty store of `width`-wide landmark rows, extracted with the given settings."""
+    return {
+        "version": FORMAT_VERSION,
+        "settings": settings,
+        "rows": 0,
+        "chunks_done": [],
+        "images_read": 0,
+        "images_unreadable": 0,
+        "complete": False,
+        "columns": {
+            "label": {"file": "label.bin", "dtype": LABEL_DTYPE.str, "width": None},
+            "landmarks": {"file": "landmarks.bin", "dtype": LANDMARK_DTYPE.str, "width": width},
+        },
+    }
+
+
+def row_bytes(column):
+    return np.dtype(column["dtype"]).itemsize * (column["width"] or 1)
+
+
+class ColumnWriter:
+    """Appends chunks of rows to a store, committing each with a manifest update."""
+
+    def __init__(self, store_dir, manifest):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.manifest = manifest
+        self.files = {}
+        for name, column in manifest["columns"].items():
+            path = os.path.join(store_dir, column["file"])
+            f = open(path, "r+b" if os.path.exists(path) else "w+b")
+            # Drop rows written after the last committed manifest
+            f.truncate(manifest["rows"] * row_bytes(column))
+            f.seek(0, os.SEEK_END)
+            self.files[name] = f
+        write_manifest(store_dir, manifest)
+
+    def append(self, chunk_index, columns, images_read=0, images_unreadable=0):
+        """Append one chunk's rows, given as an array per column, and commit them."""
+        rows = {len(values) for values in columns.values()}
+        if len(rows) != 1:
+            raise ValueError(f"Columns of chunk {chunk_index} differ in length: {sorted(rows)}")
+        for name, f in self.files.items():
+            column = self.manifest["columns"][name]
+            values = np.ascontiguousarray(columns[name], dtype=column["dtype"])
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.manifest["rows"] += rows.pop()
+        self.manifest["chunks_done"].append(chunk_index)
+        self.manifest["images_read"] += images_read
+        self.manifest["images_unreadable"] += images_unreadable
+        write_manifest(self.store_dir, self.manifest)
+
+    def finish(self):
+        self.manifest["complete"] = True
+        write_manifest(self.store_dir, self.manifest)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def load_columns(store_dir, manifest=None):
+    """Read-only memory maps of every committed column of a store, keyed by column name."""
+    manifest = manifest or read_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No keypoint store at {store_dir}")
+    columns = {}
+    for name, column in manifest["columns"].items():
+        shape = (manifest["rows"],) if column["width"] is None else (manifest["rows"], column["width"])
+        if manifest["rows"] == 0:
+            columns[name] = np.empty(shape, dtype=column["dtype"])
+        else:
+            columns[name] = np.memmap(os.path.join(store_dir, column["file"]), dtype=column["dtype"],
+                                      mode="r", shape=shape)
+    return columns
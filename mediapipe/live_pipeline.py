@@ -0,0 +1,312 @@
+"""
+Multi-process live gesture pipeline over a shared-memory frame ring.
+
+A capture process reads the camera (or a video file standing in for it, paced at
+the file's frame rate) and writes each frame into the next slot of a ring of
+frames in shared memory, so frames are never pickled or copied between processes.
+Inference processes each hold their own Hands graph and classifier; they always
+claim the newest captured frame, skipping any they did not get to, so a slow
+frame costs dropped frames rather than growing latency. Results are published on
+a queue with the latency of each stage: waiting in the ring, preprocessing,
+landmark detection and classification.
+
+A slot carries the sequence number of the frame in it, cleared while the slot is
+rewritten; a worker checks it again after copying the frame out and drops the
+frame if the capture process lapped it in the meantime.
+
+With --working_width, frames are downsampled before landmark detection, and with
+--roi cropped around the tracked hands; see roi_tracking.py, and check
+bench_roi.py on your footage first, as both change predictions.
+
+Usage: python live_pipeline.py [--source 0|video.mp4] [--workers 2] [--seconds 10] [--working_width 640] [--roi] [--use_double]
+"""
+import math
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+RING_SLOTS = 8
+POLL_SECONDS = 0.001
+# Header counters: newest frame written, newest frame claimed by a worker
+_LATEST, _CLAIMED = 0, 1
+
+
+class FrameRing:
+    """Fixed-size ring of same-shaped BGR frames in one shared memory block."""
+
+    def __init__(self, shape, slots=RING_SLOTS, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = math.prod(self.shape)
+        header_bytes = 8 * (2 + 2 * slots)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * frame_bytes)
+        else:
+            # Processes started from the pipeline share its resource tracker, so attaching
+            # does not make them unlink the block when they exit
+            self.shm = shared_memory.SharedMemory(name=name)
+        buf = self.shm.buf
+        self._counters = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=0)
+        self._seqs = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=16)
+        self._stamps = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=16 + 8 * slots)
+        self.frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=buf, offset=header_bytes)
+        if name is None:
+            self._counters[:] = -1
+            self._seqs[:] = -1
+
+    def spec(self):
+        """What another process needs to attach to this ring."""
+        return self.shm.name, self.shape, self.slots
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, slots = spec
+        return cls(shape, slots=slots, name=name)
+
+    @property
+    def latest(self):
+        return int(self._counters[_LATEST])
+
+    def write(self, seq, frame, timestamp):
+        slot = seq % self.slots
+        self._seqs[slot] = -1
+        self.frames[slot] = frame
+        self._stamps[slot] = timestamp
+        self._seqs[slot] = seq
+        self._counters[_LATEST] = seq
+
+    def claim_newest(self, lock):
+        """Sequence number of the newest frame no worker has claimed yet, or None."""
+        with lock:
+            latest = self._counters[_LATEST]
+            if latest <= self._counters[_CLAIMED]:
+                return None
+            self._counters[_CLAIMED] = latest
+            return int(latest)
+
+    def holds(self, seq):
+        """Whether the frame `seq` is still intact in its slot."""
+        return self._seqs[seq % self.slots] == seq
+
+    def frame(self, seq):
+        """A view of frame `seq` in shared memory, with its capture time; check `holds` after use."""
+        slot = seq % self.slots
+        return self.frames[slot], float(self._stamps[slot])
+
+    def close(self):
+        # Views into the buffer must go before it can be closed
+        del self._counters, self._seqs, self._stamps, self.frames
+        self.shm.close()
+
+
+def open_source(source):
+    return cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+
+
+def frame_shape(source):
+    cap = open_source(source)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        raise RuntimeError(f"Could not read a frame from {source!r}")
+    return frame.shape
+
+
+def capture_loop(source, ring_spec, stop, finished, loop_file=False):
+    """Write frames from `source` into the ring until `stop` is set or a file source runs out."""
+    ring = FrameRing.attach(ring_spec)
+    is_file = not str(source).isdigit()
+    cap = open_source(source)
+    frame_seconds = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0) if is_file else 0.0
+    seq = 0
+    next_frame = time.monotonic()
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                if is_file and loop_file:
+                    cap.release()
+                    cap = open_source(source)
+                    continue
+                break
+            if frame.shape != ring.shape:
+                frame = cv2.resize(frame, (ring.shape[1], ring.shape[0]))
+            if frame_seconds:
+                # Deliver file frames no faster than a camera would
+                next_frame += frame_seconds
+                time.sleep(max(0.0, next_frame - time.monotonic()))
+            ring.write(seq, frame, time.monotonic())
+            seq += 1
+    finally:
+        cap.release()
+        ring.close()
+        finished.set()
+
+
+def inference_loop(worker_id, ring_spec, claim_lock, results, ready, stop, use_double, working_width, track_roi):
+    """Classify the newest unclaimed frame, again and again, publishing gestures and stage latencies."""
+    import mediapipe
+    from config import DOUBLE_ID_TO_GESTURE, SINGLE_ID_TO_GESTURE
+    from detect_hand_position import (classify, model_inputs, model_path, predicted_gestures, preprocess,
+                                      rgb_landmarks, setup_model)
+
+    ring = FrameRing.attach(ring_spec)
+    hands = mediapipe.solutions.hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5)
+    if working_width is not None or track_roi:
+        from roi_tracking import HandTracker
+        tracker = HandTracker(hands, working_width=working_width, track_roi=track_roi)
+        prepare, detect = tracker.prepare, tracker.landmarks
+    else:
+        prepare, detect = preprocess, lambda frame_rgb: rgb_landmarks(frame_rgb, hands)
+    interpreter, input_details, output_details = setup_model(model_path(use_double))
+    id_to_gesture = DOUBLE_ID_TO_GESTURE if use_double else SINGLE_ID_TO_GESTURE
+    ready.set()
+    try:
+        while not stop.is_set():
+            seq = ring.claim_newest(claim_lock)
+            if seq is None:
+                time.sleep(POLL_SECONDS)
+                continue
+            start = time.monotonic()
+            frame, captured = ring.frame(seq)
+            frame_rgb = prepare(frame)
+            if not ring.holds(seq):
+                continue
+            preprocessed = time.monotonic()
+
+            landmarks = detect(frame_rgb)
+            detected = time.monotonic()
+
+            positions = [None, None]
+            rows, slots = model_inputs(landmarks, use_double)
+            if rows:
+                probabilities = classify(interpreter, input_details, output_details, np.array(rows, dtype=np.float32))
+                for slot, gesture in zip(slots, predicted_gestures(probabilities)):
+                    positions[slot] = gesture
+            classified = time.monotonic()
+
+            results.put({
+                "seq": seq,
+                "worker": worker_id,
+                "gestures": [id_to_gesture.get(p, 'none') if p is not None else None for p in positions],
+                "latency_ms": {
+                    "ring": round(1000 * (start - captured), 2),
+                    "preprocess": round(1000 * (preprocessed - start), 2),
+                    "landmarks": round(1000 * (detected - preprocessed), 2),
+                    "classify": round(1000 * (classified - detected), 2),
+                    "total": round(1000 * (classified - captured), 2),
+                },
+            })
+    finally:
+        hands.close()
+        ring.close()
+
+
+class LivePipeline:
+    """A capture process and `workers` inference processes sharing a frame ring."""
+
+    def __init__(self, source=0, workers=2, use_double=False, slots=RING_SLOTS, loop_file=False,
+                 working_width=None, track_roi=False):
+        context = mp.get_context("spawn")
+        self.ring = FrameRing(frame_shape(source), slots=slots)
+        self.results = context.Queue()
+        self.stop_event = context.Event()
+        self.capture_finished = context.Event()
+        # Kept on the pipeline: the lock must outlive __init__ until the workers have started
+        self.claim_lock = context.Lock()
+        self.workers_ready = [context.Event() for _ in range(workers)]
+        self.workers = [context.Process(
+            target=inference_loop,
+            args=(i, self.ring.spec(), self.claim_lock, self.results, ready, self.stop_event, use_double,
+                  working_width, track_roi),
+            daemon=True
+        ) for i, ready in enumerate(self.workers_ready)]
+        self.capture = context.Process(
+            target=capture_loop, args=(source, self.ring.spec(), self.stop_event, self.capture_finished, loop_file),
+            daemon=True
+        )
+        self.processes = [*self.workers, self.capture]
+
+    def start(self, timeout=60.0):
+        """Start the workers, and the capture once they have loaded their models."""
+        for worker in self.workers:
+            worker.start()
+        deadline = time.monotonic() + timeout
+        for ready, worker in zip(self.workers_ready, self.workers):
+            while not ready.wait(timeout=0.1):
+                if not worker.is_alive() or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Inference worker {worker.name} failed to start")
+        self.capture.start()
+        return self
+
+    @property
+    def frames_captured(self):
+        return self.ring.latest + 1
+
+    def get(self, timeout=None):
+        """The next published result, or None if there is none within `timeout` seconds."""
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            if process.pid is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+        self.ring.shm.unlink()
+
+
+def percentile_summary(results, stage):
+    values = [result["latency_ms"][stage] for result in results]
+    return f"{stage} p50 {np.percentile(values, 50):7.1f} ms  p95 {np.percentile(values, 95):7.1f} ms"
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the live gesture pipeline")
+    parser.add_argument("--source", default="0", help="camera index or video file")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--loop", action="store_true", help="replay a video file until --seconds have passed")
+    parser.add_argument("--working_width", type=int, default=0, help="downsample frames to this width (default 0: full size)")
+    parser.add_argument("--roi", action="store_true", help="crop frames around the tracked hands")
+    parser.add_argument('--use_double', action='store_true', help="detect hand gestures that involve both hands")
+    args = parser.parse_args()
+
+    pipeline = LivePipeline(args.source, workers=args.workers, use_double=args.use_double, loop_file=args.loop,
+                            working_width=args.working_width or None, track_roi=args.roi).start()
+    results = []
+    deadline = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < deadline:
+            # Once a file source runs out, give the workers a moment to publish their last frames
+            result = pipeline.get(timeout=1.0 if pipeline.capture_finished.is_set() else 0.1)
+            if result is None:
+                if pipeline.capture_finished.is_set():
+                    break
+                continue
+            results.append(result)
+            print(f"frame {result['seq']:5d}  worker {result['worker']}  {result['gestures']}  {result['latency_ms']}")
+    finally:
+        captured = pipeline.frames_captured
+        pipeline.stop()
+
+    print(f"Captured {captured} frames, classified {len(results)}, dropped {captured - len(results)}")
+    if results:
+        for stage in ("ring", "preprocess", "landmarks", "classify", "total"):
+            print(percentile_summary(results, stage))
+
+
+if __name__ == "__main__":
+    main()
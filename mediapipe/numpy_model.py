@@ -0,0 +1,243 @@
+"""
+TensorFlow-free inference for the gesture classifier.
+
+The classifier built by `train.build_model` is a small MLP: a Dense encoder,
+residual blocks of Dense, BatchNormalization, ReLU and Dropout, and a softmax
+Dense head. At inference Dropout is the identity and BatchNormalization an affine
+map, so each one folds into the Dense layer before it:
+
+    W' = W * gamma / sqrt(var + eps),   b' = (b - mean) * gamma / sqrt(var + eps) + beta
+
+`export_numpy_model` writes the folded weights to an `.npz` file and
+`NumpyGestureModel` runs them, batched, with NumPy alone, so gesture workers
+need neither TensorFlow nor the TFLite runtime. Weights are read from a Keras
+model or straight from a `.keras` archive, which needs only h5py.
+
+The multi-head model from `train.build_multihead_model` folds the same way; its
+shared trunk runs once per hand and `NumpyMultiHeadModel` returns the
+probabilities of both heads.
+
+Usage: python numpy_model.py model/model_doubleFalse.keras [output.npz] [--check]
+       python numpy_model.py model/model_multihead.keras
+"""
+import io
+import json
+import os
+import sys
+import zipfile
+
+import numpy as np
+
+CHECK_TOLERANCE = 1e-4
+# Names of the head layers of `train.build_multihead_model`
+SINGLE_HEAD, PAIR_LAYER, DOUBLE_HEAD = "single_head", "pair", "double_head"
+MULTIHEAD_LAYERS = (SINGLE_HEAD, PAIR_LAYER, DOUBLE_HEAD)
+
+
+def archive_layers(keras_path):
+    """(class name, config, weights) of every layer of a Keras 3 `.keras` archive, in model order."""
+    import h5py
+
+    with zipfile.ZipFile(keras_path) as archive:
+        config = json.loads(archive.read("config.json"))
+        weights_file = h5py.File(io.BytesIO(archive.read("model.weights.h5")), "r")
+    layers = []
+    with weights_file:
+        for layer in config["config"]["layers"]:
+            name = layer["config"]["name"]
+            variables = weights_file.get(f"layers/{name}/vars", {})
+            weights = [np.array(variables[key]) for key in sorted(variables, key=int)]
+            layers.append((layer["class_name"], layer["config"], weights))
+    return layers
+
+
+def model_layers(model):
+    """(class name, config, weights) of every layer of a loaded Keras model, in model order."""
+    return [(type(layer).__name__, layer.get_config(), layer.get_weights()) for layer in model.layers]
+
+
+def dense_weights(weights):
+    kernel = weights[0].astype(np.float64)
+    bias = weights[1].astype(np.float64) if len(weights) > 1 else np.zeros(kernel.shape[1])
+    return kernel, bias
+
+
+def fold_batch_norm(kernel, bias, config, weights):
+    """Kernel and bias of a Dense layer with the BatchNormalization that follows it folded in."""
+    weights = [w.astype(np.float64) for w in weights]
+    gamma = weights.pop(0) if config.get("scale", True) else np.ones(kernel.shape[1])
+    beta = weights.pop(0) if config.get("center", True) else np.zeros(kernel.shape[1])
+    mean, variance = weights
+    scale = gamma / np.sqrt(variance + config.get("epsilon", 1e-3))
+    return kernel * scale, (bias - mean) * scale + beta
+
+
+def fold_dense_layers(layers):
+    """Kernel and bias of every Dense layer, in order, with a BatchNormalization right after it folded in."""
+    dense = []
+    for i, (class_name, config, weights) in enumerate(layers):
+        if class_name == "Dense":
+            kernel, bias = dense_weights(weights)
+            following = layers[i + 1] if i + 1 < len(layers) else None
+            if following is not None and following[0] == "BatchNormalization":
+                kernel, bias = fold_batch_norm(kernel, bias, following[1], following[2])
+            dense.append((kernel, bias))
+    return dense
+
+
+def trunk_arrays(encoder, blocks):
+    (encoder_kernel, encoder_bias), hidden = encoder, encoder[0].shape[1]
+    return {
+        "encoder_kernel": encoder_kernel.astype(np.float32),
+        "encoder_bias": encoder_bias.astype(np.float32),
+        "block_kernels": np.array([k for k, _ in blocks], dtype=np.float32).reshape(-1, hidden, hidden),
+        "block_biases": np.array([b for _, b in blocks], dtype=np.float32).reshape(-1, hidden),
+    }
+
+
+def fold_layers(layers):
+    """
+    Folded arrays of a `train.build_model` classifier: the encoder, each residual
+    block with its BatchNormalization folded in, and the head. A multi-head model's
+    named head layers are saved under their own names instead.
+    """
+    heads = {config["name"]: dense_weights(weights) for class_name, config, weights in layers
+             if class_name == "Dense" and config["name"] in MULTIHEAD_LAYERS}
+    dense = fold_dense_layers([layer for layer in layers if layer[1].get("name") not in heads])
+    if heads:
+        if len(heads) != len(MULTIHEAD_LAYERS) or not dense:
+            raise ValueError(f"Expected a trunk and the {', '.join(MULTIHEAD_LAYERS)} layers, found {', '.join(heads)}")
+        arrays = trunk_arrays(dense[0], dense[1:])
+        for name, (kernel, bias) in heads.items():
+            arrays[f"{name}_kernel"], arrays[f"{name}_bias"] = kernel.astype(np.float32), bias.astype(np.float32)
+        return arrays
+
+    if len(dense) < 2:
+        raise ValueError(f"Expected an encoder, residual blocks and a head, found {len(dense)} Dense layers")
+    arrays = trunk_arrays(dense[0], dense[1:-1])
+    head_kernel, head_bias = dense[-1]
+    arrays["head_kernel"], arrays["head_bias"] = head_kernel.astype(np.float32), head_bias.astype(np.float32)
+    return arrays
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probabilities = np.exp(logits)
+    return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+
+def export_numpy_model(model, npz_path):
+    """Fold a Keras model, or the `.keras` archive at the given path, and save it to `npz_path`."""
+    layers = archive_layers(model) if isinstance(model, str) else model_layers(model)
+    arrays = fold_layers(layers)
+    tmp_path = f"{npz_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, npz_path)
+    return arrays
+
+
+class NumpyGestureModel:
+    """Batched softmax probabilities of a folded gesture classifier."""
+
+    def __init__(self, arrays):
+        self.encoder_kernel = arrays["encoder_kernel"]
+        self.encoder_bias = arrays["encoder_bias"]
+        self.blocks = list(zip(arrays["block_kernels"], arrays["block_biases"]))
+        self.head_kernel = arrays.get("head_kernel")
+        self.head_bias = arrays.get("head_bias")
+
+    @classmethod
+    def load(cls, npz_path):
+        with np.load(npz_path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    @property
+    def input_size(self):
+        return self.encoder_kernel.shape[0]
+
+    @property
+    def num_classes(self):
+        return self.head_kernel.shape[1]
+
+    def trunk(self, inputs):
+        x = np.asarray(inputs, dtype=np.float32) @ self.encoder_kernel + self.encoder_bias
+        for kernel, bias in self.blocks:
+            x = x + np.maximum(x @ kernel + bias, 0)
+        return x
+
+    def predict(self, inputs):
+        return softmax(self.trunk(inputs) @ self.head_kernel + self.head_bias)
+
+
+class NumpyMultiHeadModel(NumpyGestureModel):
+    """
+    Batched probabilities of a folded multi-head classifier. Inputs hold two hands'
+    landmarks side by side, zeros for a missing hand; the trunk and single-hand head
+    run on each hand, the two-hand head on both hands' trunk outputs together.
+    """
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self.single_kernel, self.single_bias = arrays[f"{SINGLE_HEAD}_kernel"], arrays[f"{SINGLE_HEAD}_bias"]
+        self.pair_kernel, self.pair_bias = arrays[f"{PAIR_LAYER}_kernel"], arrays[f"{PAIR_LAYER}_bias"]
+        self.double_kernel, self.double_bias = arrays[f"{DOUBLE_HEAD}_kernel"], arrays[f"{DOUBLE_HEAD}_bias"]
+
+    @property
+    def input_size(self):
+        return 2 * self.encoder_kernel.shape[0]
+
+    @property
+    def num_classes(self):
+        return self.single_kernel.shape[1], self.double_kernel.shape[1]
+
+    def predict(self, inputs):
+        """Single-hand probabilities, shape [batch, 2, classes], and two-hand probabilities, [batch, classes]."""
+        inputs = np.asarray(inputs, dtype=np.float32)
+        hands = self.trunk(inputs.reshape(len(inputs), 2, -1))
+        single = softmax(hands @ self.single_kernel + self.single_bias)
+        pair = np.maximum(hands.reshape(len(inputs), -1) @ self.pair_kernel + self.pair_bias, 0)
+        return single, softmax(pair @ self.double_kernel + self.double_bias)
+
+
+def load_numpy_model(npz_path):
+    """The NumPy engine for an exported classifier, multi-head or not."""
+    with np.load(npz_path) as arrays:
+        arrays = {name: arrays[name] for name in arrays.files}
+    return NumpyMultiHeadModel(arrays) if f"{DOUBLE_HEAD}_kernel" in arrays else NumpyGestureModel(arrays)
+
+
+def check_against_keras(keras_path, model, num_inputs=1000, seed=0):
+    """Largest absolute difference between the Keras model's and `model`'s probabilities on random landmarks."""
+    import tensorflow as tf
+
+    keras_model = tf.keras.models.load_model(keras_path)
+    inputs = np.random.default_rng(seed).random((num_inputs, model.input_size)).astype(np.float32)
+    expected, found = keras_model.predict(inputs, verbose=0), model.predict(inputs)
+    if isinstance(model, NumpyMultiHeadModel):
+        # The multi-head model's outputs are named, so Keras returns them as a dict
+        expected = expected[SINGLE_HEAD], expected[DOUBLE_HEAD]
+        return max(float(np.max(np.abs(e - f))) for e, f in zip(expected, found))
+    return float(np.max(np.abs(expected - found)))
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    if not args:
+        print("Usage: python numpy_model.py model.keras [output.npz] [--check]")
+        sys.exit(1)
+    keras_path = args[0]
+    npz_path = args[1] if len(args) > 1 else os.path.splitext(keras_path)[0] + ".npz"
+    export_numpy_model(keras_path, npz_path)
+    model = load_numpy_model(npz_path)
+    print(f"Wrote {npz_path}: {model.input_size} inputs, {len(model.blocks)} residual blocks, {model.num_classes} classes")
+
+    if "--check" in sys.argv:
+        difference = check_against_keras(keras_path, model)
+        print(f"Max difference from {keras_path}: {difference:.2e} (tolerance {CHECK_TOLERANCE:.0e})")
+        if difference > CHECK_TOLERANCE:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
+"""
+Extract hand keypoints from the HaGRID images for training.
+
+`extract_keypoints` splits the image list into chunks of CHUNK_SIZE images and
+hands them to worker processes, each keeping one `Hands` instance for all its
+chunks. Images are decoded at full resolution, as inference sees its frames;
+with --reduce they are decoded at 1/2, 1/4 or 1/8 scale instead (much cheaper
+than decoding and then resizing, about 10% faster per image at 1/2), but the
+landmarks found at a lower resolution differ, as bench_roi.py shows for
+inference, so check detection rate and accuracy before training on them. Each
+finished chunk is appended to a binary
+columnar store with a progress manifest (see keypoint_store.py), in chunk
+order whatever order the workers finish them in, so the rows come out the same
+on every run and an interrupted run picks up at the first chunk it had not
+finished.
+
+Usage: python process_data.py [--dataset ../data/HaGRIDv2_dataset_512] [--workers N] [--reduce 1] [--csv]
+"""
+import hashlib
 import numpy as np
 import os
 import cv2
 import mediapipe as mp
+import multiprocessing
+import time
 from joblib import Parallel, delayed
 from joblib.externals.loky import get_reusable_executor
-import tensorflow as tf
 import random
 import warnings
 
+from keypoint_store import ColumnWriter, new_manifest, read_manifest
+
 GESTURES = set([
     "call", "four", "hand_heart", "like", "mute", "one", "peace_inverted", "stop", "three",
     "three_gun", "timeout", "xsign", "dislike", "grabbing", "hand_heart2", "little_finger",
@@ -24,6 +46,15 @@ DOUBLE_LABEL_MAP = {gesture: idx for idx, gesture in enumerate(DOUBLE_GESTURES)}
 
 NUM_THREADS = cv2.getNumThreads()  # Prints the number of threads OpenCV will use
 IMAGES_PER_CLASS = 5000
+CHUNK_SIZE = 256
+# cv2.imread flags that decode a JPEG at 1/n of its size
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+DEFAULT_REDUCE = 1  # full resolution, like the frames classified at inference
 
 def process_image(hand_image_path, hand_class, double):
     """Process a single image and extract hand keypoints"""
@@ -35,6 +66,15 @@ def process_image(hand_image_path, hand_class, double):
         )  # ✅ Initialize hands ONCE per worker process
 
     frame = cv2.imread(hand_image_path)
+    landmark_info = image_keypoints(frame, hands, double)
+    if landmark_info is None:
+        return None  # If no hands detected
+    label = SINGLE_LABEL_MAP[hand_class] if not double else DOUBLE_LABEL_MAP[hand_class]
+    return np.concatenate(([label], landmark_info))  # Shape: (64,) or (127,)
+
+
+def image_keypoints(frame, hands, double):
+    """Landmarks of the first hand, shape (63,), or with `double` of exactly two hands, (126,); None otherwise."""
     frame = cv2.flip(frame, 1)
 
     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -47,22 +87,108 @@ def process_image(hand_image_path, hand_class, double):
             y = [lm.y for lm in hand_landmarks.landmark]
             z = [lm.z for lm in hand_landmarks.landmark]
 
-            label = SINGLE_LABEL_MAP[hand_class] if not double else DOUBLE_LABEL_MAP[hand_class]
             landmark_info = np.hstack((x, y, z))  # Shape: (63,)
 
             if not double:
-                row = np.concatenate(([label], landmark_info))
-                # print(f"{hand_class}: {hand_image_path}")
-                return row  # Shape: (64,)
+                return landmark_info
             else:
                 tmp.append(landmark_info)
 
         if double and len(tmp) == 2:
-            label = DOUBLE_LABEL_MAP[hand_class]
-            row = np.concatenate(([label], np.hstack(tmp))) # Shape: (127,)
-            return row  
-
-    return None  # If no hands detected
+            return np.hstack(tmp) # Shape: (126,)
+
+    return None
+
+
+def init_chunk_worker():
+    global hands
+    hands = mp.solutions.hands.Hands(static_image_mode=True, max_num_hands=2, min_detection_confidence=0.5)
+
+
+def process_chunk(task):
+    """Keypoint rows of one chunk of (image path, label) pairs, using the worker's Hands instance."""
+    chunk_index, images, double, reduce = task
+    labels, landmarks, unreadable = [], [], 0
+    for image_path, label in images:
+        frame = cv2.imread(image_path, REDUCED_READ_FLAGS[reduce])
+        if frame is None:
+            unreadable += 1
+            continue
+        landmark_info = image_keypoints(frame, hands, double)
+        if landmark_info is not None:
+            labels.append(label)
+            landmarks.append(landmark_info)
+    width = 126 if double else 63
+    columns = {
+        "label": np.array(labels, dtype=np.int16),
+        "landmarks": np.array(landmarks, dtype=np.float32).reshape(-1, width),
+    }
+    return chunk_index, columns, len(images), unreadable
+
+
+def list_images(dataset_path, double):
+    """(image path, label) of up to IMAGES_PER_CLASS images per gesture class, in a fixed order."""
+    label_map = DOUBLE_LABEL_MAP if double else SINGLE_LABEL_MAP
+    images = []
+    for hand_class in sorted(label_map):
+        hand_class_path = os.path.join(dataset_path, hand_class)
+        if not os.path.isdir(hand_class_path):
+            continue
+        names = sorted(os.listdir(hand_class_path))[:IMAGES_PER_CLASS]
+        images.extend((os.path.join(hand_class_path, name), label_map[hand_class]) for name in names)
+    return images
+
+
+def extraction_settings(images, double, reduce, chunk_size):
+    # A resumed run must be splitting the same image list the same way
+    digest = hashlib.sha1("\n".join(f"{path}\t{label}" for path, label in images).encode()).hexdigest()
+    return {"double": double, "reduce": reduce, "chunk_size": chunk_size, "num_images": len(images), "images_sha1": digest}
+
+
+def extract_keypoints(dataset_path, output_dir, double=False, workers=None, reduce=DEFAULT_REDUCE,
+                      chunk_size=CHUNK_SIZE):
+    """
+    Extract keypoints of the dataset's images into the store at `output_dir`, chunk by
+    chunk across `workers` processes, resuming from the store's manifest if an earlier
+    run with the same images and settings was interrupted.
+    """
+    if reduce not in REDUCED_READ_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(REDUCED_READ_FLAGS)}, not {reduce}")
+    images = list_images(dataset_path, double)
+    settings = extraction_settings(images, double, reduce, chunk_size)
+    manifest = read_manifest(output_dir)
+    if manifest is None:
+        manifest = new_manifest(126 if double else 63, settings)
+    elif manifest["settings"] != settings:
+        raise ValueError(f"{output_dir} was extracted with other images or settings; remove it to start over")
+    if manifest["complete"]:
+        print(f"{output_dir} is complete: {manifest['rows']} rows from {manifest['images_read']} images")
+        return manifest
+
+    done = set(manifest["chunks_done"])
+    tasks = [(i, images[start:start + chunk_size], double, reduce)
+             for i, start in enumerate(range(0, len(images), chunk_size)) if i not in done]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    print(f"Processing {len(images)} images in {len(tasks)} chunks "
+          f"({len(done)} done before) using {workers} processes...")
+
+    writer = ColumnWriter(output_dir, manifest)
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(workers, initializer=init_chunk_worker) as pool:
+            # In chunk order, so the store's rows do not depend on which worker finished first
+            for n, (chunk_index, columns, images_read, unreadable) in enumerate(
+                    pool.imap(process_chunk, tasks), start=1):
+                writer.append(chunk_index, columns, images_read, unreadable)
+                elapsed = time.perf_counter() - start
+                print(f"Chunk {chunk_index}: {len(columns['label'])} rows, {n}/{len(tasks)} chunks, "
+                      f"{manifest['rows']} rows total, {elapsed / n:.1f} s/chunk")
+        writer.finish()
+    finally:
+        writer.close()
+    print(f"Saved {manifest['rows']} rows from {manifest['images_read']} images to {output_dir} "
+          f"({manifest['images_unreadable']} unreadable)")
+    return manifest
 
 
 def get_keypoint_csv(dataset_path, multiprocess = True, double=False):
@@ -103,13 +229,27 @@ def get_keypoint_csv(dataset_path, multiprocess = True, double=False):
     print(f"Saved {len(results)} processed images to {output_file}")
 
 def main():
-    get_reusable_executor().shutdown(wait=True)
-    dataset_path = "../data/HaGRIDv2_dataset_512"
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract hand keypoints from the gesture dataset")
+    parser.add_argument("--dataset", default="../data/HaGRIDv2_dataset_512")
+    parser.add_argument("--output", default="../data", help="directory for the hand_keypoints_double* stores")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--reduce", type=int, default=DEFAULT_REDUCE, choices=sorted(REDUCED_READ_FLAGS),
+                        help="decode images at 1/n resolution (default 1: full size)")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--csv", action="store_true", help="write the full-resolution CSV files instead")
+    args = parser.parse_args()
     print(SINGLE_LABEL_MAP, DOUBLE_LABEL_MAP)
 
-    # Run in parallel for both single and double hand keypoints
-    get_keypoint_csv(dataset_path, multiprocess = False, double=False)
-    get_keypoint_csv(dataset_path, multiprocess = False, double=True)
+    if args.csv:
+        get_reusable_executor().shutdown(wait=True)
+        get_keypoint_csv(args.dataset, multiprocess = False, double=False)
+        get_keypoint_csv(args.dataset, multiprocess = False, double=True)
+        return
+
+    for double in (False, True):
+        extract_keypoints(args.dataset, os.path.join(args.output, f"hand_keypoints_double{double}"), double=double,
+                          workers=args.workers, reduce=args.reduce, chunk_size=args.chunk_size)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
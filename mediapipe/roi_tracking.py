@@ -0,0 +1,145 @@
+"""
+Adaptive-resolution hand landmark extraction with region-of-interest tracking.
+
+`HandTracker` replaces `detect_hand_position.extract_landmarks` for a stream of
+frames. Each frame is first downsampled to a working width, so the flip, colour
+conversion and MediaPipe's own image handling run on a fraction of the pixels.
+Once as many hands as MediaPipe looks for are found, the next frame is cropped to
+their bounding box grown by a margin, and MediaPipe only sees the crop; with
+fewer, the missing hand can only be found in the whole frame, so it is not
+cropped. Landmarks found in a crop are mapped back to coordinates normalised to
+the whole frame, the frame the classifier was trained on. When the crop loses a
+hand, and every REDETECT_FRAMES frames so new hands are picked up, the whole
+frame is searched again. MediaPipe's tracking
+state is in the coordinates of the image it last saw, so it is reset whenever the
+image switches between the whole frame and a crop, or the crop moves.
+
+Landmark coordinates are normalised, so downsampling leaves them comparable with
+the full-resolution path; `bench_roi.py` measures the speed-up, the drift and
+how often the classifier's answer changes. Both are off by default: MediaPipe
+already runs its palm detector at a fixed input size and its landmark model on a
+crop around the previous hand, so on the bundled clip downsampling saved no time
+while changing a fifth of the predictions, and a crop was slower still and
+changed about a quarter of them. Measure on your own footage before turning either on.
+"""
+import cv2
+import numpy as np
+
+from detect_hand_position import preprocess, rgb_landmarks
+
+WORKING_WIDTH = None  # full resolution; see bench_roi.py before lowering it
+ROI_MARGIN = 2.0  # of the hands' bounding box size, on each side
+MIN_ROI_FRACTION = 0.25  # of the frame's width and height
+ROI_BORDER = 0.1  # the crop moves once a hand comes this close to its edge, as a share of its size
+REDETECT_FRAMES = 30
+NUM_LANDMARKS = 21
+MAX_HANDS = 2  # max_num_hands of the Hands graph
+
+
+def downsample(frame, working_width):
+    """`frame` scaled down to `working_width` pixels wide, or as it is if already narrower."""
+    height, width = frame.shape[:2]
+    if working_width is None or width <= working_width:
+        return frame
+    scale = working_width / width
+    return cv2.resize(frame, (working_width, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def roi_around(landmarks, width, height, margin=ROI_MARGIN, min_fraction=MIN_ROI_FRACTION):
+    """Pixel box (x0, y0, x1, y1) around every hand in `landmarks`, grown by `margin` and clipped to the frame."""
+    xs = np.concatenate([hand[:NUM_LANDMARKS] for hand in landmarks]) * width
+    ys = np.concatenate([hand[NUM_LANDMARKS:2 * NUM_LANDMARKS] for hand in landmarks]) * height
+    grow = margin * max(xs.max() - xs.min(), ys.max() - ys.min())
+    half_width = max((xs.max() - xs.min()) / 2 + grow, min_fraction * width / 2)
+    half_height = max((ys.max() - ys.min()) / 2 + grow, min_fraction * height / 2)
+    cx, cy = (xs.max() + xs.min()) / 2, (ys.max() + ys.min()) / 2
+    x0, x1 = int(max(0, cx - half_width)), int(min(width, np.ceil(cx + half_width)))
+    y0, y1 = int(max(0, cy - half_height)), int(min(height, np.ceil(cy + half_height)))
+    return x0, y0, x1, y1
+
+
+def inside(landmarks, roi, width, height, border=ROI_BORDER):
+    """
+    Whether every landmark lies inside `roi`, away from its edges by `border` of its size.
+    Edges on the frame's border need no margin: moving the crop could not add any there.
+    """
+    x0, y0, x1, y1 = roi
+    pad_x, pad_y = border * (x1 - x0), border * (y1 - y0)
+    left, top = x0 + pad_x if x0 > 0 else -np.inf, y0 + pad_y if y0 > 0 else -np.inf
+    right, bottom = x1 - pad_x if x1 < width else np.inf, y1 - pad_y if y1 < height else np.inf
+    for hand in landmarks:
+        xs, ys = hand[:NUM_LANDMARKS] * width, hand[NUM_LANDMARKS:2 * NUM_LANDMARKS] * height
+        if xs.min() < left or xs.max() > right or ys.min() < top or ys.max() > bottom:
+            return False
+    return True
+
+
+def to_frame_coordinates(hand, roi, width, height):
+    """Landmarks found in the `roi` crop, normalised to the whole frame instead."""
+    x0, y0, x1, y1 = roi
+    x, y, z = np.split(np.asarray(hand, dtype=np.float64), 3)
+    # MediaPipe scales z like x, relative to the image width
+    return np.hstack(((x0 + x * (x1 - x0)) / width, (y0 + y * (y1 - y0)) / height, z * (x1 - x0) / width))
+
+
+class HandTracker:
+    """Landmarks of the hands in consecutive frames of one stream, tracked with a crop."""
+
+    def __init__(self, hands, working_width=WORKING_WIDTH, track_roi=False, margin=ROI_MARGIN,
+                 redetect_frames=REDETECT_FRAMES, max_hands=MAX_HANDS):
+        self.hands = hands
+        self.max_hands = max_hands
+        self.working_width = working_width
+        self.track_roi = track_roi
+        self.margin = margin
+        self.redetect_frames = redetect_frames
+        self.roi = None
+        self.source_roi = None  # the image MediaPipe last saw: None for the whole frame, else the crop
+        self.tracked_hands = 0
+        self.frames_since_detection = 0
+        self.full_frame_searches = 0
+
+    def prepare(self, frame):
+        """Downsampled, unmirrored RGB copy of a BGR frame."""
+        return preprocess(downsample(frame, self.working_width))
+
+    def landmarks(self, frame_rgb):
+        """Landmark vectors, shape (63,), normalised to the whole frame, of the hands in a prepared frame."""
+        height, width = frame_rgb.shape[:2]
+        landmarks = []
+        if self.roi is not None and self.frames_since_detection < self.redetect_frames:
+            landmarks = self._detect(frame_rgb, self.roi)
+            self.frames_since_detection += 1
+        if len(landmarks) < max(self.tracked_hands, 1):
+            # Lost a hand (or not tracking one yet): search the whole frame
+            landmarks = self._detect(frame_rgb, None)
+            self.frames_since_detection = 0
+            self.full_frame_searches += 1
+
+        self.tracked_hands = len(landmarks)
+        if not self.track_roi or len(landmarks) < self.max_hands:
+            self.roi = None
+        elif self.roi is None or not inside(landmarks, self.roi, width, height):
+            # Keep the crop still while the hands stay well inside it, as moving it resets tracking
+            self.roi = roi_around(landmarks, width, height, margin=self.margin)
+        return landmarks
+
+    def _detect(self, frame_rgb, roi):
+        """Landmarks, normalised to the whole frame, of the hands in the `roi` crop of a frame or in all of it."""
+        if roi != self.source_roi:
+            # MediaPipe tracks hands in the coordinates of the previous image, which a switch invalidates
+            self.reset_tracking()
+            self.source_roi = roi
+        if roi is None:
+            return rgb_landmarks(frame_rgb, self.hands)
+        height, width = frame_rgb.shape[:2]
+        x0, y0, x1, y1 = roi
+        crop = np.ascontiguousarray(frame_rgb[y0:y1, x0:x1])
+        return [to_frame_coordinates(hand, roi, width, height) for hand in rgb_landmarks(crop, self.hands)]
+
+    def reset_tracking(self):
+        if hasattr(self.hands, "reset"):
+            self.hands.reset()
+
+    def __call__(self, frame):
+        return self.landmarks(self.prepare(frame))
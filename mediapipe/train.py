@@ -2,9 +2,10 @@ import os
 import cv2
 import numpy as np
 import tensorflow as tf
-from sklearn.model_selection import train_test_split
 from wandb.integration.keras import WandbMetricsLogger 
 import wandb
+from keypoint_dataset import batches, open_dataset, split_indices
+from numpy_model import DOUBLE_HEAD, PAIR_LAYER, SINGLE_HEAD, export_numpy_model
 
 RANDOM_SEED = 42
 DOUBLE_GESTURES = sorted(set(['holy', 'hand_heart2', 'xsign', 'timeout']))
@@ -15,13 +16,73 @@ SINGLE_GESTURES = sorted(set(['rock', 'peace', 'palm', 'middle_finger', 'ok', 'o
 
 SINGLE_LABEL_MAP = {gesture: idx for idx, gesture in enumerate(SINGLE_GESTURES)}
 DOUBLE_LABEL_MAP = {gesture: idx for idx, gesture in enumerate(DOUBLE_GESTURES)}
+HAND_SIZE = 63
+BATCH_SIZE = 256
 
-def load_data(dataset_path, double = False):
-    usecols = list(range(1, 126 + 1)) if double else list(range(1, 63 + 1))
-    inputs = np.loadtxt(dataset_path, delimiter=',', dtype='float32', usecols = usecols)
-    outputs = np.loadtxt(dataset_path, delimiter=',', usecols=(0)).astype(np.int16)
-    x_train, x_test, y_train, y_test = train_test_split(inputs, outputs, train_size=0.75, random_state=RANDOM_SEED)
-    return x_train, x_test, y_train, y_test
+def dataset_paths(double):
+    """The keypoint store written by process_data.py, and the CSV of older runs to convert if it is missing."""
+    return f"../data/hand_keypoints_double{double}", f"../data/hand_keypoints_double{double}.csv"
+
+def load_data(double = False):
+    """The memory-mapped dataset, and the row indices of its train and test splits."""
+    dataset = open_dataset(*dataset_paths(double))
+    train_indices, test_indices = split_indices(len(dataset), seed=RANDOM_SEED)
+    return dataset, train_indices, test_indices
+
+def batch_stream(read_rows, indices, output_signature, batch_size = BATCH_SIZE, shuffle = False):
+    """A tf.data pipeline of the batches `read_rows` builds over `indices`, reshuffled every epoch."""
+    rng = np.random.default_rng(RANDOM_SEED) if shuffle else None
+    return tf.data.Dataset.from_generator(
+        lambda: batches(read_rows, indices, batch_size, rng=rng),
+        output_signature=output_signature
+    ).prefetch(tf.data.AUTOTUNE)
+
+def gesture_batches(dataset, indices, batch_size = BATCH_SIZE, shuffle = False):
+    signature = (
+        tf.TensorSpec(shape=(None, dataset.width), dtype=tf.float32),
+        tf.TensorSpec(shape=(None,), dtype=tf.int16),
+    )
+    return batch_stream(dataset.rows, indices, signature, batch_size = batch_size, shuffle = shuffle)
+
+def multihead_rows(single, double, slots, indices):
+    """
+    Inputs, labels and sample weights for the multi-head model. Indices below
+    len(single) are single-hand rows, the rest two-hand rows. A single hand goes in
+    its hand slot (`slots`) with the other left at zero (no hand) and only trains the
+    single-hand head for that slot; a pair of hands only trains the two-hand head.
+    """
+    indices = np.sort(indices)
+    single_index = indices[indices < len(single)]
+    double_index = indices[indices >= len(single)] - len(single)
+    n_single, n_double = len(single_index), len(double_index)
+    single_inputs, single_classes = single.rows(single_index)
+    double_inputs, double_classes = double.rows(double_index)
+    single_slots = slots[single_index]
+
+    hands = np.zeros((n_single, 2, HAND_SIZE), dtype=np.float32)
+    hands[np.arange(n_single), single_slots] = single_inputs
+    inputs = np.concatenate([hands.reshape(n_single, -1), double_inputs])
+    single_labels = np.zeros((n_single + n_double, 2), dtype=np.int16)
+    single_weights = np.zeros((n_single + n_double, 2), dtype=np.float32)
+    single_labels[np.arange(n_single), single_slots] = single_classes
+    single_weights[np.arange(n_single), single_slots] = 1.0
+    double_labels = np.concatenate([np.zeros(n_single), double_classes]).astype(np.int16)
+    double_weights = np.concatenate([np.zeros(n_single), np.ones(n_double)]).astype(np.float32)
+    return inputs, {SINGLE_HEAD: single_labels, DOUBLE_HEAD: double_labels}, {SINGLE_HEAD: single_weights, DOUBLE_HEAD: double_weights}
+
+def load_multihead_data(batch_size = BATCH_SIZE):
+    """Train and test batches for the multi-head model, drawn from both memory-mapped datasets."""
+    single, double = open_dataset(*dataset_paths(False)), open_dataset(*dataset_paths(True))
+    slots = np.random.default_rng(RANDOM_SEED).integers(0, 2, len(single)).astype(np.int8)
+    train_indices, test_indices = split_indices(len(single) + len(double), seed=RANDOM_SEED)
+    read_rows = lambda indices: multihead_rows(single, double, slots, indices)
+    signature = (
+        tf.TensorSpec(shape=(None, 2 * HAND_SIZE), dtype=tf.float32),
+        {SINGLE_HEAD: tf.TensorSpec(shape=(None, 2), dtype=tf.int16), DOUBLE_HEAD: tf.TensorSpec(shape=(None,), dtype=tf.int16)},
+        {SINGLE_HEAD: tf.TensorSpec(shape=(None, 2), dtype=tf.float32), DOUBLE_HEAD: tf.TensorSpec(shape=(None,), dtype=tf.float32)},
+    )
+    return (batch_stream(read_rows, train_indices, signature, batch_size = batch_size, shuffle = True),
+            batch_stream(read_rows, test_indices, signature, batch_size = batch_size))
 
 def build_model(input_size, hidden_size, output_size, num_layers, dropout_rate):
     inputs = tf.keras.layers.Input(shape=(input_size,))
@@ -45,13 +106,46 @@ def build_model(input_size, hidden_size, output_size, num_layers, dropout_rate):
     model = tf.keras.Model(inputs=inputs, outputs=outputs)
     return model
 
+def build_multihead_model(hidden_size, num_single, num_double, num_layers, dropout_rate):
+    """
+    One model for one- and two-hand gestures. The input holds two hands' landmarks
+    side by side (zeros for a missing hand). The encoder and residual blocks form a
+    trunk shared by both hands; the single-hand head classifies each hand against
+    SINGLE_GESTURES and the two-hand head both hands' trunk outputs together against
+    DOUBLE_GESTURES. Which answers count is gated by the number of hands found,
+    see detect_hand_position.multihead_gestures.
+    """
+    inputs = tf.keras.layers.Input(shape=(2 * HAND_SIZE,))
+    hands = tf.keras.layers.Reshape((2, HAND_SIZE))(inputs)
+
+    # Shared trunk, applied to each hand
+    x = tf.keras.layers.Dense(hidden_size)(hands)
+    for _ in range(num_layers):
+        residual_connection = x
+        x = tf.keras.layers.Dense(hidden_size)(x)
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.ReLU()(x)
+        x = tf.keras.layers.Dropout(rate=dropout_rate)(x)
+        x = tf.keras.layers.Add()([x, residual_connection])
+
+    single = tf.keras.layers.Dense(num_single, activation="softmax", name=SINGLE_HEAD)(x)
+    pair = tf.keras.layers.Flatten()(x)
+    pair = tf.keras.layers.Dense(hidden_size, activation="relu", name=PAIR_LAYER)(pair)
+    double = tf.keras.layers.Dense(num_double, activation="softmax", name=DOUBLE_HEAD)(pair)
+
+    return tf.keras.Model(inputs=inputs, outputs={SINGLE_HEAD: single, DOUBLE_HEAD: double})
+
 class WandbCallback(tf.keras.callbacks.Callback):
     def on_epoch_end(self, epoch, logs=None):
         if logs is not None:
             wandb.log({"epoch": epoch + 1, **logs})
 
-def train_gesture_recognizer(model, x_train, y_train, x_test, y_test, model_save_path, 
-                             batch_size = 256, num_epochs = 500):
+def train_gesture_recognizer(model, train_batches, test_batches, model_save_path, num_epochs = 500):
+    """
+    Train and checkpoint the model on streamed (inputs, labels[, sample weights])
+    batches. For a multi-head model, labels and sample weights are dicts keyed by
+    output name.
+    """
     # Clear previous session (helps avoid memory leaks)
     tf.keras.backend.clear_session()
 
@@ -76,19 +170,26 @@ def train_gesture_recognizer(model, x_train, y_train, x_test, y_test, model_save
     )
 
     # Compile the model
+    labels = train_batches.element_spec[1]
+    if isinstance(labels, dict):
+        loss = {name: "sparse_categorical_crossentropy" for name in labels}
+        # Keras applies sample weights to weighted_metrics only, so each head's accuracy
+        # skips the rows it is not trained on (weight 0), as its loss does
+        metrics, weighted_metrics = None, {name: ["accuracy"] for name in labels}
+    else:
+        loss, metrics, weighted_metrics = "sparse_categorical_crossentropy", ["accuracy"], None
     model.compile(
         optimizer="adam",
-        loss="sparse_categorical_crossentropy",
-        metrics=["accuracy"]
+        loss=loss,
+        metrics=metrics,
+        weighted_metrics=weighted_metrics
     )
 
     # Train the model and log metrics
     history = model.fit(
-        x_train,
-        y_train,
+        train_batches,
         epochs=num_epochs,
-        batch_size=batch_size,
-        validation_data=(x_test, y_test),
+        validation_data=test_batches,
         callbacks=[WandbMetricsLogger(), cp_callback, es_callback]
     )
 
@@ -98,10 +199,14 @@ def train_gesture_recognizer(model, x_train, y_train, x_test, y_test, model_save
     # Return history for further analysis
     return history
 
-def evaluate_gesture_recognizer(model, x_test, y_test):
-    loss, accuracy = model.evaluate(x_test, y_test, verbose=1)
+def evaluate_gesture_recognizer(model, test_batches):
+    loss, accuracy = model.evaluate(test_batches, verbose=1)
     return loss, accuracy
 
+def evaluate_multihead_recognizer(model, test_batches):
+    """Loss and per-head accuracy, each head scored only on the examples it is trained on."""
+    return model.evaluate(test_batches, verbose=1, return_dict=True)
+
 def export_model(model, tflite_save_path):
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
     converter.optimizations = [tf.lite.Optimize.DEFAULT]
@@ -115,11 +220,12 @@ def main(use_double=False):
     print(tf.config.list_physical_devices('GPU'))
     print("Num GPUs Available: ", len(tf.config.list_physical_devices('GPU')))
     
-    dataset_path = "../data/hand_keypoints_doubleTrue.csv" if use_double else "../data/hand_keypoints_doubleFalse.csv"
     model_dir = "../model/model_doubleTrue.keras" if use_double else "../model/model_doubleFalse.keras"
-    print(dataset_path)
-    # Load and preprocess data
-    x_train, x_test, y_train, y_test = load_data(dataset_path, double=use_double)
+    # Open the memory-mapped data and split it by row index
+    dataset, train_indices, test_indices = load_data(double=use_double)
+    print(f"{dataset.store_dir}: {len(train_indices)} train, {len(test_indices)} test rows")
+    train_batches = gesture_batches(dataset, train_indices, shuffle=True)
+    test_batches = gesture_batches(dataset, test_indices)
     
     # Model parameters
     input_size = 126 if use_double else 63
@@ -140,23 +246,53 @@ def main(use_double=False):
     # Train model
     history = train_gesture_recognizer(
         model=model,
-        x_train=x_train,
-        y_train=y_train,
-        x_test=x_test,
-        y_test=y_test,
+        train_batches=train_batches,
+        test_batches=test_batches,
         model_save_path=model_dir
     )
     
     # Evaluate model
-    loss, accuracy = evaluate_gesture_recognizer(model, x_test, y_test)
+    loss, accuracy = evaluate_gesture_recognizer(model, test_batches)
     print(f"\nFinal Test Loss: {loss:.4f}")
     print(f"Final Test Accuracy: {accuracy:.4f}")
 
     export_model(model, model_dir.replace(".keras", ".tflite"))
+    export_numpy_model(model, model_dir.replace(".keras", ".npz"))
+
+def main_multihead():
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "0"
+    print("Num GPUs Available: ", len(tf.config.list_physical_devices('GPU')))
+
+    model_dir = "../model/model_multihead.keras"
+    train_batches, test_batches = load_multihead_data()
+
+    model = build_multihead_model(
+        hidden_size=64,
+        num_single=len(SINGLE_GESTURES),
+        num_double=len(DOUBLE_GESTURES),
+        num_layers=3,
+        dropout_rate=0.1
+    )
+    train_gesture_recognizer(
+        model=model,
+        train_batches=train_batches,
+        test_batches=test_batches,
+        model_save_path=model_dir
+    )
+
+    results = evaluate_multihead_recognizer(model, test_batches)
+    print("\nFinal Test Results: " + ", ".join(f"{name} {value:.4f}" for name, value in results.items()))
+
+    export_model(model, model_dir.replace(".keras", ".tflite"))
+    export_numpy_model(model, model_dir.replace(".keras", ".npz"))
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Train gesture recognizer")
     parser.add_argument('--use_double', action='store_true', help="Use double dataset")
+    parser.add_argument('--multihead', action='store_true', help="Train one model for one- and two-hand gestures on both datasets")
     args = parser.parse_args()
-    main(use_double=args.use_double)
\ No newline at end of file
+    if args.multihead:
+        main_multihead()
+    else:
+        main(use_double=args.use_double)
\ No newline at end of file
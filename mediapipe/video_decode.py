@@ -0,0 +1,92 @@
+"""
+In-memory decoding of uploaded video segments.
+
+OpenCV 4.10+ can read a container straight from a Python stream with
+`cv2.VideoCapture(stream, apiPreference, params)`, so the segment bytes are
+wrapped in a BytesIO and never touch the disk. Builds or backends that cannot
+read streams get a per-call anonymous file instead: a memfd on Linux, opened
+through its /proc/self/fd path, and a private temporary file elsewhere. Either
+way concurrent calls never share a path.
+"""
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+import cv2
+
+
+def _open_stream(stream):
+    try:
+        # Only FFmpeg reads from streams; CAP_ANY also tries backends that fail on them
+        cap = cv2.VideoCapture(stream, cv2.CAP_FFMPEG, [])
+    except (cv2.error, TypeError, SystemError):
+        # No stream support in this OpenCV build
+        return None
+    if cap.isOpened():
+        return cap
+    cap.release()
+    return None
+
+
+@contextmanager
+def anonymous_file(octet_stream, suffix=".mp4"):
+    """Path of a file holding `octet_stream` that only this call can see, removed afterwards."""
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("segment")
+        path = f"/proc/self/fd/{fd}"
+    else:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb", closefd=False) as f:
+            f.write(octet_stream)
+        yield path
+    finally:
+        os.close(fd)
+        if not path.startswith("/proc/self/fd/"):
+            os.remove(path)
+
+
+@contextmanager
+def open_video(octet_stream):
+    """A `cv2.VideoCapture` reading the encoded video in `octet_stream`, released afterwards."""
+    # The capture does not keep its stream alive, so hold it until the capture is released
+    stream = io.BytesIO(octet_stream)
+    cap = _open_stream(stream)
+    if cap is not None:
+        try:
+            yield cap
+        finally:
+            cap.release()
+        return
+
+    with anonymous_file(octet_stream) as path:
+        cap = cv2.VideoCapture(path)
+        try:
+            yield cap
+        finally:
+            cap.release()
+
+
+def frame_count(cap):
+    """Number of frames the container reports, or None when it does not know."""
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return count if count > 0 else None
+
+
+def sampled_frames(cap, stride=1):
+    """Yield every `stride`-th BGR frame of `cap`; skipped frames are grabbed but never converted."""
+    index = 0
+    while cap.grab():
+        if index % stride == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            yield frame
+        index += 1
+
+
+def read_frames(octet_stream, stride=1):
+    """Yield every `stride`-th decoded BGR frame of the encoded video in `octet_stream`."""
+    with open_video(octet_stream) as cap:
+        yield from sampled_frames(cap, stride)
@@ -0,0 +1,94 @@
+"""
+Streaming majority votes over per-frame gesture predictions.
+
+A segment's gesture is the class predicted for most of its frames, with frames
+where no hand (or no confident prediction) was found voting for 'none'. Votes
+are counted as frames are classified, and a `StoppingRule` decides when the
+answer is settled so the rest of the segment need not be decoded:
+
+- always, once the leader cannot be caught by the frames left to sample (only
+  when the container reports its frame count, and exact: the full vote agrees);
+- with `confidence`, once a one-sided Wilson lower bound on the leader's share
+  of the leader and runner-up votes exceeds one half;
+- with `margin`, once the leader is that many votes ahead of the runner-up.
+"""
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class StoppingRule:
+    min_frames: int = 8
+    confidence: Optional[float] = 0.95
+    margin: Optional[int] = None
+
+
+# Only stop once the remaining frames cannot change the majority
+EXACT_VOTE = StoppingRule(min_frames=1, confidence=None, margin=None)
+DEFAULT_STOPPING_RULE = StoppingRule()
+REPORT_CONFIDENCE = 0.95
+
+
+@dataclass
+class GestureDecision:
+    left: str
+    right: str
+    frames_used: int
+    frames_total: Optional[int]
+    confidence: float
+    # Two-hand gesture, when decided together with the single-hand ones by the multi-head model.
+    # Its head has no 'none' class, so only trust it when a two-hand gesture is expected.
+    double: Optional[str] = None
+
+
+def wilson_lower_bound(successes: int, trials: int, z: float) -> float:
+    if trials == 0:
+        return 0.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = p + z * z / (2 * trials)
+    spread = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials))
+    return (centre - spread) / denominator
+
+
+class GestureVote:
+    """Vote counts over the classes of one model, plus 'none' as the last class."""
+
+    def __init__(self, num_classes: int):
+        self.counts = np.zeros(num_classes, dtype=np.int64)
+
+    def add(self, gesture: Optional[int]):
+        self.counts[-1 if gesture is None else gesture] += 1
+
+    def leader(self) -> int:
+        # Ties go to the lowest class index, like list.index(max(counts))
+        return int(np.argmax(self.counts))
+
+    def lead(self):
+        """Votes of the leader and of the runner-up."""
+        top = np.sort(self.counts)[::-1]
+        return int(top[0]), int(top[1])
+
+    def confidence(self, z: float) -> float:
+        first, second = self.lead()
+        return wilson_lower_bound(first, first + second, z)
+
+    def settled(self, rule: StoppingRule, frames_used: int, frames_left: Optional[int]) -> bool:
+        first, second = self.lead()
+        if frames_left is not None and first > second + frames_left:
+            return True
+        if frames_used < rule.min_frames:
+            return False
+        if rule.margin is not None and first - second >= rule.margin:
+            return True
+        if rule.confidence is not None:
+            return self.confidence(NormalDist().inv_cdf(rule.confidence)) > 0.5
+        return False
+
+
+def report_z(rule: StoppingRule) -> float:
+    return NormalDist().inv_cdf(rule.confidence if rule.confidence is not None else REPORT_CONFIDENCE)
@@ -0,0 +1,140 @@
+"""
+Pool of pre-initialised gesture workers for serving many players at once.
+
+A MediaPipe `Hands` graph and a `tf.lite.Interpreter` both carry state between
+calls and are not safe to share across threads, and building them costs far more
+than a classification. The pool builds `size` (Hands, classifier) pairs per model
+kind (single- and double-hand) up front; a request checks one out, classifies
+its segment and returns it, so concurrent requests run in parallel up to the pool
+size and queue beyond it. MediaPipe and the TFLite interpreter release the GIL
+while they run, so threads scale with cores. Time spent waiting for a worker is
+recorded per kind.
+
+Usage: python worker_pool.py [--requests 32] [--threads 8] [--size N] [--use_double]
+"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mediapipe as mp
+
+from detect_hand_position import decide_hand_position, model_path, setup_model
+
+
+class GestureWorker:
+    def __init__(self, use_double):
+        self.use_double = use_double
+        self.hands = mp.solutions.hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5)
+        self.interpreter, self.input_details, self.output_details = setup_model(model_path(use_double))
+
+    def reset(self):
+        # Drop hand tracking state, so the next segment starts with full-frame detection
+        if hasattr(self.hands, "reset"):
+            self.hands.reset()
+
+    def decide(self, octet_stream, **kwargs):
+        return decide_hand_position(octet_stream, self.hands, self.interpreter, self.input_details,
+                                    self.output_details, use_double = self.use_double, **kwargs)
+
+
+class WaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+
+    def as_dict(self):
+        return {
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "mean_wait_ms": round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 3),
+        }
+
+
+class GestureWorkerPool:
+    """Checkout/return pool of gesture workers for the single- and double-hand models."""
+
+    def __init__(self, size=None, kinds=(False, True)):
+        self.size = size or os.cpu_count() or 1
+        self._workers = {use_double: queue.Queue() for use_double in kinds}
+        self._stats = {use_double: WaitStats() for use_double in kinds}
+        self._lock = threading.Lock()
+        for use_double, workers in self._workers.items():
+            for _ in range(self.size):
+                workers.put(GestureWorker(use_double))
+
+    @contextmanager
+    def checkout(self, use_double=False, timeout=None):
+        """
+        A worker for the given model kind, returned to the pool afterwards. Blocks while
+        all are busy; raises queue.Empty if none frees up within `timeout` seconds.
+        """
+        if use_double not in self._workers:
+            raise ValueError(f"Pool has no {'double' if use_double else 'single'}-hand workers")
+        start = time.perf_counter()
+        worker = self._workers[use_double].get(timeout=timeout)
+        wait = time.perf_counter() - start
+        stats = self._stats[use_double]
+        with self._lock:
+            stats.checkouts += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            stats.in_use += 1
+        try:
+            yield worker
+        finally:
+            worker.reset()
+            with self._lock:
+                stats.in_use -= 1
+            self._workers[use_double].put(worker)
+
+    def decide_hand_position(self, octet_stream, use_double=False, timeout=None, **kwargs):
+        """`detect_hand_position.decide_hand_position` on a pooled worker."""
+        with self.checkout(use_double, timeout=timeout) as worker:
+            return worker.decide(octet_stream, **kwargs)
+
+    def check_hand_position(self, octet_stream, use_double=False, timeout=None, **kwargs):
+        decision = self.decide_hand_position(octet_stream, use_double=use_double, timeout=timeout, **kwargs)
+        return decision.left, decision.right
+
+    def stats(self):
+        with self._lock:
+            return {"double" if use_double else "single": stats.as_dict() for use_double, stats in self._stats.items()}
+
+
+def main():
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Classify a segment concurrently through a gesture worker pool")
+    parser.add_argument("--bin_file", default="test_double.bin")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--size", type=int, default=None, help="workers per model kind (default: CPU count)")
+    parser.add_argument('--use_double', action='store_true', help="detect hand gestures that involve both hands")
+    args = parser.parse_args()
+
+    with open(args.bin_file, "rb") as f:
+        octet_stream = f.read()
+
+    start = time.perf_counter()
+    pool = GestureWorkerPool(size=args.size, kinds=(args.use_double,))
+    print(f"Started {pool.size} workers in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(
+            lambda _: pool.check_hand_position(octet_stream, use_double=args.use_double, use_cache=False),
+            range(args.requests)
+        ))
+    elapsed = time.perf_counter() - start
+    print(f"{args.requests} segments in {elapsed:.2f} s ({args.requests / elapsed:.1f}/s): {results[0]}")
+    print(pool.stats())
+
+
+if __name__ == "__main__":
+    main()